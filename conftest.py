@@ -0,0 +1,9 @@
+"""テスト共通: 各ディレクトリで起動したときと同じく、server/・frontend/・shared/ のモジュールを直接 import できるようにする"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 同名のモジュール（pdf_raster）はサーバー側を優先
+for name in ("frontend", "server", "shared"):
+    sys.path.insert(0, os.path.join(ROOT, name))
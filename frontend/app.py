@@ -4,7 +4,7 @@ import step1_upload, step2_classify, step3_wizard, step4_ocr
 
 if "pages" not in st.session_state:
     st.session_state.update({
-        "pages": [], "templates": {}, "ocr_results": [], "step_idx": 0,
+        "pages": [], "pdf_bytes": None, "templates": {}, "style_links": {}, "ocr_results": [], "step_idx": 0,
         "wiz_style_idx": 0, "wiz_field_idx": 0
     })
 
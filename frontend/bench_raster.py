@@ -0,0 +1,117 @@
+"""
+PDF読込（ページ描画 + フィンガープリント計算）のワーカー数ごとの速度を比較するベンチマーク
+
+ステップ1と同じく、描けたページ範囲から順にフィンガープリントを計算するまでの時間を測る。
+ワーカー1（プロセスを使わない描画）の結果を基準に、画像が一致することも確認する。
+PDFを指定しなければ、スキャン画像を貼った合成PDFを作って使う。
+
+使い方（フロントエンドと同じ環境で実行）:
+    python bench_raster.py receipts.pdf --workers 1 2 4
+    python bench_raster.py --pages 100 --workers 1 2 4 8 --json raster.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from page_store import PageStore
+from pdf_raster import PdfRasterizer
+from utils import layout_fingerprints
+
+
+def synthetic_pdf(num_pages: int, seed: int = 0) -> bytes:
+    """罫線と文字を描いた画像をA4ページに貼ったPDF（スキャンした領収書の代わり）"""
+    import fitz
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for i in range(num_pages):
+        img = np.full((1754, 1240), 255, np.uint8)  # A4 150DPI
+        for row in range(int(rng.integers(8, 20))):
+            y = 120 + row * 70
+            cv2.rectangle(img, (80, y), (80 + int(rng.integers(400, 1000)), y + 50), 0, 2)
+            cv2.putText(img, f"{i}-{row} {int(rng.integers(10 ** 6))}", (100, y + 35),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2)
+        img = np.clip(img.astype(np.int16) + rng.integers(-20, 20, img.shape), 0, 255).astype(np.uint8)
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=cv2.imencode(".png", img)[1].tobytes())
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def load(rasterizer: PdfRasterizer, pdf_bytes: bytes, dpi: int):
+    """ステップ1と同じ読込を1回行い、(秒数, ハンドル, フィンガープリント, ストア) を返す"""
+    store = PageStore(budget_bytes=0)
+    start = time.perf_counter()
+    handles, fps = [], []
+    for chunk in rasterizer.render(pdf_bytes, store, dpi):
+        handles += chunk
+        fps += layout_fingerprints([h.array() for h in chunk])
+    return time.perf_counter() - start, handles, fps, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="ベンチマークに使うPDF（省略時は合成PDF）")
+    parser.add_argument("--pages", type=int, default=40, help="合成PDFのページ数")
+    parser.add_argument("--dpi", type=int, default=300, help="ページの描画DPI（ステップ1と同じ）")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="比較するワーカー数")
+    parser.add_argument("--repeat", type=int, default=3, help="ワーカー数ごとの計測回数（中央値を使う）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes = f.read()
+    else:
+        pdf_bytes = synthetic_pdf(args.pages)
+
+    print(f"cpus={os.cpu_count()} dpi={args.dpi}")
+    results = []
+    baseline = None
+    baseline_seconds = None
+    for workers in sorted(set([1] + args.workers)):
+        rasterizer = PdfRasterizer(workers)
+        # プロセスの起動（spawn）は1回目の読込に含めず、別に測る
+        start = time.perf_counter()
+        if workers > 1:
+            rasterizer.start()
+        startup = time.perf_counter() - start
+        seconds, identical = [], True
+        for _ in range(args.repeat):
+            elapsed, handles, fps, store = load(rasterizer, pdf_bytes, args.dpi)
+            seconds.append(elapsed)
+            if baseline is None:
+                baseline = fps
+            identical &= all(np.array_equal(a, b) for a, b in zip(baseline, fps)) and len(fps) == len(baseline)
+            store.close()
+        rasterizer.stop()
+        median = statistics.median(seconds)
+        if baseline_seconds is None:
+            baseline_seconds = median
+        result = {
+            "workers": workers,
+            "pages": len(baseline),
+            "startup_s": round(startup, 3),
+            "median_s": round(median, 3),
+            "pages_per_s": round(len(baseline) / median, 2),
+            "speedup": round(baseline_seconds / median, 2),
+            "identical": identical,
+        }
+        results.append(result)
+        print(
+            f"workers={workers:<3} {result['median_s']:8.3f}s  {result['pages_per_s']:7.2f} pages/s  "
+            f"x{result['speedup']:<5} startup {result['startup_s']:.2f}s  identical={identical}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
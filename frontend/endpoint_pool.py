@@ -0,0 +1,179 @@
+"""OCRサーバー群の振り分け: 未完了リクエスト数と /health の待ち行列で選び、障害ノードを一時的に外す"""
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+
+
+class NoEndpointAvailable(Exception):
+    """送信先に使えるOCRサーバーが残っていない"""
+
+
+class Endpoint:
+    """1台のOCRサーバーとこのクライアントから見た状態"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0  # このクライアントからの未完了リクエスト数
+        # 直近の /health（queue_size + running）と、その時点の自分の未完了数
+        self.server_load = 0
+        self.outstanding_at_probe = 0
+        self.max_concurrent = 1
+        self.max_pdf_pages: Optional[int] = None  # /ocr/pdf の1リクエストあたりのページ数上限
+        self.health_at: Optional[float] = None
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until is not None
+
+    def load(self) -> float:
+        """推論枠あたりの見込み負荷（他クライアント分は直近の /health から推定）"""
+        others = max(0, self.server_load - self.outstanding_at_probe)
+        return (others + self.outstanding) / max(1, self.max_concurrent)
+
+    def status(self) -> dict:
+        return {
+            "url": self.url,
+            "state": "ejected" if self.ejected else "healthy",
+            "outstanding": self.outstanding,
+            "server_load": self.server_load,
+            "max_concurrent": self.max_concurrent,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+class EndpointPool:
+    """
+    複数のOCRサーバーへの振り分け
+
+    acquire() は外されていないノードのうち見込み負荷（未完了リクエスト数 + 他クライアントの
+    待ち行列、推論枠あたり）が最小のものを選ぶ。接続できない・5xxが続くノードは
+    指数バックオフの間だけ外し、バックグラウンドで /health を再確認して戻す。
+    全ノードが外れている場合は、戻る予定が最も早いノードを使う（全停止より試す方がよい）。
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        health_interval: float = 5.0,
+        eject_after: int = 3,
+        eject_base: float = 5.0,
+        eject_max: float = 60.0,
+    ):
+        if not urls:
+            raise ValueError("At least one OCR server URL is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self.eject_after = eject_after
+        self.eject_base = eject_base
+        self.eject_max = eject_max
+        self._lock = threading.Lock()
+        self._prober: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def healthy(self) -> list[Endpoint]:
+        return [e for e in self.endpoints if not e.ejected]
+
+    def acquire(self, exclude: Optional[set] = None) -> Endpoint:
+        """送信先を選び、未完了数に数える（終わったら release する）"""
+        self._start_prober()
+        exclude = exclude or set()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.url not in exclude]
+            if not candidates:
+                raise NoEndpointAvailable("All OCR servers have been tried")
+            healthy = [e for e in candidates if not e.ejected]
+            if healthy:
+                best = min(e.load() for e in healthy)
+                endpoint = random.choice([e for e in healthy if e.load() == best])
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def report_success(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.ejections = 0
+            endpoint.ejected_until = None
+
+    def report_failure(self, endpoint: Endpoint, error: str, hard: bool = False, retry_after: Optional[float] = None):
+        """
+        失敗を記録し、必要ならノードを外す
+
+        hard（接続できない）なら即座に、それ以外は eject_after 回続いたら外す。
+        retry_after（429の Retry-After）があればその間だけ外す。
+        """
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.last_error = error
+            if retry_after is not None:
+                endpoint.ejected_until = time.monotonic() + retry_after
+            elif hard or endpoint.failures >= self.eject_after:
+                endpoint.ejections += 1
+                backoff = min(self.eject_max, self.eject_base * 2 ** (endpoint.ejections - 1))
+                endpoint.ejected_until = time.monotonic() + backoff
+
+    def update_health(self, endpoint: Endpoint, health: dict):
+        """/health の応答を反映"""
+        with self._lock:
+            endpoint.server_load = health.get("queue_size", 0) + health.get("running", 0)
+            endpoint.outstanding_at_probe = endpoint.outstanding
+            endpoint.max_concurrent = max(1, health.get("max_concurrent", 1))
+            endpoint.max_pdf_pages = health.get("max_pdf_pages") or endpoint.max_pdf_pages
+            endpoint.health_at = time.monotonic()
+
+    def probe(self, endpoint: Endpoint, timeout: float = 5) -> dict:
+        """/health を確認し、外していたノードなら戻す"""
+        try:
+            response = requests.get(f"{endpoint.url}/health", timeout=timeout)
+            response.raise_for_status()
+            health = response.json()
+        except (requests.RequestException, ValueError) as e:
+            # 外していたノードは次の確認まで外したまま（バックオフを延ばす）
+            self.report_failure(endpoint, f"{type(e).__name__}: {e}", hard=True)
+            raise
+        self.update_health(endpoint, health)
+        with self._lock:
+            if endpoint.ejected:
+                endpoint.ejected_until = None
+                endpoint.failures = 0
+        return health
+
+    def status(self) -> list[dict]:
+        return [e.status() for e in self.endpoints]
+
+    def _start_prober(self):
+        """複数ノードのときだけ、待ち行列の更新と外したノードの再確認を定期的に行う"""
+        if len(self.endpoints) < 2 or self._prober is not None:
+            return
+        with self._lock:
+            if self._prober is not None:
+                return
+            self._prober = threading.Thread(target=self._probe_loop, daemon=True, name="ocr-endpoint-prober")
+            self._prober.start()
+
+    def _probe_loop(self):
+        while True:
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                if endpoint.ejected and now < endpoint.ejected_until:
+                    continue
+                try:
+                    self.probe(endpoint, timeout=min(5, self.health_interval))
+                except (requests.RequestException, ValueError):
+                    pass
+            time.sleep(self.health_interval)
@@ -1,49 +1,686 @@
-"""OCRサーバークライアント: HTTP API経由でOCRを実行"""
-import base64
+"""OCRサーバークライアント: HTTP API経由でOCRを実行（複数サーバーへの振り分けに対応）"""
+import json
+import math
 import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterator, Optional
 import cv2
 import numpy as np
 import requests
 
+import wire_format
+from endpoint_pool import Endpoint, EndpointPool, NoEndpointAvailable
+
+# OCRサーバーのURL（カンマ区切りで複数指定すると負荷の低いサーバーへ振り分ける）
 OCR_SERVER_URL = os.environ.get("OCR_SERVER_URL", "http://localhost:8000")
+# 別のサーバーでやり直す回数（接続失敗・429・5xx）と、遅いサーバーへの重複送信までの秒数（0で無効）
+OCR_CLIENT_RETRIES = int(os.environ.get("OCR_CLIENT_RETRIES", "2"))
+OCR_HEDGE_AFTER_SEC = float(os.environ.get("OCR_HEDGE_AFTER_SEC", "0"))
+# 複数サーバー時の /health 確認間隔（待ち行列の更新・外したサーバーの再確認）
+OCR_HEALTH_INTERVAL_SEC = float(os.environ.get("OCR_HEALTH_INTERVAL_SEC", "5"))
+# /ocr/stream で1回に送るページ数（送る直前にPNGにするので、メモリに載るのはこの枚数分だけ）
+OCR_STREAM_CHUNK_PAGES = int(os.environ.get("OCR_STREAM_CHUNK_PAGES", "32"))
+# サーバーに伝える期限はタイムアウトより少し短くする（応答を受け取る余裕）
+DEADLINE_MARGIN_SEC = 5
+# 別のサーバーでやり直す応答（429: 満杯、5xx: 障害。504は期限切れなのでやり直さない）
+RETRY_STATUSES = {429, 500, 502, 503}
+# 複数サーバーに分けるとき、1サーバーあたりの分割数（速いサーバーが多く処理できるよう細かめに分ける）
+CHUNKS_PER_ENDPOINT = 2
+# /health でページ数上限が分からないサーバーに /ocr/pdf で1回に送るページ数（サーバーの既定値）
+PDF_MAX_PAGES_DEFAULT = 500
+
+
+class RetryableResponse(Exception):
+    """別のサーバーでやり直すべき応答"""
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code} from {response.url}")
+        self.response = response
 
 
 class OCRClient:
-    """OCRサーバーへのHTTPクライアント"""
+    """
+    OCRサーバーへのHTTPクライアント
     
-    def __init__(self, base_url: str = None):
-        self.base_url = base_url or OCR_SERVER_URL
+    複数のサーバーを指定すると、リクエストごとに見込み負荷の最も低いサーバーへ送る
+    （EndpointPool）。OCRは同じ画像なら何度実行しても同じ結果なので、接続失敗・429・5xx
+    のときは別のサーバーでやり直す。ストリーミングでは複数ページを分割して全サーバーで
+    並行に処理し、途中で切れたサーバーの残りのページは別のサーバーに送り直す。
+    """
+    
+    def __init__(
+        self,
+        base_url: str = None,
+        compact: Optional[bool] = None,
+        retries: Optional[int] = None,
+        hedge_after: Optional[float] = None,
+    ):
+        """
+        Args:
+            base_url: OCRサーバーのURL（カンマ区切りまたはリストで複数指定可）
+            compact: Trueの場合wordsを列指向のmsgpackで受け取る（既定はmsgpackが使えれば有効）
+            retries: 別のサーバーでやり直す回数（既定は OCR_CLIENT_RETRIES）
+            hedge_after: この秒数で応答がなければ別のサーバーにも同じリクエストを送り、
+                先に返った方を使う（0で無効、既定は OCR_HEDGE_AFTER_SEC）
+        """
+        urls = base_url or OCR_SERVER_URL
+        if isinstance(urls, str):
+            urls = [u.strip() for u in urls.split(",") if u.strip()]
+        self.pool = EndpointPool(urls, health_interval=OCR_HEALTH_INTERVAL_SEC)
+        self.base_url = self.pool.endpoints[0].url
+        self.compact = wire_format.msgpack is not None if compact is None else compact
+        self.retries = OCR_CLIENT_RETRIES if retries is None else retries
+        self.hedge_after = OCR_HEDGE_AFTER_SEC if hedge_after is None else hedge_after
+        self._hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ocr-hedge")
+        # ジョブIDと登録先サーバー（ジョブはそのサーバーにしかない）
+        self._job_endpoints: dict[str, str] = {}
     
     def health_check(self) -> dict:
-        """サーバーの稼働状態を確認"""
-        response = requests.get(f"{self.base_url}/health", timeout=5)
-        response.raise_for_status()
-        return response.json()
+        """
+        サーバーの稼働状態を確認
+        
+        複数サーバーの場合は全体の合計（queue_size・running・max_concurrent）と
+        サーバーごとの状態（endpoints）を返す。1台も応答しなければ例外。
+        """
+        if len(self.pool) == 1:
+            return self.pool.probe(self.pool.endpoints[0])
+        healths = []
+        errors = []
+        for endpoint in self.pool.endpoints:
+            try:
+                healths.append(self.pool.probe(endpoint))
+            except (requests.RequestException, ValueError) as e:
+                errors.append(e)
+        if not healths:
+            raise errors[0]
+        return {
+            "status": "healthy" if not errors else "degraded",
+            "gpu_available": any(h.get("gpu_available") for h in healths),
+            "queue_size": sum(h.get("queue_size", 0) for h in healths),
+            "running": sum(h.get("running", 0) for h in healths),
+            "max_concurrent": sum(h.get("max_concurrent", 0) for h in healths),
+            "endpoints": self.pool.status(),
+        }
     
-    def run_ocr(self, img_bgr: np.ndarray) -> list:
+    def run_ocr(self, img_bgr: np.ndarray, use_cache: bool = True, as_arrays: bool = False):
         """
         画像に対してOCRを実行
         
         Args:
             img_bgr: OpenCV BGR形式の画像 (numpy array)
+            use_cache: Falseの場合サーバー側のOCR結果キャッシュを使わない
+            as_arrays: Trueの場合dictのリストではなく WordArrays（NumPy配列）で返す
             
         Returns:
-            words_data: OCR結果のwordsリスト
+            words_data: OCR結果のwordsリスト（as_arrays=True なら WordArrays）
         """
-        # 画像をBase64エンコード
-        _, buffer = cv2.imencode('.png', img_bgr)
-        image_base64 = base64.b64encode(buffer).decode('utf-8')
+        return self.run_ocr_batch([img_bgr], use_cache=use_cache, as_arrays=as_arrays)[0]
+    
+    def run_ocr_batch(self, images: list[np.ndarray], use_cache: bool = True, as_arrays: bool = False) -> list:
+        """
+        複数画像をまとめて1リクエストでOCR
+        
+        PNGバイナリを multipart/form-data でそのまま送信する（Base64/JSONを経由しない）。
+        
+        Args:
+            images: OpenCV BGR形式の画像リスト
+            use_cache: Falseの場合サーバー側のOCR結果キャッシュを使わない
+            as_arrays: Trueの場合各画像の結果を WordArrays（NumPy配列）で返す
+            
+        Returns:
+            各画像のwordsリスト（入力順）
+        """
+        files = []
+        for i, img_bgr in enumerate(images):
+            _, buffer = cv2.imencode('.png', img_bgr)
+            files.append(("files", (f"page_{i}.png", buffer.tobytes(), "image/png")))
         
         # OCRサーバーにリクエスト
-        response = requests.post(
-            f"{self.base_url}/ocr",
-            json={"image_base64": image_base64},
-            timeout=120  # OCRは時間がかかる場合がある
+        response = self._request(
+            "POST", "/ocr/upload",
+            hedge=True,
+            files=files,
+            headers={
+                **self._cache_headers(use_cache),
+                **self._deadline_headers(120 * max(len(images), 1)),
+                **self._format_headers(),
+            },
+            timeout=120 * max(len(images), 1)  # OCRは時間がかかる場合がある
         )
         response.raise_for_status()
         
-        result = response.json()
-        return result.get("words", [])
+        result = self._decode(response, as_arrays)
+        return [r.get("words", []) for r in result.get("results", [])]
+    
+    def run_ocr_extract(
+        self,
+        img_bgr: np.ndarray,
+        template: dict,
+        roi_only: bool = False,
+        use_cache: bool = True,
+    ) -> dict:
+        """
+        OCRとROI抽出をサーバー側で一度に実行し、各ラベルのテキストだけを取得
+        
+        Args:
+            img_bgr: OpenCV BGR形式の画像 (numpy array)
+            template: {"label": {"x", "y", "w", "h"}, ...}（ページ座標）
+            roi_only: Trueの場合テンプレート領域の周辺だけをOCRする（高速）
+            use_cache: Falseの場合サーバー側のOCR結果キャッシュを使わない
+            
+        Returns:
+            extractions: {"label": "extracted_text", ...}
+        """
+        rois = [{"label": label, **coords} for label, coords in template.items()]
+        _, buffer = cv2.imencode('.png', img_bgr)
+        
+        response = self._request(
+            "POST", "/ocr/extract",
+            hedge=True,
+            files={"file": ("page.png", buffer.tobytes(), "image/png")},
+            data={
+                "rois": json.dumps(rois, ensure_ascii=False),
+                "roi_only": str(roi_only).lower(),
+            },
+            headers={**self._cache_headers(use_cache), **self._deadline_headers(120), **self._format_headers()},
+            timeout=120
+        )
+        response.raise_for_status()
+        
+        result = self._decode(response)
+        return result.get("extractions", {})
+    
+    def run_ocr_roi(self, img_bgr: np.ndarray, template: dict, use_cache: bool = True) -> dict:
+        """テンプレート領域の周辺だけをOCRして各ラベルのテキストを取得"""
+        return self.run_ocr_extract(img_bgr, template, roi_only=True, use_cache=use_cache)
+    
+    def stream_ocr(
+        self,
+        pages: list[tuple[int, "np.ndarray | Callable[[], np.ndarray]", Optional[dict]]],
+        roi_only: bool = False,
+        use_cache: bool = True,
+    ) -> Iterator[dict]:
+        """
+        複数ページをまとめて送り、1ページ終わるごとに結果を受け取る
+        
+        画像は送る直前に読み込んでPNGにする（OCR_STREAM_CHUNK_PAGES ページずつ送る）。
+        
+        Args:
+            pages: [(ページ番号, BGR画像 または 画像を返す関数, テンプレート {"label": {"x","y","w","h"}} または None), ...]
+            roi_only: Trueの場合テンプレート領域の周辺だけをOCRする
+            use_cache: Falseの場合サーバー側のOCR結果キャッシュを使わない
+            
+        Yields:
+            {"page": ページ番号, "status": "completed", "extractions": {...}} または
+            {"page": ページ番号, "status": "error", "error": "..."}（完了順）
+            テンプレートがNoneのページは extractions の代わりに words を返す
+        """
+        images = {}
+        templates = {}
+        for page_id, image, template in pages:
+            images[page_id] = image
+            templates[page_id] = self._rois(template)
+        
+        def encode(page_id) -> bytes:
+            image = images[page_id]
+            _, buffer = cv2.imencode('.png', image() if callable(image) else image)
+            return buffer.tobytes()
+        
+        def open_stream(endpoint: Endpoint, page_ids: list) -> Iterator[dict]:
+            response = self._post_stream(
+                endpoint, "/ocr/stream",
+                files=[("files", (f"page_{i}.png", encode(i), "image/png")) for i in page_ids],
+                data={
+                    "page_ids": json.dumps(page_ids),
+                    "templates": json.dumps([templates[i] for i in page_ids], ensure_ascii=False),
+                    "roi_only": str(roi_only).lower(),
+                },
+                headers=self._cache_headers(use_cache),
+            )
+            return self._iter_stream(response)
+        
+        yield from self._stream_pages(open_stream, list(images), max_chunk=OCR_STREAM_CHUNK_PAGES)
+    
+    def stream_ocr_pdf(
+        self,
+        pdf_bytes: bytes,
+        templates: list[Optional[dict]],
+        dpi: int = 300,
+        roi_only: bool = False,
+        use_cache: bool = True,
+    ) -> Iterator[dict]:
+        """
+        PDFをそのまま送り、サーバー側で画像化・OCRした結果を1ページずつ受け取る
+        
+        ページ画像（PNG）を送るより転送量がずっと小さい。
+        
+        Args:
+            pdf_bytes: PDFファイルの内容
+            templates: ページ順のテンプレート {"label": {"x","y","w","h"}}（Noneのページはwordsを返す）
+            dpi: サーバー側の描画解像度（テンプレート座標を指定した画像と揃える）
+            roi_only: Trueの場合テンプレート領域の周辺だけをOCRする
+            use_cache: Falseの場合サーバー側のOCR結果キャッシュを使わない
+            
+        Yields:
+            {"page": 1始まりのページ番号, "width", "height", "status": "completed", "extractions": {...}}
+            または {"page": ..., "status": "error", "error": "..."}（完了順）
+        
+        複数サーバーの場合、またはサーバーの1リクエストあたりのページ数上限（/health の
+        max_pdf_pages）を超える場合は、ページを分けた小さなPDFにして送る。
+        """
+        def open_stream(endpoint: Endpoint, page_nums: list) -> Iterator[dict]:
+            if page_nums == list(range(1, len(templates) + 1)):
+                body = pdf_bytes
+            else:
+                body = self._select_pages(pdf_bytes, page_nums)
+            response = self._post_stream(
+                endpoint, "/ocr/pdf",
+                files={"file": ("document.pdf", body, "application/pdf")},
+                data={
+                    "dpi": str(dpi),
+                    "templates": json.dumps([self._rois(templates[p - 1]) for p in page_nums], ensure_ascii=False),
+                    "roi_only": str(roi_only).lower(),
+                },
+                headers=self._cache_headers(use_cache),
+            )
+            # 分割したPDF内のページ番号を元のページ番号に戻す
+            for item in self._iter_stream(response):
+                if isinstance(item.get("page"), int) and 1 <= item["page"] <= len(page_nums):
+                    item["page"] = page_nums[item["page"] - 1]
+                yield item
+        
+        yield from self._stream_pages(
+            open_stream, list(range(1, len(templates) + 1)), max_chunk=self._pdf_page_limit(),
+        )
+    
+    def _pdf_page_limit(self) -> int:
+        """/ocr/pdf に1回で送れるページ数（全サーバーの上限の最小値。未確認のサーバーは /health を確認する）"""
+        for endpoint in self.pool.endpoints:
+            if endpoint.health_at is None:
+                try:
+                    self.pool.probe(endpoint)
+                except (requests.RequestException, ValueError):
+                    pass
+        limits = [e.max_pdf_pages for e in self.pool.endpoints if e.max_pdf_pages]
+        return min(limits) if limits else PDF_MAX_PAGES_DEFAULT
+    
+    @staticmethod
+    def _select_pages(pdf_bytes: bytes, page_nums: list[int]) -> bytes:
+        """指定ページ（1始まり）だけのPDFを作る"""
+        import fitz
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            doc.select([p - 1 for p in page_nums])
+            return doc.tobytes(garbage=1)
+    
+    @staticmethod
+    def _rois(template: Optional[dict]) -> Optional[list]:
+        """{"label": {"x","y","w","h"}} をサーバーのROI配列形式に変換"""
+        if template is None:
+            return None
+        return [{"label": label, **coords} for label, coords in template.items()]
+    
+    @staticmethod
+    def _iter_stream(response) -> Iterator[dict]:
+        """NDJSONレスポンスを1行ずつdictにして返す（終端行は返さない）"""
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item.get("status") == "done":
+                    break
+                yield item
+    
+    def _request(
+        self, method: str, path: str, hedge: bool = False, endpoint_url: Optional[str] = None,
+        idempotent: bool = True, **kwargs,
+    ):
+        """
+        サーバーを選んでリクエストを送る（接続失敗・429・5xxなら別のサーバーでやり直す）
+        
+        hedge=True かつ hedge_after が設定されていれば、その秒数で応答がないとき
+        別のサーバーにも送って先に返った方を使う（遅い方の応答は捨てる）。
+        endpoint_url を指定した場合はそのサーバーにだけ送る（ジョブAPI）。
+        idempotent=False のリクエスト（ジョブ登録など）はやり直さない（接続失敗・5xxでは
+        サーバー側で処理済みかもしれない）。
+        やり直しても成功しなければ最後の応答（raise_for_status で例外になる）か例外を返す。
+        """
+        if endpoint_url is not None:
+            return requests.request(method, f"{endpoint_url}{path}", **kwargs)
+        tried: set[str] = set()
+        last_error: Optional[Exception] = None
+        for _ in range(1 + max(0, self.retries)):
+            try:
+                if hedge and self.hedge_after > 0 and len(self.pool) > 1:
+                    return self._hedged(method, path, tried, **kwargs)
+                return self._attempt(self.pool.acquire(tried), method, path, tried, **kwargs)
+            except NoEndpointAvailable:
+                break
+            except (RetryableResponse, requests.ConnectionError) as e:
+                last_error = e
+                if not idempotent:
+                    break
+        if isinstance(last_error, RetryableResponse):
+            return last_error.response
+        if last_error is None:
+            raise NoEndpointAvailable("No OCR server available")
+        raise last_error
+    
+    def _attempt(self, endpoint: Endpoint, method: str, path: str, tried: set, **kwargs):
+        """acquire 済みのサーバーに1回送る（成否をプールに記録し、未完了数を戻す）"""
+        tried.add(endpoint.url)
+        try:
+            response = requests.request(method, f"{endpoint.url}{path}", **kwargs)
+        except requests.ConnectionError as e:
+            self.pool.report_failure(endpoint, f"{type(e).__name__}: {e}", hard=True)
+            raise
+        finally:
+            self.pool.release(endpoint)
+        self._check_response(endpoint, response)
+        return response
+    
+    def _check_response(self, endpoint: Endpoint, response):
+        """応答をプールに記録し、やり直すべき応答なら RetryableResponse"""
+        if response.status_code in RETRY_STATUSES:
+            retry_after = response.headers.get("Retry-After")
+            self.pool.report_failure(
+                endpoint, f"HTTP {response.status_code}",
+                retry_after=float(retry_after) if response.status_code == 429 and retry_after else None,
+            )
+            response.close()
+            raise RetryableResponse(response)
+        self.pool.report_success(endpoint)
+    
+    def _hedged(self, method: str, path: str, tried: set, **kwargs):
+        """最初のサーバーが hedge_after 秒以内に応答しなければ2台目にも送り、早い方を返す"""
+        # 2つの送信は別スレッドで tried に書き込むので、それぞれの写しを渡して最後にまとめる
+        first = self.pool.acquire(tried)
+        attempt_tried = [set(tried) | {first.url}]
+        pending = {self._hedge_executor.submit(self._attempt, first, method, path, attempt_tried[0], **kwargs)}
+        done, pending = wait(pending, timeout=self.hedge_after)
+        if not done:
+            try:
+                second = self.pool.acquire(tried | {first.url})
+                attempt_tried.append(set(tried) | {second.url})
+                pending.add(self._hedge_executor.submit(
+                    self._attempt, second, method, path, attempt_tried[-1], **kwargs
+                ))
+            except NoEndpointAvailable:
+                pass
+        error: Optional[Exception] = None
+        while pending or done:
+            for future in done:
+                try:
+                    response = future.result()
+                except (requests.RequestException, RetryableResponse) as e:
+                    error = error or e
+                    continue
+                for other in pending:
+                    # 遅い方の応答は届いたら捨てる（サーバー側は期限ヘッダーで打ち切られる）
+                    other.add_done_callback(lambda f: f.exception() is None and f.result().close())
+                return response
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for urls in attempt_tried:
+            tried.update(urls)
+        raise error
+    
+    def _post_stream(self, endpoint: Endpoint, path: str, **kwargs):
+        """ストリーミング応答を開く（ヘッダーまで受け取った時点で成否をプールに記録）"""
+        try:
+            response = requests.post(
+                f"{endpoint.url}{path}",
+                stream=True,
+                timeout=(30, 120),  # 接続 / 1ページあたりの受信待ち
+                **kwargs,
+            )
+        except requests.ConnectionError as e:
+            self.pool.report_failure(endpoint, f"{type(e).__name__}: {e}", hard=True)
+            raise
+        self._check_response(endpoint, response)
+        return response
+    
+    def _stream_pages(
+        self,
+        open_stream: Callable[[Endpoint, list], Iterator[dict]],
+        page_ids: list,
+        max_chunk: Optional[int] = None,
+    ) -> Iterator[dict]:
+        """
+        ページ群をストリーミングでOCRする（複数サーバーなら分割して並行に送る）
+        
+        open_stream(endpoint, page_ids) はそのサーバーに指定ページを送り、結果を1行ずつ返す。
+        分割したページ群は全サーバー分のスレッドが順に取り出して処理するので、速い
+        サーバーほど多くのページを受け持つ。
+        max_chunk を指定すると1回に送るページ数をそれ以下にする（1台でも分割して順に送る）。
+        """
+        if not page_ids:
+            return
+        workers = len(self.pool.healthy()) or 1
+        if len(self.pool) == 1 or workers == 1 or len(page_ids) == 1:
+            yield from self._stream_sequential(open_stream, page_ids, max_chunk or len(page_ids))
+            return
+        
+        size = math.ceil(len(page_ids) / (workers * CHUNKS_PER_ENDPOINT))
+        if max_chunk:
+            size = min(size, max_chunk)
+        chunks: queue.Queue = queue.Queue()
+        for start in range(0, len(page_ids), size):
+            chunks.put(page_ids[start:start + size])
+        results: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        
+        def worker():
+            try:
+                while not stop.is_set():
+                    try:
+                        chunk = chunks.get_nowait()
+                    except queue.Empty:
+                        break
+                    for item in self._stream_chunk(open_stream, chunk):
+                        if stop.is_set():
+                            return
+                        results.put(("item", item))
+            except Exception as e:
+                results.put(("error", e))
+            finally:
+                results.put(("done", None))
+        
+        threads = [threading.Thread(target=worker, daemon=True, name=f"ocr-stream-{i}") for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            remaining = len(threads)
+            while remaining:
+                kind, value = results.get()
+                if kind == "done":
+                    remaining -= 1
+                elif kind == "error":
+                    raise value
+                else:
+                    yield value
+        finally:
+            stop.set()
+    
+    def _stream_sequential(
+        self, open_stream: Callable[[Endpoint, list], Iterator[dict]], page_ids: list, size: int,
+    ) -> Iterator[dict]:
+        """
+        size ページずつ順に送る（1台のサーバー向け）
+        
+        まだ1ページも結果を返していなければ例外をそのまま上げ、返した後に失敗した
+        ページ群は残りのページ群を続けられるようエラー行にする。
+        """
+        started = False
+        for start in range(0, len(page_ids), size):
+            chunk = page_ids[start:start + size]
+            done = set()
+            try:
+                for item in self._stream_chunk(open_stream, chunk):
+                    done.add(item.get("page"))
+                    started = True
+                    yield item
+            except (requests.RequestException, RuntimeError) as e:
+                if not started:
+                    raise
+                for page_id in chunk:
+                    if page_id not in done:
+                        yield {"page": page_id, "status": "error", "error": str(e)}
+    
+    def _stream_chunk(self, open_stream: Callable[[Endpoint, list], Iterator[dict]], page_ids: list) -> Iterator[dict]:
+        """
+        1つのページ群をストリーミングでOCRする
+        
+        接続失敗・429・5xx・受信途中の切断では、まだ結果のないページだけを別のサーバーに
+        送り直す。送り先がなくなったら残りのページをエラー行として返す（既に結果を返した
+        後なので例外にはしない）。
+        """
+        remaining = list(page_ids)
+        tried: set[str] = set()
+        error: Optional[Exception] = None
+        for _ in range(1 + max(0, self.retries)):
+            try:
+                endpoint = self.pool.acquire(tried)
+            except NoEndpointAvailable:
+                break
+            tried.add(endpoint.url)
+            try:
+                for item in open_stream(endpoint, list(remaining)):
+                    if item.get("page") in remaining:
+                        remaining.remove(item["page"])
+                    yield item
+                if not remaining:
+                    return
+                error = RuntimeError(f"{endpoint.url} ended the stream without all pages")
+            except RetryableResponse as e:
+                error = e
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                self.pool.report_failure(endpoint, f"{type(e).__name__}: {e}", hard=True)
+                error = e
+            finally:
+                self.pool.release(endpoint)
+        if len(remaining) == len(page_ids) and error is not None:
+            if isinstance(error, RetryableResponse):
+                error.response.raise_for_status()
+            raise error
+        for page_id in remaining:
+            yield {"page": page_id, "status": "error", "error": str(error or "No OCR server available")}
+    
+    def submit_job(self, images: list[np.ndarray], use_cache: bool = True) -> str:
+        """
+        OCRジョブを登録（サーバーは即座にジョブIDを返し、バックグラウンドで処理する）
+        
+        Args:
+            images: OpenCV BGR形式の画像リスト
+            use_cache: Falseの場合サーバー側のOCR結果キャッシュを使わない
+            
+        Returns:
+            job_id: ジョブID
+        """
+        files = []
+        for i, img_bgr in enumerate(images):
+            _, buffer = cv2.imencode('.png', img_bgr)
+            files.append(("files", (f"page_{i}.png", buffer.tobytes(), "image/png")))
+        
+        # ジョブ登録はやり直すと同じジョブが二重にできるので、ヘッジ・再送しない
+        response = self._request(
+            "POST", "/jobs",
+            idempotent=False,
+            files=files,
+            headers=self._cache_headers(use_cache),
+            timeout=60
+        )
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        self._job_endpoints[job_id] = str(response.url).rsplit("/jobs", 1)[0]
+        return job_id
+    
+    def get_job(self, job_id: str, include_results: bool = True) -> dict:
+        """ジョブの状態と処理済みページの結果を取得"""
+        response = self._request(
+            "GET", f"/jobs/{job_id}",
+            endpoint_url=self._job_endpoints.get(job_id, self.base_url),
+            params={"include_results": include_results},
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def cancel_job(self, job_id: str) -> dict:
+        """ジョブをキャンセル（終了済みのジョブは削除）"""
+        response = self._request(
+            "DELETE", f"/jobs/{job_id}",
+            endpoint_url=self._job_endpoints.get(job_id, self.base_url),
+            timeout=10,
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def wait_job(self, job_id: str, poll_interval: float = 1.0, timeout: float = None) -> list:
+        """
+        ジョブの完了を待って結果を取得
+        
+        Args:
+            job_id: ジョブID
+            poll_interval: ポーリング間隔（秒）
+            timeout: 待ち時間の上限（秒）。Noneなら無制限
+            
+        Returns:
+            各ページのwordsリスト（入力順、失敗したページはNone）
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get_job(job_id, include_results=False)
+            if job["status"] in ("completed", "failed", "cancelled"):
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"OCR job {job_id} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+        
+        if job["status"] != "completed":
+            raise RuntimeError(f"OCR job {job_id} {job['status']}: {job.get('error')}")
+        job = self.get_job(job_id)
+        return [page.get("words") for page in job.get("results", [])]
+    
+    @staticmethod
+    def _cache_headers(use_cache: bool) -> dict:
+        """サーバー側キャッシュを使わない場合のリクエストヘッダー"""
+        return {} if use_cache else {"X-OCR-Cache": "bypass"}
+    
+    def _format_headers(self) -> dict:
+        """コンパクト形式と、この環境で展開できる応答圧縮を要求するヘッダー"""
+        if not self.compact:
+            return {}
+        return {
+            "Accept": f"{wire_format.MSGPACK_MEDIA_TYPE}, application/json;q=0.5",
+            "Accept-Encoding": ", ".join(wire_format.supported_encodings()),
+        }
+    
+    @staticmethod
+    def _decode(response, as_arrays: bool = False) -> dict:
+        """
+        JSON / msgpack の応答をdictにする
+        
+        msgpackの列指向wordsは as_arrays=True なら WordArrays のまま、
+        そうでなければ従来のdictのリストに戻す。
+        """
+        body = wire_format.decompress(response.content, response.headers.get("Content-Encoding"))
+        if response.headers.get("Content-Type", "").startswith(wire_format.MSGPACK_MEDIA_TYPE):
+            return wire_format.expand_words(wire_format.unpack(body), as_arrays)
+        result = json.loads(body)
+        if as_arrays:
+            result = wire_format.expand_words(wire_format.compact_words(result))
+        return result
+    
+    @staticmethod
+    def _deadline_headers(timeout: float) -> dict:
+        """タイムアウト後に届く結果のためにサーバーが推論しないよう期限を伝える"""
+        return {"X-OCR-Deadline": str(max(1, timeout - DEADLINE_MARGIN_SEC))}
     
     def extract_roi(self, words_data: list, rois: list[dict]) -> dict:
         """
@@ -56,8 +693,8 @@ class OCRClient:
         Returns:
             extractions: {"label": "extracted_text", ...}
         """
-        response = requests.post(
-            f"{self.base_url}/extract-roi",
+        response = self._request(
+            "POST", "/extract-roi",
             json={"words_data": words_data, "rois": rois},
             timeout=30
         )
@@ -0,0 +1,157 @@
+"""ページ画像の置き場: 描画したページをディスクに書き出し、必要なときにメモリマップで渡す"""
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ページ画像（300DPIのA4で1枚約26MB）を書き出す場所
+PAGE_STORE_DIR = os.environ.get("PAGE_STORE_DIR", tempfile.gettempdir())
+# セッションごとにメモリ上に残すページ画像・縮小画像の上限(MB)。超えた分はディスクから読む
+PAGE_STORE_BUDGET_MB = int(os.environ.get("PAGE_STORE_BUDGET_MB", "256"))
+# 開いたままにするメモリマップの数（1つごとにファイル記述子を使う）。上の上限には含まれず、
+# 読んだ部分はOSのページキャッシュに載る（最大でこの枚数分。メモリが足りなければOSが手放す）
+PAGE_STORE_OPEN_MAPS = int(os.environ.get("PAGE_STORE_OPEN_MAPS", "32"))
+
+
+class PageHandle:
+    """PageStore 内の1ページへの参照（画像そのものは持たない）"""
+
+    __slots__ = ("store", "index", "shape")
+
+    def __init__(self, store: "PageStore", index: int, shape: tuple):
+        self.store = store
+        self.index = index
+        self.shape = shape
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """(幅, 高さ)"""
+        return self.shape[1], self.shape[0]
+
+    def array(self) -> np.ndarray:
+        """BGR画像（読み取り専用。メモリ上になければディスクのメモリマップ）"""
+        return self.store.get(self.index)
+
+    def thumbnail(self, width: int = 320) -> np.ndarray:
+        """表示用の縮小RGB画像"""
+        return self.store.thumbnail(self.index, width)
+
+
+class PageStore:
+    """
+    1セッション分のページ画像
+
+    add() したページは <dir>/<番号>.npy に書き出し、直近に使った画像だけを
+    budget_bytes までメモリに残す（LRUで追い出す）。メモリにないページは
+    np.load(mmap_mode="r") のビューを返すので、読んだ部分だけがOSのページキャッシュに載る。
+    開いたメモリマップは直近の max_open_maps 件だけ保持する（それより古いものは、呼び出し側が
+    参照を手放した時点でファイル記述子ごと閉じられる）。メモリマップは budget_bytes に
+    数えない（読んだ部分はOSが管理するページキャッシュで、プロセスのメモリではない）。
+    返す画像は読み取り専用。ファイルは close() か、ストアが参照されなくなったときに消える。
+    """
+
+    def __init__(
+        self,
+        directory: str = PAGE_STORE_DIR,
+        budget_bytes: int = PAGE_STORE_BUDGET_MB * 1024 * 1024,
+        max_open_maps: int = PAGE_STORE_OPEN_MAPS,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix="ocr-pages-", dir=directory)
+        self.budget_bytes = budget_bytes
+        self.max_open_maps = max(0, max_open_maps)
+        self.resident_bytes = 0
+        self._lock = threading.Lock()
+        self._resident: OrderedDict = OrderedDict()  # キー → 配列（ページは番号、縮小画像は (番号, 幅)）
+        self._maps: OrderedDict = OrderedDict()  # 番号 → メモリマップ（LRU）
+        self._count = 0
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def add(self, img: np.ndarray) -> PageHandle:
+        """ページを書き出してハンドルを返す（img はそのままメモリ側のキャッシュに使う）"""
+        with self._lock:
+            index = self._count
+            self._count += 1
+        np.save(self.page_path(index), img)
+        img.setflags(write=False)
+        with self._lock:
+            self._remember(index, img)
+        return PageHandle(self, index, img.shape)
+
+    def reserve(self, count: int) -> list[int]:
+        """
+        別プロセスが書き出すページの番号を確保する
+
+        書き出し先は page_path(番号)（np.save 形式）。書き終えたら adopt() でハンドルにする。
+        """
+        with self._lock:
+            start = self._count
+            self._count += count
+        return list(range(start, start + count))
+
+    def adopt(self, index: int, shape: tuple) -> PageHandle:
+        """page_path(index) に書き出し済みのページのハンドル（メモリには載せない）"""
+        return PageHandle(self, index, tuple(shape))
+
+    def page_path(self, index: int) -> str:
+        return os.path.join(self.path, f"{index}.npy")
+
+    def get(self, index: int) -> np.ndarray:
+        with self._lock:
+            img = self._resident.get(index)
+            if img is not None:
+                self._resident.move_to_end(index)
+                return img
+            img = self._maps.get(index)
+            if img is not None:
+                self._maps.move_to_end(index)
+                return img
+            img = np.load(self.page_path(index), mmap_mode="r")
+            if self.max_open_maps:
+                self._maps[index] = img
+                while len(self._maps) > self.max_open_maps:
+                    self._maps.popitem(last=False)
+            return img
+
+    def thumbnail(self, index: int, width: int) -> np.ndarray:
+        key = (index, width)
+        with self._lock:
+            thumb = self._resident.get(key)
+            if thumb is not None:
+                self._resident.move_to_end(key)
+                return thumb
+        img = self.get(index)
+        height = max(1, round(img.shape[0] * width / img.shape[1]))
+        thumb = cv2.cvtColor(cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+        with self._lock:
+            self._remember(key, thumb)
+        return thumb
+
+    def close(self):
+        """ファイルとキャッシュを破棄する（以降このストアのハンドルは使えない）"""
+        with self._lock:
+            self._resident.clear()
+            self._maps.clear()
+            self.resident_bytes = 0
+        self._finalizer()
+
+    def _remember(self, key, arr: np.ndarray):
+        """メモリに残す（上限を超えた分は古いものから捨てる。ディスクにあるので失われない）"""
+        if arr.nbytes > self.budget_bytes:
+            return
+        old = self._resident.pop(key, None)
+        if old is not None:
+            self.resident_bytes -= old.nbytes
+        self._resident[key] = arr
+        self.resident_bytes += arr.nbytes
+        while self.resident_bytes > self.budget_bytes:
+            _, evicted = self._resident.popitem(last=False)
+            self.resident_bytes -= evicted.nbytes
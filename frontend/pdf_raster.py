@@ -0,0 +1,121 @@
+"""PDFのページ画像化: ページ範囲ごとにプロセスへ分け、描画したページをページ順に返す"""
+import math
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+import cv2
+import numpy as np
+
+from page_store import PageHandle, PageStore
+
+# PDF描画のワーカープロセス数（1でプロセスを使わずに描画、0でCPU数）
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", "0"))
+
+
+def render_pixmap(page, dpi: int) -> np.ndarray:
+    """PyMuPDFのページをBGR画像に描画"""
+    pix = page.get_pixmap(dpi=dpi)
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
+    if pix.n == 4:
+        return cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+
+
+def render_range(pdf_path: str, start: int, stop: int, dpi: int, paths: list[str]) -> list[tuple]:
+    """
+    start〜stop-1 ページを描画して paths に np.save で書き出す（ワーカープロセスで実行）
+
+    PyMuPDFのオブジェクトはプロセス間で共有できないので、範囲ごとにPDFを開く。
+    画像はパイプで送らずファイルに書くので、親は画像の形だけを受け取る。
+    """
+    import fitz
+    shapes = []
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        for index, path in zip(range(start, stop), paths):
+            img = render_pixmap(doc[index], dpi)
+            np.save(path, img)
+            shapes.append(img.shape)
+    return shapes
+
+
+class PdfRasterizer:
+    """
+    PDFページを並列に画像化するプロセスプール（全セッションで共有）
+
+    ページを小さな範囲に分けてワーカーに配り、描画済みのページは PageStore のファイルとして
+    受け取る。render() は範囲をページ順に返すので、呼び出し側は先頭から順に
+    フィンガープリント計算などを始められる（後ろの範囲の描画はその間も進む）。
+    Streamlitのスレッドを抱えた親をforkしないよう spawn で起動する。
+    """
+
+    def __init__(self, num_workers: int = PDF_RENDER_WORKERS, chunks_per_worker: int = 4):
+        self.num_workers = max(1, num_workers or os.cpu_count() or 1)
+        self.chunks_per_worker = chunks_per_worker
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def render(self, pdf_bytes: bytes, store: PageStore, dpi: int) -> Iterator[list[PageHandle]]:
+        """PDFを描画し、ページ範囲ごとのハンドルをページ順に返す"""
+        import fitz
+        pdf_path = os.path.join(store.path, "source.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+        with fitz.open(pdf_path, filetype="pdf") as doc:
+            num_pages = doc.page_count
+        indices = store.reserve(num_pages)
+        paths = [store.page_path(i) for i in indices]
+        try:
+            if self.num_workers == 1 or num_pages < 2:
+                for page in range(num_pages):
+                    shapes = render_range(pdf_path, page, page + 1, dpi, paths[page:page + 1])
+                    yield [store.adopt(indices[page], shapes[0])]
+                return
+            yield from self._render_parallel(pdf_path, num_pages, dpi, store, indices, paths)
+        finally:
+            os.remove(pdf_path)
+
+    def _render_parallel(self, pdf_path, num_pages, dpi, store, indices, paths):
+        size = max(1, math.ceil(num_pages / (self.num_workers * self.chunks_per_worker)))
+        self.start()
+        futures = [
+            (start, self._executor.submit(
+                render_range, pdf_path, start, min(start + size, num_pages), dpi, paths[start:start + size]
+            ))
+            for start in range(0, num_pages, size)
+        ]
+        try:
+            for start, future in futures:
+                shapes = future.result()
+                yield [store.adopt(indices[start + i], shape) for i, shape in enumerate(shapes)]
+        finally:
+            # 途中で止めた（例外・呼び出し側の中断）ときは残りの範囲を描画しない
+            for _, future in futures:
+                future.cancel()
+
+    def start(self):
+        """ワーカープロセスを起動する（初回の render() でも起動する）"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=mp.get_context("spawn"),
+            )
+            # 全ワーカーの起動（spawn）をここで済ませる
+            for future in [self._executor.submit(os.getpid) for _ in range(self.num_workers)]:
+                future.result()
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_default_rasterizer = None
+
+
+def get_rasterizer() -> PdfRasterizer:
+    """デフォルトのラスタライザを取得（遅延初期化）"""
+    global _default_rasterizer
+    if _default_rasterizer is None:
+        _default_rasterizer = PdfRasterizer()
+    return _default_rasterizer
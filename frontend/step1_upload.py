@@ -1,9 +1,39 @@
-"""Step1: PDF読込・画像展開・様式クラスタリング"""
+"""Step1: PDF読込・画像展開・様式ライブラリ照合・様式クラスタリング"""
 import streamlit as st
-import fitz
-import cv2
-import numpy as np
-from utils import perform_clustering
+from page_store import PageStore
+from pdf_raster import get_rasterizer
+from style_library import get_library, scale_template
+from utils import cluster_fingerprints, layout_fingerprints
+
+# ページ画像の解像度（OCRサーバーでPDFを画像化するときも同じ値を使う）
+PDF_DPI = 300
+
+
+def assign_styles(fps, matches):
+    """
+    ライブラリ照合の結果とクラスタリングでページにグループ番号を振る
+
+    登録済み様式に一致したページは様式ごとに 0, 1, ... のグループにまとめ、
+    一致しなかったページだけをクラスタリングしてその後ろの番号を振る。
+
+    Returns:
+        (labels, {グループ番号: 様式キー})
+    """
+    labels = [None] * len(fps)
+    group_styles = {}
+    style_groups = {}
+    for i, match in enumerate(matches):
+        if match is None:
+            continue
+        key = match[0]
+        if key not in style_groups:
+            style_groups[key] = len(style_groups)
+            group_styles[style_groups[key]] = key
+        labels[i] = style_groups[key]
+    rest = [i for i, label in enumerate(labels) if label is None]
+    for i, label in zip(rest, cluster_fingerprints([fps[i] for i in rest])):
+        labels[i] = len(style_groups) + int(label)
+    return labels, group_styles
 
 def show():
     st.header("1. 領収書PDFの読み込み")
@@ -12,21 +42,38 @@ def show():
     
     if uploaded_file and st.button("読み込んで次へ"):
         with st.spinner("PDFを画像に変換しています..."):
-            doc = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-            temp_imgs = []
-            for p in doc:
-                pix = p.get_pixmap(dpi=300)
-                img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
-                if pix.n == 4:
-                    img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
-                else:
-                    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-                temp_imgs.append(img)
+            pdf_bytes = uploaded_file.read()
+            # ページ画像はディスクに書き出し、以降のステップにはハンドルだけを渡す
+            old_store = st.session_state.get("page_store")
+            if old_store is not None:
+                old_store.close()
+            store = st.session_state.page_store = PageStore()
+            handles, fps = [], []
+            # 描画はワーカープロセスで並列に進み、描けた範囲から順にフィンガープリントを計算する
+            for chunk in get_rasterizer().render(pdf_bytes, store, PDF_DPI):
+                handles += chunk
+                fps += layout_fingerprints([h.array() for h in chunk])
             
-            labels = perform_clustering(temp_imgs)
+            library = get_library()
+            labels, group_styles = assign_styles(fps, library.match(fps))
             st.session_state.pages = [
-                {"img": img, "style_id": int(l), "page_num": i+1} 
-                for i, (img, l) in enumerate(zip(temp_imgs, labels))
+                {"handle": h, "style_id": int(l), "page_num": i+1, "fp": fp} 
+                for i, (h, l, fp) in enumerate(zip(handles, labels, fps))
             ]
+            # 登録済み様式に一致したグループは保存済みの読取位置を使い、ステップ3を省く
+            # 前回のPDFのグループ番号とは対応しないので、読取位置と自動検出の状態は作り直す
+            st.session_state.templates = {}
+            st.session_state.style_links = {}
+            for name in ("auto_detect_attempted", "auto_detect_failed", "ai_debug"):
+                st.session_state.pop(name, None)
+            for sid, key in group_styles.items():
+                style = library.get(key)
+                rep = next(p for p in st.session_state.pages if p["style_id"] == sid)
+                st.session_state.templates[sid] = scale_template(style["template"], style["size"], rep["handle"].size)
+                st.session_state.style_links[sid] = {"key": key, "name": style["name"], "auto": True}
+            st.session_state.wiz_style_idx = 0
+            st.session_state.wiz_field_idx = 0
+            # OCRはページ画像ではなくPDFのまま送る（step4）
+            st.session_state.pdf_bytes = pdf_bytes
             st.session_state.step_idx = 1
             st.rerun()
\ No newline at end of file
@@ -1,6 +1,5 @@
 """Step2: 様式グループの確認・手動修正"""
 import streamlit as st
-import cv2
 
 def show():
     st.header("2. 様式グループの確認")
@@ -15,17 +14,27 @@ def show():
     for sid in unique_styles:
         with st.container():
             st.subheader(f"📂 グループ {sid}")
+            link = st.session_state.style_links.get(sid)
+            if link is not None and link["auto"]:
+                st.caption(f"📚 登録済みの様式「{link['name']}」に一致しました。保存済みの読取位置を使います。")
+                if st.button("読取位置を指定し直す", key=f"relink_{sid}"):
+                    link["auto"] = False
+                    # ステップ3はこのグループから始める
+                    links = st.session_state.style_links
+                    manual = [s for s in unique_styles if not (s in links and links[s]["auto"])]
+                    st.session_state.wiz_style_idx = manual.index(sid)
+                    st.session_state.wiz_field_idx = 0
+                    st.rerun()
             pages_in_style = [p for p in st.session_state.pages if p["style_id"] == sid]
             
             cols = st.columns(5)
             for idx, p in enumerate(pages_in_style):
                 with cols[idx % 5]:
-                    img_display = cv2.cvtColor(p["img"], cv2.COLOR_BGR2RGB)
-                    st.image(img_display, caption=f"{p['page_num']}ページ目", use_column_width=True)
+                    st.image(p["handle"].thumbnail(), caption=f"{p['page_num']}ページ目", use_column_width=True)
                     
                     new_id = st.number_input(
                         f"グループ番号", 
-                        0, 20, sid, 
+                        0, max(20, unique_styles[-1]), sid, 
                         key=f"classify_{p['page_num']}"
                     )
                     if new_id != sid:
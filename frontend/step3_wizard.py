@@ -1,6 +1,7 @@
 """Step3: 各様式のOCR対象領域を矩形で指定"""
 import streamlit as st
 import cv2
+import numpy as np
 from PIL import Image
 import base64
 import io
@@ -12,6 +13,7 @@ import logging
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'components'))
 from rect_selector import rect_selector
 from ai_detector_client import get_detector
+from style_library import get_library
 
 logger = logging.getLogger(__name__)
 
@@ -88,9 +90,51 @@ def run_auto_detection(style_id: str, pil_img: Image.Image, target_labels: list[
         return False, debug
 
 
+def save_to_library():
+    """読取位置を指定したグループを様式ライブラリに登録する欄"""
+    links = st.session_state.style_links
+    all_styles = sorted(set(p["style_id"] for p in st.session_state.pages))
+    saved = [sid for sid in all_styles if sid in links and links[sid]["auto"]]
+    unsaved = [sid for sid in all_styles if st.session_state.templates.get(sid) and sid not in saved]
+    if not saved and not unsaved:
+        return
+
+    st.subheader("📚 様式ライブラリ")
+    st.caption("保存した様式は次回以降のPDFで自動的に割り当てられ、読取位置の指定を省けます。")
+    for sid in saved:
+        st.caption(f"✅ グループ {sid}: 様式「{links[sid]['name']}」の読取位置を使います。")
+
+    library = get_library()
+    for sid in unsaved:
+        link = links.get(sid)
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            name = st.text_input(
+                f"グループ {sid} の様式名", value=link["name"] if link else "",
+                placeholder="例: ○○クリニック", key=f"style_name_{sid}"
+            )
+        with col2:
+            st.write("")
+            if st.button("上書き保存" if link else "保存", key=f"save_style_{sid}", disabled=not name.strip()):
+                pages = [p for p in st.session_state.pages if p["style_id"] == sid]
+                # グループ内のフィンガープリントの平均を代表にする（読取位置は先頭ページ上で指定したもの）
+                fp = np.mean([p["fp"] for p in pages], axis=0).astype(np.uint8)
+                key = library.save(
+                    name.strip(), fp, st.session_state.templates[sid], pages[0]["handle"].size,
+                    key=link["key"] if link else None
+                )
+                links[sid] = {"key": key, "name": name.strip(), "auto": True}
+                st.rerun()
+
+
 def show():
     target_labels = ["領収金額", "自費金額", "日付", "受診者名", "医療機関名"]
-    unique_styles = sorted(list(set(p["style_id"] for p in st.session_state.pages)))
+    # 登録済み様式に一致したグループは保存済みの読取位置を使う（AI検出も行わない）
+    links = st.session_state.style_links
+    unique_styles = sorted(
+        sid for sid in set(p["style_id"] for p in st.session_state.pages)
+        if not (sid in links and links[sid]["auto"])
+    )
     
     # 自動検出の状態を初期化
     if "auto_detect_attempted" not in st.session_state:
@@ -102,6 +146,7 @@ def show():
     
     if st.session_state.wiz_style_idx >= len(unique_styles):
         st.success("すべてのグループの設定が完了しました！")
+        save_to_library()
         if st.button("OCR実行へ進む", type="primary"):
             st.session_state.step_idx = 3
             st.rerun()
@@ -114,7 +159,7 @@ def show():
     
     # 代表画像を取得
     rep = next(p for p in st.session_state.pages if p["style_id"] == current_sid)
-    pil_img = Image.fromarray(cv2.cvtColor(rep["img"], cv2.COLOR_BGR2RGB))
+    pil_img = Image.fromarray(cv2.cvtColor(rep["handle"].array(), cv2.COLOR_BGR2RGB))
     
     # ========================================
     # 自動検出フェーズ（各グループの最初のみ）
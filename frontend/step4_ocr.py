@@ -1,9 +1,56 @@
 """Step4: YomiToku OCRによる文字認識・結果検証・CSV出力"""
+import time
 import streamlit as st
 import pandas as pd
 import cv2
 from ocr_client import get_client
-from utils import extract_text_from_roi, parse_date
+from step1_upload import PDF_DPI
+from utils import STATUS_ERROR, normalize_results
+
+# 正規化しない列
+INFO_COLUMNS = ["ページ", "グループ"]
+# OCR中の結果表を描き直す間隔（秒）
+TABLE_REFRESH_SEC = 0.5
+
+
+def build_page_result(p: dict, template: dict, extractions: dict) -> tuple[dict, dict]:
+    """1ページ分のOCR結果（正規化前）を整形し、表の行と切り抜き画像を返す"""
+    img_bgr = p["handle"].array()
+    row = {"ページ": p["page_num"], "グループ": p["style_id"]}
+    page_crops = {"ページ": p["page_num"]}
+    
+    for label, coords in template.items():
+        row[label] = extractions.get(label, "").strip()
+        
+        x, y, w, h = coords['x'], coords['y'], coords['w'], coords['h']
+        cropped = img_bgr[y:y+h, x:x+w]
+        cropped_rgb = cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB)
+        page_crops[label] = cropped_rgb
+    
+    return row, page_crops
+
+
+def normalize_rows(rows: list[dict]) -> tuple[pd.DataFrame, pd.DataFrame, list[dict]]:
+    """
+    結果の行をまとめて正規化する（金額・日付など列ごとに一括）
+
+    Returns:
+        (正規化後の表, 状態表, 正規化後の行: 各行は元の行にある項目だけを持つ)
+    """
+    df = pd.DataFrame(rows)
+    fields = [c for c in df.columns if c not in INFO_COLUMNS]
+    normalized, status = normalize_results(df, fields)
+    records = [
+        {label: value if label in INFO_COLUMNS else normalized.at[i, label] for label, value in row.items()}
+        for i, row in zip(normalized.index, rows)
+    ]
+    return normalized, status, records
+
+
+def highlight_errors(status: pd.DataFrame):
+    """st.dataframe 用: 読み取れなかった値のセルに色を付ける"""
+    return lambda _: status.map(lambda s: "background-color: #ffe0e0" if s == STATUS_ERROR else "")
+
 
 def show():
     st.header("4. OCR実行・結果確認")
@@ -22,11 +69,16 @@ def show():
     try:
         health = ocr_client.health_check()
         if health.get("queue_size", 0) > 0:
-            st.warning(f"⏳ OCRサーバーは現在 {health['queue_size']}/{health['max_concurrent']} 件処理中です。順番待ちになる場合があります。")
+            st.warning(f"⏳ OCRサーバーは現在 {health.get('running', 0)} 件処理中、{health['queue_size']} 件が順番待ちです。")
     except Exception as e:
         st.error(f"❌ OCRサーバーに接続できません: {e}")
         return
     
+    roi_only = st.checkbox(
+        "読取位置の周辺だけOCRする（高速）", value=False,
+        help="ページ全体ではなく、ステップ3で指定した領域の周辺だけを認識します。"
+    )
+    
     if st.button("🚀 OCRを実行する", type="primary"):
         if not st.session_state.pages:
             st.error("読み込まれたページがありません。ステップ1からやり直してください。")
@@ -35,43 +87,75 @@ def show():
             st.error("読取位置が設定されていません。ステップ3で設定してください。")
             return
             
-        all_results = []
-        # 切り抜き画像を保存するリスト
-        cropped_images = []
+        pages = st.session_state.pages
+        # 正規化済みの行（届いたページの行だけを正規化して加える）
+        rows = {}
+        # 切り抜き画像（rows と同じインデックス）
+        crops = {}
+        templates = {}
+        for idx, p in enumerate(pages):
+            template = st.session_state.templates.get(p["style_id"], {})
+            templates[idx] = template if isinstance(template, dict) else {}
         
         with st.status("OCR処理中...", expanded=True) as status:
-            for p in st.session_state.pages:
-                img_bgr = p["img"]
-                
-                # OCRサーバーにリクエスト
-                try:
-                    words_data = ocr_client.run_ocr(img_bgr)
-                except Exception as e:
-                    st.error(f"OCRエラー (ページ {p['page_num']}): {e}")
-                    continue
-
-                template = st.session_state.templates.get(p["style_id"], {})
-                row = {"ページ": p["page_num"], "グループ": p["style_id"]}
-                page_crops = {"ページ": p["page_num"]}
-                
-                if isinstance(template, dict):
-                    for label, coords in template.items():
-                        text = extract_text_from_roi(words_data, coords)
-                        text = text.strip()
-                        if "金額" in label:
-                            text = "".join(filter(str.isdigit, text))
-                        elif "日付" in label or "日" in label:
-                            text = parse_date(text)
-                        row[label] = text
-                        
-                        x, y, w, h = coords['x'], coords['y'], coords['w'], coords['h']
-                        cropped = img_bgr[y:y+h, x:x+w]
-                        cropped_rgb = cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB)
-                        page_crops[label] = cropped_rgb
-                
-                all_results.append(row)
-                cropped_images.append(page_crops)
+            progress = st.progress(0.0)
+            table = st.empty()
+            last_refresh = [0.0]
+            
+            def refresh_table(force: bool = False):
+                # 表の描画はページ数に比例するので、間隔をあけて更新する
+                now = time.monotonic()
+                if force or now - last_refresh[0] >= TABLE_REFRESH_SEC:
+                    last_refresh[0] = now
+                    table.dataframe(pd.DataFrame([rows[i] for i in sorted(rows)]), use_container_width=True)
+            
+            def add_page(idx, extractions):
+                row, crops[idx] = build_page_result(pages[idx], templates[idx], extractions)
+                rows[idx] = normalize_rows([row])[2][0]
+                progress.progress(len(rows) / len(pages), text=f"{len(rows)} / {len(pages)} ページ")
+                refresh_table()
+            
+            # 読取位置のないページはOCR不要
+            for idx in templates:
+                if not templates[idx]:
+                    add_page(idx, {})
+            
+            # 終わったページから順に表に反映
+            try:
+                pdf_bytes = st.session_state.get("pdf_bytes")
+                if pdf_bytes:
+                    # PDFのままサーバーへ送り、サーバー側で画像化する（page は1始まり）
+                    results = ocr_client.stream_ocr_pdf(
+                        pdf_bytes, [templates[idx] for idx in templates],
+                        dpi=PDF_DPI, roi_only=roi_only,
+                    )
+                else:
+                    # 画像は送る直前に読み込む（全ページのメモリマップを同時に開かない）
+                    stream_pages = [(idx + 1, pages[idx]["handle"].array, templates[idx]) for idx in templates if templates[idx]]
+                    results = ocr_client.stream_ocr(stream_pages, roi_only=roi_only)
+                for result in results:
+                    idx = result["page"] - 1
+                    if not templates[idx]:
+                        continue  # 読取位置のないページ（反映済み）
+                    if result["status"] == "error":
+                        st.error(f"OCRエラー (ページ {pages[idx]['page_num']}): {result['error']}")
+                        continue
+                    if "width" in result and (result["height"], result["width"]) != pages[idx]["handle"].shape[:2]:
+                        st.warning(f"ページ {pages[idx]['page_num']}: サーバー側の画像サイズが異なるため読取位置がずれている可能性があります。")
+                    add_page(idx, result.get("extractions", {}))
+            except Exception as e:
+                st.error(f"OCRエラー: {e}")
+            skipped = [pages[idx]["page_num"] for idx in templates if idx not in rows]
+            if skipped:
+                shown = "、".join(str(n) for n in skipped[:20]) + (" ほか" if len(skipped) > 20 else "")
+                st.warning(f"⚠️ {len(skipped)} / {len(pages)} ページはOCRできなかったため結果に含まれていません（ページ {shown}）。")
+            if rows:
+                refresh_table(force=True)
             status.update(label="OCR完了！", state="complete")
+        
+        order = sorted(rows)
+        all_results = [rows[i] for i in order]
+        cropped_images = [crops[i] for i in order]
         st.session_state.ocr_results = all_results
         st.session_state.cropped_images = cropped_images
 
@@ -90,7 +174,7 @@ def show():
             page_crops = cropped_images[idx] if idx < len(cropped_images) else {}
             
             for label in row.keys():
-                if label in ["ページ", "グループ"]:
+                if label in INFO_COLUMNS:
                     continue
                 
                 input_key = f"edit_p{page_num}_{label}"
@@ -113,6 +197,10 @@ def show():
             st.divider()
 
         st.subheader("📊 集計結果")
-        df = pd.DataFrame(st.session_state.ocr_results)
-        st.dataframe(df, use_container_width=True)
+        # 編集後の値もまとめて正規化し直す（正規化済みの値は変わらない）
+        df, status, st.session_state.ocr_results = normalize_rows(st.session_state.ocr_results)
+        errors = int((status == STATUS_ERROR).sum().sum())
+        if errors:
+            st.warning(f"⚠️ 金額・日付として読み取れなかった値が {errors} 件あります（色付きのセル）。上で修正してください。")
+        st.dataframe(df.style.apply(highlight_errors(status), axis=None), use_container_width=True)
         st.download_button("📥 CSVファイルをダウンロード", df.to_csv(index=False).encode('utf-8-sig'), "医療費集計.csv")
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""様式ライブラリ: 名前を付けた様式（代表フィンガープリント + 読取位置）を保存し、新しいページを照合する"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Optional
+
+import numpy as np
+
+# 様式ライブラリの保存先（コンテナ再作成後も残すにはボリューム上に置く）
+STYLE_LIBRARY_DIR = os.environ.get(
+    "STYLE_LIBRARY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "style_library")
+)
+# 登録済み様式とみなす距離（1 - 正規化相関）の上限。クラスタリングの閾値(0.4)より厳しめ
+STYLE_MATCH_DISTANCE = float(os.environ.get("STYLE_MATCH_DISTANCE", "0.3"))
+
+
+def scale_template(template: dict, from_size, to_size) -> dict:
+    """読取位置を (幅, 高さ) from_size の画像から to_size の画像の座標に変換"""
+    if not from_size or tuple(from_size) == tuple(to_size):
+        return {label: dict(r) for label, r in template.items()}
+    sx, sy = to_size[0] / from_size[0], to_size[1] / from_size[1]
+    return {
+        label: {"x": int(r["x"] * sx), "y": int(r["y"] * sy), "w": int(r["w"] * sx), "h": int(r["h"] * sy)}
+        for label, r in template.items()
+    }
+
+
+def _unit_rows(fps) -> np.ndarray:
+    """
+    フィンガープリントを平均を引いて長さ1にした行ベクトルに変換
+
+    2行の内積が cv2.TM_CCOEFF_NORMED（同サイズ同士）と同じ値になる。分散0の行は0ベクトル。
+    """
+    rows = np.stack([np.asarray(fp, dtype=np.float32).reshape(-1) for fp in fps])
+    rows -= rows.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    return np.divide(rows, norms, out=np.zeros_like(rows), where=norms > 0)
+
+
+class StyleLibrary:
+    """
+    ローカルに保存する様式の一覧と最近傍照合
+
+    様式ごとに代表フィンガープリント（utils.get_layout_fingerprint の出力）と読取位置を持つ。
+    照合用に全様式のフィンガープリントを正規化した行列を保持し、match() はページ群との
+    正規化相関を1回の行列積で求めて最も近い様式を返す（距離が max_distance を超えたら該当なし）。
+
+    保存形式: <dir>/styles.json（名前・読取位置・画像サイズ）と <dir>/<key>.npy（フィンガープリント）。
+    書き込みは一時ファイルからの置き換えなので、途中で落ちても壊れた一覧は残らない。
+    """
+
+    def __init__(self, path: str = STYLE_LIBRARY_DIR, max_distance: float = STYLE_MATCH_DISTANCE):
+        self.path = path
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._styles: dict[str, dict] = {}
+        self._fingerprints: dict[str, np.ndarray] = {}
+        self._keys: list[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._styles)
+
+    def get(self, key: str) -> Optional[dict]:
+        style = self._styles.get(key)
+        return dict(style) if style is not None else None
+
+    def styles(self) -> list[dict]:
+        """登録済み様式（名前順）"""
+        return sorted((dict(s) for s in self._styles.values()), key=lambda s: s["name"])
+
+    def match(self, fps) -> list[Optional[tuple[str, float]]]:
+        """
+        各フィンガープリントに最も近い様式を探す
+
+        Returns:
+            ページごとに (様式キー, 距離)、該当なしは None
+        """
+        if not fps:
+            return []
+        with self._lock:
+            keys, matrix = self._keys, self._matrix
+        if matrix is None:
+            return [None] * len(fps)
+        scores = _unit_rows(fps) @ matrix.T
+        best = scores.argmax(axis=1)
+        results = []
+        for row, col in enumerate(best):
+            distance = 1.0 - float(scores[row, col])
+            results.append((keys[col], distance) if distance <= self.max_distance else None)
+        return results
+
+    def save(self, name: str, fingerprint: np.ndarray, template: dict, size, key: Optional[str] = None) -> str:
+        """
+        様式を登録（key を指定すると上書き）し、キーを返す
+
+        size は読取位置を指定した画像の (幅, 高さ)。
+        """
+        if not template:
+            raise ValueError("Template has no fields")
+        with self._lock:
+            key = key or uuid.uuid4().hex[:12]
+            now = time.strftime("%Y-%m-%dT%H:%M:%S")
+            created = self._styles.get(key, {}).get("created", now)
+            os.makedirs(self.path, exist_ok=True)
+            self._atomic_write(
+                os.path.join(self.path, f"{key}.npy"),
+                lambda f: np.save(f, np.asarray(fingerprint, dtype=np.uint8)),
+            )
+            self._styles[key] = {
+                "key": key,
+                "name": name,
+                "template": {label: dict(r) for label, r in template.items()},
+                "size": [int(size[0]), int(size[1])],
+                "created": created,
+                "updated": now,
+            }
+            self._write_index()
+            self._fingerprints[key] = np.asarray(fingerprint, dtype=np.uint8)
+            self._rebuild()
+        return key
+
+    def delete(self, key: str):
+        with self._lock:
+            if self._styles.pop(key, None) is None:
+                return
+            self._fingerprints.pop(key, None)
+            self._write_index()
+            try:
+                os.remove(os.path.join(self.path, f"{key}.npy"))
+            except FileNotFoundError:
+                pass
+            self._rebuild()
+
+    def _load(self):
+        index = os.path.join(self.path, "styles.json")
+        if not os.path.exists(index):
+            return
+        with open(index, encoding="utf-8") as f:
+            styles = json.load(f)
+        for style in styles:
+            try:
+                self._fingerprints[style["key"]] = np.load(os.path.join(self.path, f"{style['key']}.npy"))
+            except (OSError, ValueError):
+                continue  # フィンガープリントのない様式は照合できないので読み込まない
+            self._styles[style["key"]] = style
+        self._rebuild()
+
+    def _rebuild(self):
+        self._keys = list(self._fingerprints)
+        self._matrix = _unit_rows([self._fingerprints[k] for k in self._keys]) if self._keys else None
+
+    def _write_index(self):
+        styles = list(self._styles.values())
+        self._atomic_write(
+            os.path.join(self.path, "styles.json"),
+            lambda f: f.write(json.dumps(styles, ensure_ascii=False, indent=1).encode("utf-8")),
+        )
+
+    def _atomic_write(self, path: str, write):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+_default_library = None
+
+
+def get_library() -> StyleLibrary:
+    """デフォルトの様式ライブラリを取得（遅延初期化、セッション間で共有）"""
+    global _default_library
+    if _default_library is None:
+        _default_library = StyleLibrary()
+    return _default_library
@@ -0,0 +1,70 @@
+"""similarity_matrix: 従来の cv2.matchTemplate のループと同じ類似度・同じクラスタになる"""
+import cv2
+import numpy as np
+import pytest
+
+from utils import get_layout_fingerprint, perform_clustering, similarity_matrix
+
+
+def legacy_similarity(fps) -> np.ndarray:
+    """変更前の perform_clustering の組ごとの matchTemplate（類似度として返す）"""
+    num = len(fps)
+    score_matrix = np.zeros((num, num))
+    for i in range(num):
+        for j in range(i, num):
+            res = cv2.matchTemplate(fps[i], fps[j], cv2.TM_CCOEFF_NORMED)
+            _, score, _, _ = cv2.minMaxLoc(res)
+            score_matrix[i, j] = score_matrix[j, i] = score
+    return score_matrix
+
+
+def random_page(rng: np.random.Generator, layout: int) -> np.ndarray:
+    """様式 layout の罫線と、ページごとに少しずれた文字ブロックを描いたページ"""
+    img = np.full((400, 300, 3), 255, np.uint8)
+    layout_rng = np.random.default_rng(layout)
+    for _ in range(6):
+        x, y = layout_rng.integers(10, 250), layout_rng.integers(10, 350)
+        cv2.rectangle(img, (int(x), int(y)), (int(x) + 40, int(y) + 30), (0, 0, 0), 2)
+    for _ in range(5):
+        x, y = rng.integers(10, 260), rng.integers(10, 380)
+        cv2.putText(img, "1234", (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+    return img
+
+
+@pytest.fixture(scope="module")
+def fingerprints():
+    rng = np.random.default_rng(0)
+    pages = [random_page(rng, layout) for layout in (0, 1, 2) for _ in range(4)]
+    fps = [get_layout_fingerprint(p) for p in pages]
+    # 白紙（分散0）のページを前後に混ぜる
+    blank = np.zeros_like(fps[0])
+    return [blank] + fps[:6] + [blank.copy()] + fps[6:]
+
+
+@pytest.mark.parametrize("chunk_pixels", [16384, 1000, 10**7])
+def test_matches_match_template_loop(fingerprints, chunk_pixels):
+    expected = legacy_similarity(fingerprints)
+    actual = similarity_matrix(fingerprints, chunk_pixels=chunk_pixels)
+    np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+
+def test_clustering_labels_unchanged(fingerprints):
+    from sklearn.cluster import AgglomerativeClustering
+
+    def labels(score):
+        return AgglomerativeClustering(
+            n_clusters=None, distance_threshold=0.4, metric='precomputed', linkage='complete',
+        ).fit(1 - score).labels_
+
+    expected = labels(legacy_similarity(fingerprints))
+    actual = labels(similarity_matrix(fingerprints))
+    # ラベルの番号ではなく分け方が同じこと
+    assert len(set(zip(expected, actual))) == len(set(expected)) == len(set(actual))
+
+
+def test_perform_clustering_groups_layouts():
+    rng = np.random.default_rng(1)
+    pages = [random_page(rng, layout) for layout in (0, 1) for _ in range(3)]
+    labels = list(perform_clustering(pages))
+    assert len(set(labels[:3])) == 1 and len(set(labels[3:])) == 1
+    assert labels[0] != labels[3]
@@ -1,11 +1,24 @@
-"""ユーティリティ関数: 日付パース、レイアウトクラスタリング、OCRテキスト抽出"""
+"""ユーティリティ関数: 日付パース・項目の正規化、レイアウトクラスタリング、OCRテキスト抽出"""
 import cv2
 import numpy as np
+import os
+import pandas as pd
 import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from sklearn.cluster import AgglomerativeClustering
+from roi_index import WordIndex
+
+# このページ数を超えたら距離行列を作らない逐次クラスタリング（leader法）に切り替える
+CLUSTER_SCALABLE_ABOVE = int(os.environ.get("CLUSTER_SCALABLE_ABOVE", "1000"))
+# フィンガープリント計算のスレッド数（OpenCVはGILを解放するので並列に進む、0でCPU数）
+FINGERPRINT_WORKERS = int(os.environ.get("FINGERPRINT_WORKERS", "0"))
+# 同じ様式とみなす距離（1 - 正規化相関）の上限
+CLUSTER_DISTANCE = 0.4
 
 ZEN2HAN = str.maketrans('０１２３４５６７８９', '0123456789')
+# 金額用: 全角の数字・カンマ・円記号も半角に
+AMOUNT_ZEN2HAN = str.maketrans('０１２３４５６７８９，￥', '0123456789,¥')
 
 WAREKI_MAP = {
     '令和': 2019, 'r': 2019, 'R': 2019,
@@ -13,6 +26,27 @@ WAREKI_MAP = {
     '昭和': 1926, 's': 1926, 'S': 1926,
 }
 
+# 日付の形式（上から順に試す）: (パターン, 和暦か)。和暦は (元号, 年, 月, 日)、西暦は (年, 月, 日)
+DATE_PATTERNS = [
+    (re.compile(r'(令和|平成|昭和)(\d{1,2}|元)年(\d{1,2})月(\d{1,2})日?'), True),
+    (re.compile(r'([RHSrhs])(\d{1,2})[.\-/](\d{1,2})[.\-/](\d{1,2})'), True),
+    (re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})日?'), False),
+    (re.compile(r'(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})'), False),
+]
+WHITESPACE = re.compile(r'\s+')
+# 金額: 円記号（OCRでは \\ になることがある）・カンマ・空白・「円」・末尾の「-」（¥1,234- の書き方）
+AMOUNT_NOISE = r'[¥\\,\s円]|-$'
+
+# 項目の正規化結果
+STATUS_OK = "ok"
+STATUS_EMPTY = "empty"
+STATUS_ERROR = "error"
+
+# 正規化済みの値: (種類, 元の値) -> (正規化後の値, 状態)。ページごと・編集後の正規化で同じ値を
+# 処理し直さないよう共有する（上限を超えたら空にする）
+NORMALIZE_CACHE_MAX = 100_000
+_normalized: dict[tuple[str, str], tuple[str, str]] = {}
+
 def parse_date(text: str, output_format: str = '%Y-%m-%d') -> str:
     """
     日本語日付形式を統一フォーマットに変換
@@ -23,30 +57,20 @@ def parse_date(text: str, output_format: str = '%Y-%m-%d') -> str:
         return text
     
     text = text.translate(ZEN2HAN).strip()
-    text = re.sub(r'\s+', '', text)
+    text = WHITESPACE.sub('', text)
     
     year, month, day = None, None, None
     
-    m = re.search(r'(令和|平成|昭和)(\d{1,2})年(\d{1,2})月(\d{1,2})日?', text)
-    if m:
-        era, y, month, day = m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4))
-        year = WAREKI_MAP[era] + y - 1
-    
-    if year is None:
-        m = re.search(r'([RHSrhs])(\d{1,2})[.\-/](\d{1,2})[.\-/](\d{1,2})', text)
-        if m:
-            era, y, month, day = m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4))
-            year = WAREKI_MAP[era] + y - 1
-    
-    if year is None:
-        m = re.search(r'(\d{4})年(\d{1,2})月(\d{1,2})日?', text)
-        if m:
-            year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
-    
-    if year is None:
-        m = re.search(r'(\d{4})[/\-](\d{1,2})[/\-](\d{1,2})', text)
-        if m:
+    for pattern, era in DATE_PATTERNS:
+        m = pattern.search(text)
+        if not m:
+            continue
+        if era:
+            y = 1 if m.group(2) == '元' else int(m.group(2))
+            year, month, day = WAREKI_MAP[m.group(1)] + y - 1, int(m.group(3)), int(m.group(4))
+        else:
             year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        break
     
     if year and month and day:
         try:
@@ -57,6 +81,116 @@ def parse_date(text: str, output_format: str = '%Y-%m-%d') -> str:
     return text
 
 
+def field_kind(label: str) -> str:
+    """項目名から正規化の種類を決める: "amount" / "date" / "text" """
+    if "金額" in label:
+        return "amount"
+    if "日付" in label or "日" in label:
+        return "date"
+    return "text"
+
+
+def _per_unique(values: pd.Series, fn, kind: str) -> tuple[pd.Series, pd.Series]:
+    """
+    重複する値は1回だけ正規化する（fn は一意な値の Series を受け取り (値, 状態) を返す）
+
+    以前に同じ種類で正規化した値は fn に渡さず _normalized の結果を使う。
+    """
+    codes, uniques = pd.factorize(values.fillna('').astype(str))
+    if len(uniques) == 0:
+        return values.astype(object), pd.Series(STATUS_EMPTY, index=values.index)
+    found = [_normalized.get((kind, raw)) for raw in uniques]
+    missing = [raw for raw, hit in zip(uniques, found) if hit is None]
+    if missing:
+        norm, status = fn(pd.Series(missing, dtype=object))
+        computed = dict(zip(missing, zip(norm.to_numpy(), status.to_numpy())))
+        if len(_normalized) + len(computed) > NORMALIZE_CACHE_MAX:
+            _normalized.clear()
+        _normalized.update({(kind, raw): hit for raw, hit in computed.items()})
+        found = [hit if hit is not None else computed[raw] for raw, hit in zip(uniques, found)]
+    norm = np.array([hit[0] for hit in found], dtype=object)
+    status = np.array([hit[1] for hit in found], dtype=object)
+    return (
+        pd.Series(norm[codes], index=values.index),
+        pd.Series(status[codes], index=values.index),
+    )
+
+
+def _normalize_dates(text: pd.Series, output_format: str) -> tuple[pd.Series, pd.Series]:
+    clean = text.str.translate(ZEN2HAN).str.strip().str.replace(WHITESPACE, '', regex=True)
+    year = pd.Series(np.nan, index=clean.index)
+    month = year.copy()
+    day = year.copy()
+    for pattern, era in DATE_PATTERNS:
+        todo = year.isna()
+        if not todo.any():
+            break
+        m = clean[todo].str.extract(pattern)
+        m = m[m[0].notna()]
+        if era:
+            y = m[1].replace('元', '1').astype(int)
+            year[m.index] = m[0].map(WAREKI_MAP) + y - 1
+            month[m.index], day[m.index] = m[2].astype(int), m[3].astype(int)
+        else:
+            year[m.index] = m[0].astype(int)
+            month[m.index], day[m.index] = m[1].astype(int), m[2].astype(int)
+    # 存在しない日付（2月30日など）は読み取れなかった扱い
+    dates = pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day}), errors='coerce')
+    ok = dates.notna()
+    out = clean.copy()
+    out[ok] = dates[ok].dt.strftime(output_format)
+    status = pd.Series(np.where(ok, STATUS_OK, np.where(clean == '', STATUS_EMPTY, STATUS_ERROR)), index=clean.index)
+    return out, status
+
+
+def _normalize_amounts(text: pd.Series) -> tuple[pd.Series, pd.Series]:
+    clean = text.str.translate(AMOUNT_ZEN2HAN).str.strip()
+    stripped = clean.str.replace(AMOUNT_NOISE, '', regex=True)
+    ok = stripped.str.fullmatch(r'\d+')
+    # 読み取れなかった値も従来どおり数字だけを残す（状態で要確認にする）
+    out = stripped.where(ok, clean.str.replace(r'\D', '', regex=True))
+    status = pd.Series(np.where(ok, STATUS_OK, np.where(clean == '', STATUS_EMPTY, STATUS_ERROR)), index=clean.index)
+    return out, status
+
+
+def _normalize_text(text: pd.Series) -> tuple[pd.Series, pd.Series]:
+    out = text.str.strip()
+    return out, pd.Series(np.where(out == '', STATUS_EMPTY, STATUS_OK), index=text.index)
+
+
+def normalize_results(df: pd.DataFrame, fields=None, date_format: str = '%Y-%m-%d') -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    OCR結果の表を列ごとに一括で正規化する
+
+    金額は全角数字・カンマ・円記号を除いた数字、日付は和暦（令和/平成/昭和・R/H/S）も含めて
+    date_format にそろえる。同じ値は1回だけ処理する（以前の呼び出しで処理した値も再利用する）。
+    正規化済みの値をもう一度通しても変わらない。
+
+    Args:
+        fields: 正規化する列（既定はすべての列。種類は field_kind で列名から決める）
+
+    Returns:
+        (正規化後の表, 同じ形の状態表: "ok" / "empty" / "error"、対象外の列と欠損は None)
+    """
+    out = df.copy()
+    status = pd.DataFrame(None, index=df.index, columns=df.columns, dtype=object)
+    for col in (df.columns if fields is None else fields):
+        kind = field_kind(col)
+        if kind == "amount":
+            fn = _normalize_amounts
+        elif kind == "date":
+            fn = lambda text: _normalize_dates(text, date_format)
+            kind = f"date:{date_format}"
+        else:
+            fn = _normalize_text
+        present = df[col].notna()
+        values, states = _per_unique(df.loc[present, col], fn, kind)
+        out[col] = out[col].astype(object)
+        out.loc[present, col] = values
+        status.loc[present, col] = states
+    return out, status
+
+
 def get_layout_fingerprint(img):
     """画像からレイアウト特徴量（フィンガープリント）を生成"""
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -65,53 +199,114 @@ def get_layout_fingerprint(img):
                                    cv2.THRESH_BINARY_INV, 11, 2)
     return cv2.GaussianBlur(binary, (21, 21), 0)
 
+def layout_fingerprints(images, workers: int = FINGERPRINT_WORKERS):
+    """画像群のフィンガープリントをスレッドで並列に計算（順序は images と同じ）"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(images) < 2:
+        return [get_layout_fingerprint(m) for m in images]
+    with ThreadPoolExecutor(min(workers, len(images))) as executor:
+        return list(executor.map(get_layout_fingerprint, images))
+
+def layout_embedding(fp, size=(75, 100)):
+    """
+    フィンガープリントを縮小・平均0・長さ1にした float16 ベクトル（120KB → 15KB）
+
+    フィンガープリントは強くぼかしてあるので縮小しても相関はほぼ変わらず、
+    2つの埋め込みの内積が正規化相関の近似になる。分散0（白紙）は0ベクトル。
+    """
+    vec = cv2.resize(np.asarray(fp), size, interpolation=cv2.INTER_AREA).reshape(-1).astype(np.float32)
+    vec -= vec.mean()
+    norm = np.linalg.norm(vec)
+    return (vec / norm if norm > 0 else vec).astype(np.float16)
+
+def similarity_matrix(fps, chunk_pixels: int = 16384):
+    """
+    全フィンガープリント間の正規化相関（cv2.TM_CCOEFF_NORMED と同じ値）を一括で計算
+
+    同じサイズ同士の matchTemplate は1点だけの正規化相関なので、各画像を平坦化して
+    グラム行列 X·Xᵀ を画素の区間ごとに積み上げ、平均を引いて分散で割る。
+    メモリはページ数×chunk_pixels 分だけで済む。分散0（白紙）を含む組は従来のループと同じ値にする
+    （後ろのページが白紙なら1、前のページだけが白紙なら0）。
+    """
+    num = len(fps)
+    flat = np.stack([np.asarray(fp).reshape(-1) for fp in fps])
+    pixels = flat.shape[1]
+    gram = np.zeros((num, num))
+    for start in range(0, pixels, chunk_pixels):
+        block = flat[:, start:start + chunk_pixels].astype(np.float64)
+        gram += block @ block.T
+    sums = flat.sum(axis=1, dtype=np.float64)
+    cov = gram - np.outer(sums, sums) / pixels
+    var = np.clip(np.diag(cov), 0, None)
+    denom = np.sqrt(np.outer(var, var))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(denom > 0, cov / denom, 0.0)
+    # matchTemplate(fps[i], fps[j]) (i <= j) と同じ扱い: テンプレート側 j が一様なら1
+    flat_page = var <= 0
+    score[:, flat_page] = 1.0
+    upper = np.triu(np.clip(score, -1.0, 1.0))
+    return upper + np.triu(upper, 1).T
+
 def perform_clustering(images):
     """画像群をレイアウト類似度でクラスタリング"""
-    num = len(images)
-    if num < 2: return [0]
-    fps = [get_layout_fingerprint(m) for m in images]
-    dist_matrix = np.zeros((num, num))
-    for i in range(num):
-        for j in range(i, num):
-            res = cv2.matchTemplate(fps[i], fps[j], cv2.TM_CCOEFF_NORMED)
-            _, score, _, _ = cv2.minMaxLoc(res)
-            dist_matrix[i, j] = dist_matrix[j, i] = 1 - score
-    return AgglomerativeClustering(n_clusters=None, distance_threshold=0.4, 
+    return cluster_fingerprints(layout_fingerprints(images))
+
+def cluster_fingerprints(fps, scalable_above: int = CLUSTER_SCALABLE_ABOVE):
+    """
+    計算済みのフィンガープリント群をクラスタリング（perform_clustering と同じラベル）
+
+    scalable_above ページ以下は全ページ間の距離行列で完全連結法、それを超えたら leader_clustering。
+    """
+    num = len(fps)
+    if num < 2: return [0] * num
+    if num > scalable_above:
+        return leader_clustering([layout_embedding(fp) for fp in fps])
+    dist_matrix = 1 - similarity_matrix(fps)
+    return AgglomerativeClustering(n_clusters=None, distance_threshold=CLUSTER_DISTANCE, 
                                    metric='precomputed', linkage='complete').fit(dist_matrix).labels_
 
+def leader_clustering(embeddings, threshold: float = CLUSTER_DISTANCE, block: int = 256):
+    """
+    埋め込み（layout_embedding）を先頭から順に代表ページ（leader）へ割り当てるクラスタリング
+
+    各ページは距離 threshold 以内で最も近い代表に入り、どれにも入らなければ新しい代表になる。
+    その後、全ページを最終的な代表のうち最も近いものへ割り当て直す（先に来たページの偏りを減らす）。
+    block ページずつ代表との内積をまとめて計算するので、時間はページ数×様式数、
+    メモリは埋め込みと代表の分だけ（距離行列を作らない）。
+    """
+    emb = np.asarray(embeddings)
+    num = len(emb)
+    if num < 2: return np.zeros(num, dtype=int)
+    leaders = np.empty((0, emb.shape[1]), dtype=np.float32)
+    if not emb.any():
+        return np.zeros(num, dtype=int)
+    for start in range(0, num, block):
+        vecs = emb[start:start + block].astype(np.float32)
+        to_leaders = vecs @ leaders.T
+        within = vecs @ vecs.T
+        new = []  # このブロックで代表になったページ（ブロック内の位置）
+        for i in range(len(vecs)):
+            best = to_leaders[i].max() if len(leaders) else -np.inf
+            if new:
+                best = max(best, within[i, new].max())
+            if 1 - best > threshold:
+                new.append(i)
+        if new:
+            leaders = np.vstack([leaders, vecs[new]])
+    labels = np.empty(num, dtype=int)
+    for start in range(0, num, block):
+        labels[start:start + block] = (emb[start:start + block].astype(np.float32) @ leaders.T).argmax(axis=1)
+    # 白紙（0ベクトル）はどの代表とも相関0なので、白紙どうしで1つのグループにする
+    labels[~emb.any(axis=1)] = len(leaders)
+    # 先に現れた様式から 0, 1, ... と番号を振り直す
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    return np.argsort(np.argsort(first))[inverse]
+
 def extract_text_from_roi(words_data, roi):
     """
     OCR結果からROI内のテキストを文字単位で抽出（横書き1行想定）
     
     各文字の中心座標がROI内にあるかで判定。wordの幅を文字数で等分して推定。
+    同じページで複数ROIを抽出する場合は roi_index.WordIndex を直接使うと速い。
     """
-    matched_chars = []
-    rx, ry, rw, rh = roi['x'], roi['y'], roi['w'], roi['h']
-    roi_x2, roi_y2 = rx + rw, ry + rh
-    
-    for word in words_data:
-        points = word.get('points', [])
-        content = word.get('content', '')
-        if len(points) < 4 or not content:
-            continue
-            
-        xs = [p[0] for p in points]
-        ys = [p[1] for p in points]
-        wx1, wy1 = min(xs), min(ys)
-        wx2, wy2 = max(xs), max(ys)
-        
-        cy = (wy1 + wy2) / 2
-        if not (ry <= cy <= roi_y2):
-            continue
-        
-        char_count = len(content)
-        word_width = wx2 - wx1
-        char_width = word_width / char_count if char_count > 0 else 0
-        
-        for i, char in enumerate(content):
-            char_cx = wx1 + char_width * (i + 0.5)
-            if rx <= char_cx <= roi_x2:
-                matched_chars.append({"char": char, "x": char_cx})
-
-    matched_chars.sort(key=lambda k: k['x'])
-    return "".join([m['char'] for m in matched_chars])
\ No newline at end of file
+    return WordIndex(words_data).extract(roi)
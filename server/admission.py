@@ -0,0 +1,166 @@
+"""受付制御: 推論待ちの上限、リクエストごとの期限、クライアント切断の検出"""
+import math
+import time
+from typing import Callable, Optional
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+
+class Overloaded(Exception):
+    """推論待ちが上限に達している（429 + Retry-After で返す）"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """推論開始前にリクエストの期限が過ぎた"""
+
+
+class ClientDisconnected(Exception):
+    """推論開始前にクライアントが切断した"""
+
+
+class RequestGuard:
+    """
+    1リクエスト分の期限とクライアント接続状態
+
+    推論に入る直前に check() を呼び、誰も受け取らない結果のために
+    GPUを使わないようにする。
+    """
+
+    def __init__(self, request: Optional[Request] = None, timeout: Optional[float] = None):
+        self.request = request
+        self.deadline = time.monotonic() + timeout if timeout else None
+
+    def remaining(self) -> Optional[float]:
+        """期限までの残り秒数（期限なしはNone）"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    async def check(self):
+        """期限切れ・切断済みなら例外を送出"""
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded before inference")
+        if self.request is not None and await self.request.is_disconnected():
+            raise ClientDisconnected("Client disconnected before inference")
+
+
+class AdmissionControl:
+    """
+    処理中OCR画像数の上限と Retry-After の見積もり
+
+    処理中の画像数（1画像のリクエストは1、複数ページのリクエストはページ数）のうち
+    同時に推論できる数（capacity）を超えた分を待ち行列とみなし、それが
+    max_waiting に達したら新しいリクエストを断る。Retry-After は直近の推論時間
+    （1画像あたり）の指数移動平均から、待ち行列がはけるまでの時間を見積もる。
+    """
+
+    def __init__(self, max_waiting: int, capacity: int, alpha: float = 0.2):
+        self.max_waiting = max_waiting
+        self.capacity = max(1, capacity)
+        self.alpha = alpha
+        self.in_flight = 0
+        self.seconds_per_image = 1.0  # 実測が入るまでの仮の値
+
+    @property
+    def waiting(self) -> int:
+        return max(0, self.in_flight - self.capacity)
+
+    def acquire(self, units: int = 1):
+        """
+        units 枚分を受け付ける。待ち行列が満杯なら Overloaded（0以下で無制限）
+
+        判定は受け付ける前の待ち行列で行う（上限より多いページのPDFも、空いていれば受け付ける）。
+        """
+        if self.max_waiting > 0 and self.waiting >= self.max_waiting:
+            raise Overloaded(self.retry_after())
+        self.in_flight += units
+
+    def release(self, units: int = 1):
+        self.in_flight -= units
+
+    def observe(self, seconds: float, num_images: int = 1):
+        """推論1回の所要時間を記録"""
+        per_image = seconds / max(1, num_images)
+        self.seconds_per_image += self.alpha * (per_image - self.seconds_per_image)
+
+    def retry_after(self) -> int:
+        """待ち行列がはけるまでの見込み秒数（1〜60秒）"""
+        estimate = (self.waiting + 1) * self.seconds_per_image / self.capacity
+        return min(60, max(1, math.ceil(estimate)))
+
+
+class AdmissionTicket:
+    """
+    1リクエストが処理中として数えている画像数
+
+    AdmissionMiddleware が1枚分で受け付け、scope["state"]["admission"] に置く。
+    複数ページのエンドポイントはページ数が分かった時点で expand() し、
+    ページが終わるごとに page_done() で減らす。残りは応答の終了時に解放される。
+    """
+
+    def __init__(self, control: AdmissionControl):
+        self.control = control
+        self.units = 0
+
+    def acquire(self, units: int = 1):
+        self.control.acquire(units)
+        self.units += units
+
+    def expand(self, units: int):
+        """数えている枚数を units に増やす（待ち行列が満杯なら Overloaded）"""
+        if units > self.units:
+            self.acquire(units - self.units)
+
+    def page_done(self):
+        if self.units > 0:
+            self.units -= 1
+            self.control.release()
+
+    def close(self):
+        self.control.release(self.units)
+        self.units = 0
+
+
+class AdmissionMiddleware:
+    """
+    OCRエンドポイントの受付制御（ASGIミドルウェア）
+
+    リクエスト本体を読む前に判定し、満杯なら 429 + Retry-After を返す。
+    ストリーミング応答も含めて応答を送り終える（または切断される）まで
+    処理中として数えるため、エンドポイント側で解放漏れが起きない。
+    """
+
+    def __init__(self, app, control: AdmissionControl, paths: set[str], on_reject: Optional[Callable[[], None]] = None):
+        self.app = app
+        self.control = control
+        self.paths = paths
+        self.on_reject = on_reject
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        ticket = AdmissionTicket(self.control)
+        try:
+            ticket.acquire()
+        except Overloaded as e:
+            if self.on_reject is not None:
+                self.on_reject()
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": str(e)},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        scope.setdefault("state", {})["admission"] = ticket
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            ticket.close()
@@ -0,0 +1,308 @@
+"""マイクロバッチング: 短時間に到着したOCRリクエストをまとめてYomiTokuに流す"""
+import asyncio
+import unicodedata
+import warnings
+from importlib.metadata import PackageNotFoundError, version
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+# バッチ推論はYomiTokuの内部API（detector.preprocess/postprocess, recognizer._cfg,
+# ParseqDataset, ocr_aggregate）を使うので、確認したバージョンでだけ有効にする
+YOMITOKU_BATCHING_VERSION = "0.10.3"
+
+
+def installed_yomitoku_version() -> Optional[str]:
+    """インストールされているYomiTokuのバージョン（import せずに調べる。未導入なら None）"""
+    try:
+        return version("yomitoku")
+    except PackageNotFoundError:
+        return None
+
+
+YOMITOKU_VERSION = installed_yomitoku_version()
+BATCHING_SUPPORTED = YOMITOKU_VERSION == YOMITOKU_BATCHING_VERSION
+if YOMITOKU_VERSION is not None and not BATCHING_SUPPORTED:
+    warnings.warn(
+        f"yomitoku {YOMITOKU_VERSION} is installed but batched OCR was written for {YOMITOKU_BATCHING_VERSION}; "
+        "falling back to one image per engine call",
+        RuntimeWarning,
+    )
+
+
+def ocr_single(engine, img: np.ndarray) -> list:
+    """1枚の画像をOCRしてwordsリストを返す（従来の engine(img) 経路）"""
+    results, _ = engine(img)
+    try:
+        res_dict = results.model_dump()
+    except AttributeError:
+        res_dict = results.dict()
+    return res_dict.get('words', [])
+
+
+def supports_batching(engine) -> bool:
+    """エンジンが検出器・認識器を個別に持つ（YomiToku OCR互換）、かつ内部APIを確認したバージョンか"""
+    return BATCHING_SUPPORTED and hasattr(engine, "detector") and hasattr(engine, "recognizer")
+
+
+def detect_batch(detector, imgs: list[np.ndarray]) -> list[tuple[list, list]]:
+    """
+    複数画像の文字領域検出をまとめて実行
+
+    前処理後のテンソル形状が同じ画像同士を1バッチにする（同サイズのスキャンは
+    すべて同じ形状になる）。パディングしないので結果は1枚ずつの場合と同一。
+
+    Returns:
+        各画像の (quads, scores)
+    """
+    import torch
+
+    tensors = [detector.preprocess(img) for img in imgs]
+    groups: dict[tuple, list[int]] = {}
+    for i, t in enumerate(tensors):
+        groups.setdefault(tuple(t.shape), []).append(i)
+
+    outputs = [None] * len(imgs)
+    for indices in groups.values():
+        batch = torch.cat([tensors[i] for i in indices], 0)
+        if detector.infer_onnx:
+            results = detector.sess.run(["output"], {"input": batch.numpy()})
+            preds = {"binary": torch.tensor(results[0])}
+        else:
+            with torch.inference_mode():
+                preds = detector.model(batch.to(detector.device))
+
+        for j, i in enumerate(indices):
+            item_preds = {
+                k: v[j:j + 1] if torch.is_tensor(v) else v
+                for k, v in preds.items()
+            }
+            h, w = imgs[i].shape[:2]
+            outputs[i] = detector.postprocess(item_preds, (h, w))
+    return outputs
+
+
+def text_directions(points: list) -> list[str]:
+    """四角形の縦横比から書字方向を判定（YomiToku TextRecognizer と同じ規則）"""
+    directions = []
+    for point in points:
+        point = np.array(point)
+        w = np.linalg.norm(point[0] - point[1])
+        h = np.linalg.norm(point[1] - point[2])
+        directions.append("vertical" if h > w * 2 else "horizontal")
+    return directions
+
+
+def recognize_batch(recognizer, imgs: list[np.ndarray], points_list: list[list]) -> list[tuple[list, list, list]]:
+    """
+    複数画像の文字認識をまとめて実行
+
+    全画像の切り出し領域を連結し、認識器の batch_size ごとに推論してから
+    画像ごとに分配する。
+
+    Returns:
+        各画像の (contents, scores, directions)
+    """
+    import torch
+    from yomitoku.data.dataset import ParseqDataset
+
+    crops = []
+    counts = []
+    for img, points in zip(imgs, points_list):
+        dataset = ParseqDataset(recognizer._cfg, img, points)
+        crops.extend(dataset[i] for i in range(len(dataset)))
+        counts.append(len(dataset))
+
+    contents, scores = [], []
+    batch_size = recognizer._cfg.data.batch_size
+    for start in range(0, len(crops), batch_size):
+        data = torch.stack(crops[start:start + batch_size], 0)
+        if recognizer.infer_onnx:
+            results = recognizer.sess.run(["output"], {"input": data.numpy()})
+            p = torch.tensor(results[0])
+        else:
+            with torch.inference_mode():
+                p = recognizer.model(data.to(recognizer.device)).softmax(-1)
+        pred, score = recognizer.tokenizer.decode(p)
+        contents.extend(unicodedata.normalize("NFKC", x) for x in pred)
+        scores.extend(score)
+
+    outputs = []
+    offset = 0
+    for points, count in zip(points_list, counts):
+        outputs.append((
+            contents[offset:offset + count],
+            scores[offset:offset + count],
+            text_directions(points),
+        ))
+        offset += count
+    return outputs
+
+
+def build_words(quads: list, det_scores: list, contents: list, rec_scores: list, directions: list) -> list:
+    """検出・認識結果を engine(img) と同じ形式のwordsリストに組み立てる"""
+    from yomitoku.ocr import ocr_aggregate
+    from yomitoku.schemas import OCRSchema, TextDetectorSchema, TextRecognizerSchema
+
+    det = TextDetectorSchema(points=quads, scores=det_scores)
+    rec = TextRecognizerSchema(
+        contents=contents, scores=rec_scores, points=quads, directions=directions
+    )
+    return OCRSchema(words=ocr_aggregate(det, rec)).model_dump()['words']
+
+
+def ocr_batch(engine, imgs: list[np.ndarray]) -> list[list]:
+    """
+    複数画像をまとめてOCRし、画像ごとのwordsリストを返す
+
+    YomiToku互換でないエンジン、確認していないバージョンのYomiToku、1枚だけの場合は
+    従来の経路で1枚ずつ処理する。
+    """
+    if len(imgs) == 1 or not supports_batching(engine):
+        return [ocr_single(engine, img) for img in imgs]
+
+    dets = detect_batch(engine.detector, imgs)
+    recs = recognize_batch(engine.recognizer, imgs, [quads for quads, _ in dets])
+    return [
+        build_words(quads, det_scores, contents, rec_scores, directions)
+        for (quads, det_scores), (contents, rec_scores, directions) in zip(dets, recs)
+    ]
+
+
+class MicroBatcher:
+    """
+    OCRリクエストを時間窓で集めてバッチ推論するスケジューラ
+
+    最初のリクエストから max_wait_ms 以内に届いたもの（最大 max_batch_size 件）を
+    1バッチとし、semaphore を1つ取得して run_batch に渡す。結果は各呼び出し元の
+    Future に個別に返す。semaphore 待ちの間に届いたリクエストも同じバッチに詰める。
+    推論直前に各リクエストの precheck を呼び、例外を送出したもの（期限切れ・切断など）は
+    バッチから外す。
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[np.ndarray]], list[list]],
+        semaphore: asyncio.Semaphore,
+        max_batch_size: int,
+        max_wait_ms: float,
+        on_dispatch: Optional[Callable[[list[float]], None]] = None,
+    ):
+        self.run_batch = run_batch
+        self.on_dispatch = on_dispatch
+        self.semaphore = semaphore
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+        self.waiting = 0  # 推論開始待ちのリクエスト数
+        self.running = 0  # 推論中のリクエスト数
+
+    def start(self):
+        """バッチ収集ループを開始"""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._collect_loop())
+
+    async def stop(self):
+        """バッチ収集ループを停止し、実行中のバッチの完了を待つ"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    @property
+    def pending(self) -> int:
+        """バッチ待ちのリクエスト数"""
+        return self._queue.qsize()
+
+    async def submit(
+        self,
+        img: np.ndarray,
+        timeout: Optional[float] = None,
+        precheck: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> list:
+        """
+        画像をキューに入れ、自分の分のwordsリストを待つ
+
+        timeout 秒以内に結果が出なければ asyncio.TimeoutError（未推論ならバッチから外れる）。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.waiting += 1
+        await self._queue.put((img, future, loop.time(), precheck))
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    def _fill(self, batch: list):
+        """キューに溜まっている分を上限まで詰める"""
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _collect_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.semaphore.acquire()
+            self._fill(batch)
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: list):
+        loop = asyncio.get_running_loop()
+        self.waiting -= len(batch)
+        # 呼び出し元が既にキャンセルされた分・precheck で弾かれた分は推論しない
+        checks = await asyncio.gather(
+            *(precheck() for _, _, _, precheck in batch if precheck is not None),
+            return_exceptions=True,
+        )
+        checks = iter(checks)
+        admitted = []
+        for img, fut, t, precheck in batch:
+            error = next(checks) if precheck is not None else None
+            if fut.done():
+                continue
+            if isinstance(error, BaseException):
+                fut.set_exception(error)
+                continue
+            admitted.append((img, fut, t))
+        batch = admitted
+        self.running += len(batch)
+        try:
+            if not batch:
+                return
+            if self.on_dispatch is not None:
+                now = loop.time()
+                self.on_dispatch([now - t for _, _, t in batch])
+            try:
+                results = await loop.run_in_executor(
+                    None, self.run_batch, [img for img, _, _ in batch]
+                )
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            for (_, fut, _), words in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(words)
+        finally:
+            self.running -= len(batch)
+            self.semaphore.release()
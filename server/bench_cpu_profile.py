@@ -0,0 +1,115 @@
+"""
+CPU推論プロファイルごとのOCR速度と読み取り結果の一致率を比較するベンチマーク
+
+baseline（最適化なし）の結果を基準に、各プロファイルのページあたりの処理時間、
+baselineに対する高速化率、同じROIから抽出した文字列が一致する割合を表示する。
+torchのスレッド設定はプロセスごとに一度しか変えられず、compile / ONNX の状態も
+持ち越さないよう、プロファイルごとに別プロセスで計測する。
+
+使い方（サーバーと同じ環境で実行）:
+    python bench_cpu_profile.py receipts.pdf --threads 4 --interop-threads 1
+    python bench_cpu_profile.py receipts.pdf --profiles eager quantized onnx --json cpu_profile.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bench_preprocess import agreement, load_pages
+from cpu_profile import PRESETS, CPUProfile, apply_threads
+
+
+def run_profile(options: dict, pages: list, warmup: int) -> tuple[float, list, list]:
+    """1つのプロファイルでエンジンを作って全ページをOCRする（子プロセスで実行）"""
+    from batching import ocr_single
+    from engine_pool import create_engine
+
+    profile = CPUProfile(**options)
+    apply_threads(profile)
+    start = time.perf_counter()
+    engine = create_engine("cpu", profile)
+    for img in pages[:warmup]:
+        ocr_single(engine, img)  # torch.compile はここでコンパイルされる
+    setup = time.perf_counter() - start
+
+    latencies, results = [], []
+    for img in pages:
+        start = time.perf_counter()
+        results.append(ocr_single(engine, img))
+        latencies.append(time.perf_counter() - start)
+    return setup, latencies, results
+
+
+def measure(options: dict, pages: list, warmup: int):
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+        return executor.submit(run_profile, options, pages, warmup).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", help="ベンチマークに使うPDF")
+    parser.add_argument("--dpi", type=int, default=300, help="ページの描画DPI（フロントエンドと同じ）")
+    parser.add_argument(
+        "--profiles", nargs="*", default=[name for name in PRESETS if name != "baseline"],
+        choices=list(PRESETS), help="比較するプロファイル",
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1, help="演算内スレッド数")
+    parser.add_argument("--interop-threads", type=int, default=1, help="演算間スレッド数")
+    parser.add_argument(
+        "--artifact-dir", default=os.environ.get("OCR_ARTIFACT_DIR", os.path.expanduser("~/.cache/ocr-server")),
+        help="compile / ONNX の成果物の保存先",
+    )
+    parser.add_argument("--template", help="ROIテンプレートJSON {\"label\": {\"x\",\"y\",\"w\",\"h\"}}")
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2, help="計測前に空回しするページ数")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    template = None
+    if args.template:
+        with open(args.template, encoding="utf-8") as f:
+            template = json.load(f)
+
+    pages = load_pages(args.pdf, args.dpi, args.max_pages)
+    rows = []
+    baseline = base_median = None
+    for name in ["baseline"] + [p for p in args.profiles if p != "baseline"]:
+        options = dict(
+            PRESETS[name], name=name, intra_threads=args.threads,
+            inter_threads=args.interop_threads, artifact_dir=args.artifact_dir,
+        )
+        setup, latencies, results = measure(options, pages, args.warmup)
+        median = statistics.median(latencies)
+        if baseline is None:
+            baseline, base_median = results, median
+        matched, total = agreement(baseline, results, template)
+        rows.append({
+            "profile": name,
+            "pages": len(latencies),
+            "threads": f"{args.threads}/{args.interop_threads}",
+            "setup_s": round(setup, 1),
+            "median_ms": round(median * 1000, 1),
+            "p95_ms": round(sorted(latencies)[int(0.95 * (len(latencies) - 1))] * 1000, 1),
+            "pages_per_s": round(len(latencies) / sum(latencies), 2),
+            "speedup": round(base_median / median, 2) if median > 0 else None,
+            "agreement": round(matched / total, 4) if total else None,
+            "rois": total,
+        })
+
+    print(f"{'profile':<12}{'setup_s':>9}{'median_ms':>11}{'p95_ms':>9}{'pages/s':>9}{'speedup':>9}{'agreement':>11}")
+    for row in rows:
+        print(
+            f"{row['profile']:<12}{row['setup_s']:>9}{row['median_ms']:>11}{row['p95_ms']:>9}"
+            f"{row['pages_per_s']:>9}{row['speedup']:>9}{row['agreement']:>11}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
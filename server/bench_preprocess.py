@@ -0,0 +1,134 @@
+"""
+推論前の縮小設定ごとのOCR速度と読み取り結果の一致率を比較するベンチマーク
+
+原寸での結果を基準に、各設定で縮小した画像をOCRしてwordsを元の座標に戻し、
+同じROIから抽出した文字列が一致する割合を測る。ROIはテンプレートを指定すればそれを、
+指定しなければ原寸の各wordの外接矩形を使う。
+
+使い方（サーバーと同じ環境で実行）:
+    python bench_preprocess.py receipts.pdf --target-dpi 200 150 --max-side 1600
+    python bench_preprocess.py receipts.pdf --template template.json --grayscale
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Optional
+
+import numpy as np
+
+from batching import ocr_single
+from engine_pool import create_engine
+from preprocess import downscale_factor, prepare_image, rescale_words
+from roi_index import WordIndex
+
+
+def load_pages(pdf_path: str, dpi: int, max_pages: int) -> list[np.ndarray]:
+    """PDFをフロントエンドと同じ方法でBGR画像にする"""
+    from pdf_raster import render_page, page_count
+    n = min(page_count(pdf_path), max_pages)
+    return [render_page(pdf_path, i, dpi) for i in range(n)]
+
+
+def word_rois(words: list) -> list[dict]:
+    """原寸のwordsの外接矩形をROIにする（テンプレート未指定時）"""
+    rois = []
+    for word in words:
+        xs = [p[0] for p in word.get("points", [])]
+        ys = [p[1] for p in word.get("points", [])]
+        if len(xs) < 4 or not word.get("content"):
+            continue
+        rois.append({"x": min(xs), "y": min(ys), "w": max(xs) - min(xs), "h": max(ys) - min(ys)})
+    return rois
+
+
+def run_setting(engine, pages: list, source_dpi: int, target_dpi: float, max_side: int, grayscale: bool):
+    """1つの設定で全ページをOCRし、(ページごとの秒数, 元座標に戻したwordsのリスト) を返す"""
+    latencies, results = [], []
+    for img in pages:
+        img_h, img_w = img.shape[:2]
+        start = time.perf_counter()
+        scale = downscale_factor(img_w, img_h, source_dpi, target_dpi, max_side)
+        small, sx, sy = prepare_image(img, scale, grayscale)
+        words = rescale_words(ocr_single(engine, small), sx, sy, (img_w, img_h))
+        latencies.append(time.perf_counter() - start)
+        results.append(words)
+    return latencies, results
+
+
+def agreement(baseline: list, candidate: list, template: Optional[dict]) -> tuple[int, int]:
+    """基準と同じ文字列が抽出できたROIの数と、ROIの総数"""
+    matched = total = 0
+    for base_words, words in zip(baseline, candidate):
+        rois = list(template.values()) if template else word_rois(base_words)
+        expected = WordIndex(base_words).extract_many(rois)
+        actual = WordIndex(words).extract_many(rois)
+        matched += sum(e == a for e, a in zip(expected, actual))
+        total += len(rois)
+    return matched, total
+
+
+def summarize(name: str, latencies: list, matched: int, total: int, base_median: float) -> dict:
+    median = statistics.median(latencies)
+    return {
+        "setting": name,
+        "pages": len(latencies),
+        "median_ms": round(median * 1000, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "speedup": round(base_median / median, 2) if median > 0 else None,
+        "agreement": round(matched / total, 4) if total else None,
+        "rois": total,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", help="ベンチマークに使うPDF")
+    parser.add_argument("--dpi", type=int, default=300, help="ページの描画DPI（フロントエンドと同じ）")
+    parser.add_argument("--target-dpi", type=float, nargs="*", default=[200, 150], help="比較する推論DPI")
+    parser.add_argument("--max-side", type=int, nargs="*", default=[], help="比較する長辺の上限px")
+    parser.add_argument("--grayscale", action="store_true", help="各設定をグレースケールでも測る")
+    parser.add_argument("--template", help="ROIテンプレートJSON {\"label\": {\"x\",\"y\",\"w\",\"h\"}}")
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1, help="計測前に空回しするページ数")
+    parser.add_argument("--device", default=os.environ.get("OCR_DEVICE", "cuda"))
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    template = None
+    if args.template:
+        with open(args.template, encoding="utf-8") as f:
+            template = json.load(f)
+
+    pages = load_pages(args.pdf, args.dpi, args.max_pages)
+    engine = create_engine(args.device)
+    for img in pages[:args.warmup]:
+        ocr_single(engine, img)
+
+    settings = [(f"target_dpi={d:g}", d, 0) for d in args.target_dpi]
+    settings += [(f"max_side={m}", 0, m) for m in args.max_side]
+    grays = [False, True] if args.grayscale else [False]
+
+    base_latencies, baseline = run_setting(engine, pages, args.dpi, 0, 0, False)
+    base_median = statistics.median(base_latencies)
+    rows = [summarize("original", base_latencies, *agreement(baseline, baseline, template), base_median)]
+    for gray in grays:
+        if gray:
+            latencies, results = run_setting(engine, pages, args.dpi, 0, 0, True)
+            rows.append(summarize("grayscale", latencies, *agreement(baseline, results, template), base_median))
+        for name, target_dpi, max_side in settings:
+            latencies, results = run_setting(engine, pages, args.dpi, target_dpi, max_side, gray)
+            label = f"{name}+grayscale" if gray else name
+            rows.append(summarize(label, latencies, *agreement(baseline, results, template), base_median))
+
+    print(f"{'setting':<28}{'median_ms':>11}{'speedup':>9}{'agreement':>11}{'rois':>7}")
+    for row in rows:
+        print(f"{row['setting']:<28}{row['median_ms']:>11}{row['speedup']:>9}{row['agreement']:>11}{row['rois']:>7}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+OCRサーバーの負荷試験（GPU・モデルなしでサーバーの処理経路を測る）
+
+推論を一定時間スリープするだけの決定的なフェイクエンジンに差し替えたサーバーを
+MAX_CONCURRENT_OCR の設定ごとに別プロセスで起動し、合成したレシート画像を
+同時接続数を変えながら /ocr に送る。応答時間の p50/p95/p99、ページ/秒、
+推論枠の待ち時間（/metrics の ocr_semaphore_wait_seconds）をJSONで保存し、
+--baseline で以前の結果と比べて劣化していれば終了コード1を返す。
+
+結果キャッシュは使わず（X-OCR-Cache: bypass）、エンジンはサーバープロセス内で
+動かす（OCR_WORKERS=1。ワーカープロセスにはフェイクエンジンを渡せないため）。
+
+使い方:
+    python bench_server.py --max-concurrent 1 2 4 --concurrency 1 4 16 --json bench.json
+    python bench_server.py --latency-ms 80 --batch-size 4 --baseline bench.json
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import cv2
+import numpy as np
+
+# 合成画像のサイズ（300DPI換算）: 80mmロール紙のレシート / A4スキャン
+PAGE_SIZES = {
+    "receipt": (945, 2400),
+    "a4": (2480, 3508),
+}
+
+
+class FakeResults:
+    """YomiToku の結果オブジェクト互換（model_dump のみ）"""
+
+    def __init__(self, words: list):
+        self.words = words
+
+    def model_dump(self) -> dict:
+        return {"words": self.words}
+
+
+class FakeEngine:
+    """
+    決定的なフェイクOCRエンジン
+
+    1枚あたり latency_ms + per_megapixel_ms × 画素数(MP) だけスリープし（GILを手放すので
+    GPU推論と同じく他のリクエスト処理を妨げない）、画像サイズから決まる位置に
+    words_per_page 個のwordを返す。
+    """
+
+    def __init__(self, latency_ms: float = 50, per_megapixel_ms: float = 0, words_per_page: int = 40):
+        self.latency_ms = latency_ms
+        self.per_megapixel_ms = per_megapixel_ms
+        self.words_per_page = words_per_page
+
+    def latency(self, img: np.ndarray) -> float:
+        """1枚の推論時間（秒）"""
+        megapixels = img.shape[0] * img.shape[1] / 1e6
+        return (self.latency_ms + self.per_megapixel_ms * megapixels) / 1000
+
+    def words(self, img: np.ndarray) -> list:
+        img_h, img_w = img.shape[:2]
+        n = self.words_per_page
+        line_h = max(1, img_h // max(1, n))
+        return [
+            {
+                "points": [[20, i * line_h], [img_w - 20, i * line_h], [img_w - 20, (i + 1) * line_h], [20, (i + 1) * line_h]],
+                "content": f"品目{i:03d} ¥{(i * 137) % 10000:,}",
+                "direction": "horizontal",
+                "det_score": 0.99,
+                "rec_score": 0.98,
+            }
+            for i in range(n)
+        ]
+
+    def __call__(self, img: np.ndarray):
+        time.sleep(self.latency(img))
+        return FakeResults(self.words(img)), None
+
+
+def receipt_image(seed: int, size: str = "receipt") -> np.ndarray:
+    """
+    合成レシート画像（BGR）
+
+    白地に店名・明細行・罫線・合計を描き、スキャンらしく少しノイズを乗せる。
+    同じ seed なら同じ画像になる。
+    """
+    rng = random.Random(seed)
+    img_w, img_h = PAGE_SIZES[size]
+    img = np.full((img_h, img_w, 3), 255, dtype=np.uint8)
+    scale = img_w / 945
+    font = cv2.FONT_HERSHEY_SIMPLEX
+
+    def text(s: str, x: int, y: int, size: float = 1.2, thickness: int = 2):
+        cv2.putText(img, s, (int(x * scale), int(y * scale)), font, size * scale, (20, 20, 20), int(thickness * scale) or 1)
+
+    text(f"STORE #{rng.randint(100, 999)}", 250, 120, 2.0, 4)
+    text(f"2024/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d} {rng.randint(8, 21):02d}:{rng.randint(0, 59):02d}", 60, 220)
+    y, total = 320, 0
+    while y < img_h / scale - 400:
+        price = rng.randint(1, 300) * 10
+        total += price
+        text(f"ITEM {rng.randint(1000, 9999)}", 60, y)
+        text(f"{price:>6,}", 680, y)
+        y += rng.randint(55, 80)
+    cv2.line(img, (int(40 * scale), int((y + 10) * scale)), (int(905 * scale), int((y + 10) * scale)), (0, 0, 0), max(1, int(3 * scale)))
+    text("TOTAL", 60, y + 90, 1.6, 3)
+    text(f"{total:>7,}", 620, y + 90, 1.6, 3)
+
+    noise = np.random.default_rng(seed).integers(0, 24, img.shape[:2], dtype=np.uint8)
+    return cv2.subtract(img, cv2.merge([noise, noise, noise]))
+
+
+def encode_image(img: np.ndarray) -> str:
+    """フロントエンドと同じPNGのbase64"""
+    ok, buf = cv2.imencode(".png", img)
+    return base64.b64encode(buf.tobytes()).decode("ascii")
+
+
+def serve(port: int, latency_ms: float, per_megapixel_ms: float, words_per_page: int):
+    """フェイクエンジンを組み込んだサーバーを起動（子プロセスで実行）"""
+    import uvicorn
+
+    import ocr_server
+    ocr_server.ocr_engine = FakeEngine(latency_ms, per_megapixel_ms, words_per_page)
+    uvicorn.run(ocr_server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, max_concurrent: int, workdir: str) -> tuple[subprocess.Popen, str]:
+    """MAX_CONCURRENT_OCR を指定してサーバーを起動し、/health が応答するまで待つ"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        MAX_CONCURRENT_OCR=str(max_concurrent),
+        OCR_MAX_BATCH_SIZE=str(args.batch_size),
+        OCR_BATCH_WAIT_MS=str(args.batch_wait_ms),
+        OCR_WORKERS="1",
+        OCR_CACHE_MAX_MB="0",
+        OCR_CACHE_DIR="",
+        OCR_MAX_QUEUE="0",
+        OCR_JOB_DB=os.path.join(workdir, "jobs.sqlite3"),
+    )
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--serve", str(port),
+        "--latency-ms", str(args.latency_ms), "--per-megapixel-ms", str(args.per_megapixel_ms),
+        "--words", str(args.words),
+    ]
+    proc = subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=1):
+                return proc, base_url
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Benchmark server did not become ready")
+
+
+def stop_server(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+def post_ocr(base_url: str, body: bytes, timeout: float) -> tuple[int, float]:
+    """/ocr に1件送り、(ステータス, 応答時間秒) を返す"""
+    request = urllib.request.Request(
+        f"{base_url}/ocr",
+        data=body,
+        headers={"Content-Type": "application/json", "X-OCR-Cache": "bypass"},
+        method="POST",
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def scrape_histogram(base_url: str, name: str) -> dict:
+    """/metrics からヒストグラム1つの累積バケット・合計・件数を読む"""
+    with urllib.request.urlopen(f"{base_url}/metrics", timeout=10) as response:
+        text = response.read().decode("utf-8")
+    buckets: dict[float, float] = {}
+    total = count = 0.0
+    for line in text.splitlines():
+        if line.startswith(f"{name}_bucket"):
+            le = line.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float("inf") if le == "+Inf" else float(le)] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_sum"):
+            total = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count"):
+            count = float(line.rsplit(" ", 1)[1])
+    return {"buckets": buckets, "sum": total, "count": count}
+
+
+def histogram_delta(before: dict, after: dict, q: float) -> tuple[Optional[float], Optional[float]]:
+    """2時点の差分から (平均, 分位点q の上限バケット) を秒で返す"""
+    count = after["count"] - before["count"]
+    if count <= 0:
+        return None, None
+    mean = (after["sum"] - before["sum"]) / count
+    for le in sorted(after["buckets"]):
+        if after["buckets"][le] - before["buckets"].get(le, 0) >= q * count:
+            return mean, le
+    return mean, None
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run_load(base_url: str, bodies: list[bytes], concurrency: int, num_requests: int, timeout: float) -> dict:
+    """concurrency 本のスレッドで合計 num_requests 件を送り続ける"""
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            status, seconds = post_ocr(base_url, bodies[i % len(bodies)], timeout)
+            with lock:
+                statuses.append(status)
+                if status == 200:
+                    latencies.append(seconds)
+
+    wait_before = scrape_histogram(base_url, "ocr_semaphore_wait_seconds")
+    infer_before = scrape_histogram(base_url, "ocr_inference_seconds")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    wall = time.perf_counter() - start
+    wait_mean, wait_p95 = histogram_delta(wait_before, scrape_histogram(base_url, "ocr_semaphore_wait_seconds"), 0.95)
+    infer_mean, _ = histogram_delta(infer_before, scrape_histogram(base_url, "ocr_inference_seconds"), 0.95)
+
+    def ms(seconds: Optional[float]) -> Optional[float]:
+        return None if seconds is None or seconds == float("inf") else round(seconds * 1000, 1)
+
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "ok": len(latencies),
+        "errors": len(statuses) - len(latencies),
+        "wall_s": round(wall, 3),
+        "pages_per_s": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "p50_ms": ms(percentile(latencies, 0.50)) if latencies else None,
+        "p95_ms": ms(percentile(latencies, 0.95)) if latencies else None,
+        "p99_ms": ms(percentile(latencies, 0.99)) if latencies else None,
+        "mean_ms": ms(statistics.mean(latencies)) if latencies else None,
+        "queue_wait_mean_ms": ms(wait_mean),
+        "queue_wait_p95_le_ms": ms(wait_p95),
+        "inference_mean_ms": ms(infer_mean),
+    }
+
+
+def compare(runs: list, baseline_runs: list, tolerance: float) -> list[str]:
+    """同じ設定の以前の結果より p95 が悪化・スループットが低下したものを列挙"""
+    previous = {(r["max_concurrent"], r["concurrency"]): r for r in baseline_runs}
+    regressions = []
+    for run in runs:
+        base = previous.get((run["max_concurrent"], run["concurrency"]))
+        if base is None:
+            continue
+        label = f"max_concurrent={run['max_concurrent']} concurrency={run['concurrency']}"
+        if run["p95_ms"] and base["p95_ms"] and run["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {base['p95_ms']}ms -> {run['p95_ms']}ms")
+        if run["pages_per_s"] and base["pages_per_s"] and run["pages_per_s"] < base["pages_per_s"] * (1 - tolerance):
+            regressions.append(f"{label}: pages/s {base['pages_per_s']} -> {run['pages_per_s']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-concurrent", type=int, nargs="*", default=[1, 2, 4], help="比較する MAX_CONCURRENT_OCR")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16], help="同時接続数")
+    parser.add_argument("--requests", type=int, default=200, help="同時接続数ごとのリクエスト数")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前に送るリクエスト数")
+    parser.add_argument("--latency-ms", type=float, default=50, help="フェイクエンジンの1枚あたりの推論時間")
+    parser.add_argument("--per-megapixel-ms", type=float, default=0, help="画素数(MP)あたりの追加推論時間")
+    parser.add_argument("--words", type=int, default=40, help="1ページあたりのword数")
+    parser.add_argument("--batch-size", type=int, default=1, help="OCR_MAX_BATCH_SIZE")
+    parser.add_argument("--batch-wait-ms", type=float, default=10, help="OCR_BATCH_WAIT_MS")
+    parser.add_argument("--size", choices=list(PAGE_SIZES), default="receipt", help="合成画像のサイズ")
+    parser.add_argument(
+        "--images", type=int, default=32,
+        help="使い回す合成画像の枚数（同時接続数より少ないと同一画像の統合で推論回数が減る）",
+    )
+    parser.add_argument("--timeout", type=float, default=120, help="1リクエストのタイムアウト秒")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較する以前の結果JSON（劣化があれば終了コード1）")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="劣化とみなす変化率")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.latency_ms, args.per_megapixel_ms, args.words)
+        return
+
+    bodies = [
+        json.dumps({"image_base64": encode_image(receipt_image(seed, args.size))}).encode("utf-8")
+        for seed in range(args.images)
+    ]
+    runs = []
+    for max_concurrent in args.max_concurrent:
+        workdir = tempfile.mkdtemp(prefix="ocr-bench-")
+        proc, base_url = start_server(args, max_concurrent, workdir)
+        try:
+            run_load(base_url, bodies, 1, args.warmup, args.timeout)
+            for concurrency in args.concurrency:
+                run = {"max_concurrent": max_concurrent, **run_load(base_url, bodies, concurrency, args.requests, args.timeout)}
+                runs.append(run)
+                print(
+                    f"max_concurrent={max_concurrent:<3} concurrency={concurrency:<4} "
+                    f"p50={run['p50_ms']}ms p95={run['p95_ms']}ms p99={run['p99_ms']}ms "
+                    f"pages/s={run['pages_per_s']} queue_wait={run['queue_wait_mean_ms']}ms errors={run['errors']}"
+                )
+        finally:
+            stop_server(proc)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "config": {
+            "latency_ms": args.latency_ms,
+            "per_megapixel_ms": args.per_megapixel_ms,
+            "words": args.words,
+            "batch_size": args.batch_size,
+            "batch_wait_ms": args.batch_wait_ms,
+            "size": args.size,
+            "requests": args.requests,
+        },
+        "runs": runs,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(runs, json.load(f)["runs"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""CPU推論プロファイル: スレッド数・channels_last・int8量子化・torch.compile / ONNX Runtime"""
+import os
+from typing import Optional
+
+# OCR_CPU_PROFILE で選ぶ既定の組み合わせ（個別の環境変数で上書きできる）
+PRESETS = {
+    "baseline": {"channels_last": False, "quantize": False, "backend": "eager"},
+    "eager": {"channels_last": True, "quantize": False, "backend": "eager"},
+    "quantized": {"channels_last": True, "quantize": True, "backend": "eager"},
+    "compiled": {"channels_last": True, "quantize": False, "backend": "compile"},
+    "onnx": {"channels_last": False, "quantize": False, "backend": "onnx"},
+    "onnx-int8": {"channels_last": False, "quantize": True, "backend": "onnx"},
+}
+BACKENDS = ("eager", "compile", "onnx")
+
+
+def _env_flag(name: str) -> Optional[bool]:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return None
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class CPUProfile:
+    """
+    CPUでのYomiToku推論設定
+
+    - intra_threads / inter_threads: torch（ONNX Runtime）の演算内・演算間スレッド数（0で既定のまま）
+    - channels_last: 検出器（DBNet, CNN）の重みと入力を NHWC レイアウトにする
+    - quantize: 認識器（PARSeq, Transformer）の Linear を動的int8量子化する
+    - backend: "eager"（そのまま）/ "compile"（torch.compile）/ "onnx"（ONNX Runtime）
+
+    compile / onnx の成果物は artifact_dir に保存し、再起動やワーカー間で使い回す。
+    """
+
+    def __init__(
+        self,
+        name: str = "baseline",
+        intra_threads: int = 0,
+        inter_threads: int = 0,
+        channels_last: bool = False,
+        quantize: bool = False,
+        backend: str = "eager",
+        artifact_dir: str = "",
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown OCR CPU backend: {backend} (expected one of {BACKENDS})")
+        self.name = name
+        self.intra_threads = intra_threads
+        self.inter_threads = inter_threads
+        self.channels_last = channels_last
+        self.quantize = quantize
+        self.backend = backend
+        self.artifact_dir = artifact_dir
+
+    @classmethod
+    def from_env(cls, intra_threads: int = 0) -> "CPUProfile":
+        """OCR_CPU_PROFILE（プリセット名）と個別の環境変数から作る"""
+        name = os.environ.get("OCR_CPU_PROFILE", "baseline")
+        if name not in PRESETS:
+            raise ValueError(f"Unknown OCR_CPU_PROFILE: {name} (expected one of {tuple(PRESETS)})")
+        options = dict(PRESETS[name])
+        for key, env in (("channels_last", "OCR_CPU_CHANNELS_LAST"), ("quantize", "OCR_CPU_QUANTIZE")):
+            flag = _env_flag(env)
+            if flag is not None:
+                options[key] = flag
+        options["backend"] = os.environ.get("OCR_CPU_BACKEND") or options["backend"]
+        return cls(
+            name=name,
+            intra_threads=intra_threads,
+            inter_threads=int(os.environ.get("OCR_CPU_INTEROP_THREADS", "0")),
+            artifact_dir=os.environ.get("OCR_ARTIFACT_DIR", os.path.expanduser("~/.cache/ocr-server")),
+            **options,
+        )
+
+    @property
+    def forkable(self) -> bool:
+        """最適化済みエンジンを fork で共有できるか（ONNX Runtime のスレッドプールは fork 後に使えない）"""
+        return self.backend != "onnx"
+
+    def key(self) -> str:
+        """結果が変わりうる設定（キャッシュキー用）"""
+        return f"cpu_backend={self.backend};quantize={int(self.quantize)}"
+
+    def describe(self) -> str:
+        return (
+            f"profile={self.name} backend={self.backend} threads={self.intra_threads}/{self.inter_threads} "
+            f"channels_last={self.channels_last} quantize={self.quantize}"
+        )
+
+
+def apply_threads(profile: CPUProfile):
+    """現在のプロセスのtorchスレッド数を設定"""
+    import torch
+    if profile.intra_threads > 0:
+        torch.set_num_threads(profile.intra_threads)
+    if profile.inter_threads > 0:
+        try:
+            torch.set_num_interop_threads(profile.inter_threads)
+        except RuntimeError:
+            pass  # 既に並列処理が始まっている場合は変更できない
+
+
+def _artifact_path(profile: CPUProfile, name: str) -> str:
+    """成果物のパス（YomiTokuのバージョンごとに分ける）"""
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        yomitoku_version = version("yomitoku")
+    except PackageNotFoundError:
+        yomitoku_version = "unknown"
+    directory = os.path.join(profile.artifact_dir, f"yomitoku-{yomitoku_version}")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def _channels_last(detector):
+    """検出器の重みと入力を channels_last にする（入力は forward 前に変換）"""
+    import torch
+
+    class ChannelsLastInput(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model.to(memory_format=torch.channels_last)
+
+        def forward(self, x):
+            return self.model(x.contiguous(memory_format=torch.channels_last))
+
+    detector.model = ChannelsLastInput(detector.model).eval()
+
+
+def _quantize_recognizer(recognizer):
+    """認識器の Linear を動的int8量子化（tokenizer 等の属性を保つため inplace）"""
+    import torch
+    torch.ao.quantization.quantize_dynamic(
+        recognizer.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def _compile(module, profile: CPUProfile):
+    """torch.compile（Inductorのキャッシュを artifact_dir に置き、再起動後の再コンパイルを省く）"""
+    import torch
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", _artifact_path(profile, "inductor"))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    module.model = torch.compile(module.model, dynamic=True)
+
+
+def _onnx_session(module, profile: CPUProfile, name: str, quantize: bool):
+    """モデルをONNXに書き出し（初回のみ）、ONNX Runtime のセッションに差し替える"""
+    import onnxruntime
+
+    path = _artifact_path(profile, f"{name}.onnx")
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        module.convert_onnx(tmp)
+        os.replace(tmp, path)
+    if quantize:
+        quantized = _artifact_path(profile, f"{name}.int8.onnx")
+        if not os.path.exists(quantized):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            tmp = f"{quantized}.{os.getpid()}.tmp"
+            quantize_dynamic(path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, quantized)
+        path = quantized
+
+    options = onnxruntime.SessionOptions()
+    if profile.intra_threads > 0:
+        options.intra_op_num_threads = profile.intra_threads
+    if profile.inter_threads > 0:
+        options.inter_op_num_threads = profile.inter_threads
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    module.sess = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+    module.infer_onnx = True
+    module.model = None
+
+
+def optimize_engine(engine, profile: CPUProfile):
+    """
+    CPU向けにエンジンを最適化して返す（YomiToku OCR互換の detector / recognizer を持つ場合のみ）
+
+    ONNXは検出器・認識器とも ONNX Runtime のセッションに置き換え、quantize なら
+    認識器のONNXをint8量子化したものを使う。スレッド数は推論するプロセスで apply_threads() する。
+    """
+    if not (hasattr(engine, "detector") and hasattr(engine, "recognizer")):
+        return engine
+    detector, recognizer = engine.detector, engine.recognizer
+
+    if profile.backend == "onnx":
+        _onnx_session(detector, profile, "text_detector", quantize=False)
+        _onnx_session(recognizer, profile, "text_recognizer", quantize=profile.quantize)
+        return engine
+
+    if profile.channels_last:
+        _channels_last(detector)
+    if profile.quantize:
+        _quantize_recognizer(recognizer)
+    if profile.backend == "compile":
+        _compile(detector, profile)
+        _compile(recognizer, profile)
+    return engine
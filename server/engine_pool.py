@@ -0,0 +1,295 @@
+"""OCRエンジンのマルチプロセスプール: ワーカーごとに独立したモデル・スレッド設定"""
+import json
+import multiprocessing as mp
+import multiprocessing.forkserver
+import os
+import queue
+import time
+from typing import Optional
+
+import numpy as np
+
+from batching import ocr_batch
+from cpu_profile import CPUProfile, apply_threads, optimize_engine
+
+
+def create_engine(device: str, profile: Optional[CPUProfile] = None):
+    """YomiToku OCRエンジンを生成（CPUなら profile の最適化を適用）"""
+    from yomitoku import OCR
+    engine = OCR(visualize=False, device=device)
+    if device == "cpu" and profile is not None:
+        engine = optimize_engine(engine, profile)
+    return engine
+
+
+# 起動準備ができるまで待つ秒数（モデルのダウンロード・ロードを含む）
+WORKER_READY_TIMEOUT_SEC = float(os.environ.get("OCR_WORKER_READY_TIMEOUT_SEC", "600"))
+
+# forkserver に共有エンジンのロードを頼む環境変数（値は親のpid・device・CPUProfile のJSON）
+_PRELOAD_ENV = "OCR_ENGINE_POOL_PRELOAD"
+# forkserver プロセスでロードした共有エンジン（ワーカーはここからforkされてコピーオンライトで共有する）
+_preloaded_engine = None
+
+
+def _preload_shared_engine():
+    """
+    forkserver プロセスで import されたときに共有エンジンをロードする
+
+    forkserver はサーバー本体と違ってスレッドを持たないので、そこからforkしたワーカーは
+    イベントループ・スレッドプールの状態を引き継がない。ロードに失敗した場合は
+    各ワーカーが自前でロードする。
+    """
+    global _preloaded_engine
+    spec = os.environ.pop(_PRELOAD_ENV, None)
+    if not spec:
+        return
+    try:
+        spec = json.loads(spec)
+        if spec["parent"] != os.getppid():
+            return  # forkserver でのロードに失敗して、ワーカーが初めて import した
+        profile = CPUProfile(**spec["profile"])
+        # ロード時にtorchの演算スレッドを作らない（スレッド数はfork後に各ワーカーで設定する）
+        apply_threads(CPUProfile(intra_threads=1))
+        _preloaded_engine = create_engine(spec["device"], profile)
+    except Exception as e:
+        print(f"Failed to preload the shared OCR engine in the fork server: {type(e).__name__}: {e}", flush=True)
+
+
+def _worker_main(conn, device: str, num_threads: int, shared: bool = False, profile: Optional[CPUProfile] = None):
+    """
+    ワーカープロセス本体
+
+    shared なら forkserver でロード・最適化済みのエンジンをそのまま使う（重みはコピーオンライトで共有）。
+    それ以外（spawn起動）は自前でロードする。
+    """
+    profile = profile or CPUProfile()
+    profile.intra_threads = num_threads
+    # ワーカー数ぶん並列に動くので、演算間の並列は指定がなければ使わない
+    profile.inter_threads = profile.inter_threads or 1
+    apply_threads(profile)
+
+    engine = _preloaded_engine if shared else None
+    if engine is None:
+        engine = create_engine(device, profile)
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            imgs = conn.recv()
+        except EOFError:
+            break
+        if imgs is None:
+            break
+        try:
+            conn.send(("ok", ocr_batch(engine, imgs)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class EngineWorker:
+    """1つのワーカープロセスとその状態"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[mp.Process] = None
+        self.conn = None
+        self.pid: Optional[int] = None
+        self.state = "starting"
+        self.processed = 0
+        self.errors = 0
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+        self.last_latency_ms: Optional[float] = None
+
+    def status(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "state": self.state,
+            "alive": self.process is not None and self.process.is_alive(),
+            "processed": self.processed,
+            "errors": self.errors,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+            "last_latency_ms": self.last_latency_ms,
+        }
+
+
+class EnginePool:
+    """
+    N個のワーカープロセスにOCRを振り分けるプール
+
+    share_engine=True（CPU推論）では forkserver プロセスで一度だけ重みをロードし、
+    そこからforkした各ワーカーがコピーオンライトでモデルを共有する。サーバー本体
+    （イベントループ・スレッドプールを持つ）は直接forkしないので、再起動時も安全。
+    CUDAと、ONNX Runtime のセッションを持つエンジンはfork後に使えないため、
+    spawnで各ワーカーが個別にロードする。
+
+    ocr_batch() はブロッキングで、空いているワーカーを1つ確保して処理する。
+    run_in_executor から呼ばれる想定。再起動できなかったワーカーは "dead" にして外し、
+    全ワーカーが dead になったら ocr_batch() は例外にする。
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        device: str,
+        threads_per_worker: int,
+        profile: Optional[CPUProfile] = None,
+        share_engine: bool = False,
+        ready_timeout: float = WORKER_READY_TIMEOUT_SEC,
+    ):
+        self.num_workers = num_workers
+        self.device = device
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.profile = profile
+        self.share_engine = share_engine
+        self.ready_timeout = ready_timeout
+        self._ctx = mp.get_context("forkserver" if share_engine else "spawn")
+        self.workers = [EngineWorker(i) for i in range(num_workers)]
+        self._idle: queue.Queue = queue.Queue()
+
+    @property
+    def alive_workers(self) -> int:
+        """dead でないワーカー数"""
+        return sum(worker.state != "dead" for worker in self.workers)
+
+    def start(self):
+        """全ワーカーを起動し、モデルのロード完了を待つ（起動できなかったワーカーは dead）"""
+        if self.share_engine:
+            self._start_forkserver()
+        for worker in self.workers:
+            try:
+                self._spawn(worker)
+            except Exception as e:
+                self._mark_dead(worker, f"start failed: {type(e).__name__}: {e}")
+        for worker in self.workers:
+            if worker.state == "dead":
+                continue
+            try:
+                self._wait_ready(worker)
+            except Exception as e:
+                self._mark_dead(worker, f"start failed: {type(e).__name__}: {e}")
+                continue
+            self._idle.put(worker)
+        if not self.alive_workers:
+            raise RuntimeError(f"No OCR worker could be started: {self.workers[0].last_error}")
+
+    def _start_forkserver(self):
+        """共有エンジンをロードする forkserver を起動する"""
+        profile = self.profile or CPUProfile()
+        self._ctx.set_forkserver_preload([__name__])
+        # forkserver は親の sys.path を引き継がない（Python 3.11）ので、このモジュールの場所を渡す
+        python_path = os.environ.get("PYTHONPATH")
+        os.environ["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(os.path.abspath(__file__))] + ([python_path] if python_path else [])
+        )
+        os.environ[_PRELOAD_ENV] = json.dumps({"parent": os.getpid(), "device": self.device, "profile": vars(profile)})
+        try:
+            multiprocessing.forkserver.ensure_running()
+        finally:
+            # 以降に起動する子プロセス（spawn）にはロードさせない
+            os.environ.pop(_PRELOAD_ENV, None)
+            if python_path is None:
+                os.environ.pop("PYTHONPATH", None)
+            else:
+                os.environ["PYTHONPATH"] = python_path
+
+    def stop(self):
+        """全ワーカーを停止"""
+        for worker in self.workers:
+            try:
+                worker.conn.send(None)
+            except (OSError, AttributeError):
+                pass
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=10)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            worker.state = "stopped"
+
+    def _spawn(self, worker: EngineWorker):
+        parent_conn, child_conn = self._ctx.Pipe()
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.device, self.threads_per_worker, self.share_engine, self.profile),
+            daemon=True,
+            name=f"ocr-worker-{worker.index}",
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.state = "starting"
+
+    def _wait_ready(self, worker: EngineWorker):
+        """ワーカーのロード完了を待つ（ロード中に終了したら EOFError、時間切れなら TimeoutError）"""
+        if not worker.conn.poll(self.ready_timeout):
+            worker.process.terminate()
+            raise TimeoutError(f"OCR worker {worker.index} was not ready within {self.ready_timeout:g}s")
+        kind, pid = worker.conn.recv()
+        worker.pid = pid
+        worker.state = "idle"
+        print(f"OCR worker {worker.index} ready (pid={pid}, threads={self.threads_per_worker})")
+
+    def _restart(self, worker: EngineWorker):
+        """異常終了したワーカーを再起動"""
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+        worker.restarts += 1
+        self._spawn(worker)
+        self._wait_ready(worker)
+
+    def _mark_dead(self, worker: EngineWorker, error: str):
+        """再起動できなかったワーカーを外す（/health の workers に dead として出る）"""
+        worker.state = "dead"
+        worker.last_error = error
+        print(f"OCR worker {worker.index} is dead: {error}")
+
+    def _acquire(self) -> EngineWorker:
+        """空いているワーカーを1つ確保する（全ワーカーが dead なら例外）"""
+        while True:
+            if not self.alive_workers:
+                raise RuntimeError("All OCR workers are dead")
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def ocr_batch(self, imgs: list[np.ndarray]) -> list[list]:
+        """空いているワーカーで画像群をOCRし、画像ごとのwordsリストを返す"""
+        worker = self._acquire()
+        worker.state = "busy"
+        start = time.time()
+        try:
+            worker.conn.send(imgs)
+            kind, payload = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            worker.errors += 1
+            worker.last_error = f"worker crashed: {e}"
+            worker.state = "restarting"
+            try:
+                self._restart(worker)
+            except Exception as restart_error:
+                self._mark_dead(worker, f"worker crashed: {e}; restart failed: {type(restart_error).__name__}: {restart_error}")
+            else:
+                self._idle.put(worker)
+            raise RuntimeError(f"OCR worker {worker.index} crashed") from e
+
+        worker.last_latency_ms = round((time.time() - start) * 1000, 2)
+        worker.state = "idle"
+        self._idle.put(worker)
+        if kind == "error":
+            worker.errors += 1
+            worker.last_error = payload
+            raise RuntimeError(payload)
+        worker.processed += len(imgs)
+        return payload
+
+    def status(self) -> list[dict]:
+        """ワーカーごとの状態"""
+        return [worker.status() for worker in self.workers]
+
+
+# forkserver が preload で import したときだけ共有エンジンをロードする（それ以外では何もしない）
+_preload_shared_engine()
@@ -0,0 +1,215 @@
+"""非同期OCRジョブの永続キュー（SQLite）"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+# ジョブ状態
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    num_pages INTEGER NOT NULL,
+    use_cache INTEGER NOT NULL DEFAULT 1,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+    page_idx INTEGER NOT NULL,
+    image BLOB,
+    words TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, page_idx)
+);
+"""
+
+
+class JobStore:
+    """
+    OCRジョブと各ページの画像・結果をSQLiteに保存する
+
+    キュー待ち・実行中・完了済みのジョブはサーバー再起動後も残る。
+    実行中だったジョブは再起動時にキュー待ちへ戻し、結果が未保存のページだけ再実行する。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def create(self, images: list[bytes], use_cache: bool = True) -> str:
+        """画像バイナリのリストからジョブを登録し、ジョブIDを返す"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, num_pages, use_cache, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, len(images), int(use_cache), now, now),
+            )
+            self._conn.executemany(
+                "INSERT INTO job_pages (job_id, page_idx, image) VALUES (?, ?, ?)",
+                [(job_id, i, sqlite3.Binary(data)) for i, data in enumerate(images)],
+            )
+        return job_id
+
+    def requeue_running(self) -> int:
+        """起動時: 実行中のまま残ったジョブをキュー待ちに戻す"""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (QUEUED, time.time(), RUNNING),
+            )
+            return cur.rowcount
+
+    def claim_next(self) -> Optional[dict]:
+        """最も古いキュー待ちジョブを実行中にして返す"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (RUNNING, time.time(), row["id"]),
+            )
+            job = dict(row)
+            job["status"] = RUNNING
+            return job
+
+    def pending_pages(self, job_id: str) -> list[int]:
+        """結果が未保存のページ番号"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page_idx FROM job_pages"
+                " WHERE job_id = ? AND words IS NULL AND error IS NULL ORDER BY page_idx",
+                (job_id,),
+            ).fetchall()
+        return [r["page_idx"] for r in rows]
+
+    def load_image(self, job_id: str, page_idx: int) -> Optional[bytes]:
+        """ページ画像（結果の保存後・ジョブの終了後は破棄済みなのでNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT image FROM job_pages WHERE job_id = ? AND page_idx = ?",
+                (job_id, page_idx),
+            ).fetchone()
+        return None if row is None or row["image"] is None else bytes(row["image"])
+
+    def save_page(self, job_id: str, page_idx: int, words: Optional[list] = None, error: Optional[str] = None):
+        """ページ結果を保存し、不要になった画像を削除する"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE job_pages SET words = ?, error = ?, image = NULL"
+                " WHERE job_id = ? AND page_idx = ?",
+                (
+                    None if words is None else json.dumps(words, ensure_ascii=False),
+                    error,
+                    job_id,
+                    page_idx,
+                ),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> bool:
+        """
+        ジョブを終了状態にする
+
+        Returns:
+            状態を更新した場合True（既にキャンセル等で終了済みならFalse）
+        """
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?"
+                " WHERE id = ? AND status NOT IN (?, ?, ?)",
+                (status, error, time.time(), job_id, *FINISHED_STATUSES),
+            )
+            if status in FINISHED_STATUSES:
+                # 残った画像はもう使わない
+                self._conn.execute(
+                    "UPDATE job_pages SET image = NULL WHERE job_id = ?", (job_id,)
+                )
+            return cur.rowcount > 0
+
+    def status(self, job_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else row["status"]
+
+    def get(self, job_id: str, include_results: bool = True) -> Optional[dict]:
+        """ジョブの状態とページごとの結果"""
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            pages = self._conn.execute(
+                "SELECT page_idx, words, error FROM job_pages WHERE job_id = ? ORDER BY page_idx",
+                (job_id,),
+            ).fetchall()
+
+        job = dict(job)
+        job["pages_done"] = sum(
+            1 for p in pages if p["words"] is not None or p["error"] is not None
+        )
+        if include_results:
+            job["results"] = [
+                {
+                    "page_idx": p["page_idx"],
+                    "words": None if p["words"] is None else json.loads(p["words"]),
+                    "error": p["error"],
+                }
+                for p in pages
+            ]
+        return job
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return cur.rowcount > 0
+
+    def queue_length(self) -> int:
+        """キュー待ちジョブ数"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS n FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()
+        return row["n"]
+
+    def purge_finished(self, older_than_sec: float) -> int:
+        """終了から一定時間経ったジョブを削除"""
+        cutoff = time.time() - older_than_sec
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+                (*FINISHED_STATUSES, cutoff),
+            )
+            return cur.rowcount
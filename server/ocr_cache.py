@@ -0,0 +1,173 @@
+"""OCR結果キャッシュ: デコード後画像のハッシュをキーにしたLRU + ディスク層"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+class OCRCache:
+    """
+    画像内容アドレスのOCR結果キャッシュ
+
+    キーはデコード後の画素データ・形状とエンジン設定のハッシュ。
+    メモリ層はバイト数上限付きLRU、ディスク層（任意）はサーバー再起動後も残る。
+    値はwordsリストをJSONにシリアライズしたバイト列で保持する。
+    """
+
+    def __init__(
+        self,
+        engine_config: str,
+        max_memory_bytes: int,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 0,
+    ):
+        self.engine_config = engine_config
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir or None
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_memory_bytes > 0 or self.disk_dir is not None
+
+    def make_key(self, img: np.ndarray) -> str:
+        """画像とエンジン設定からキャッシュキーを生成"""
+        h = hashlib.sha256()
+        h.update(self.engine_config.encode())
+        h.update(f"{img.shape}:{img.dtype}".encode())
+        h.update(np.ascontiguousarray(img).data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[list]:
+        """キャッシュからwordsリストを取得（メモリ → ディスクの順）"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return json.loads(data)
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits_disk += 1
+            self._put_memory(key, data)
+        return json.loads(data)
+
+    def put(self, key: str, words: list):
+        """wordsリストをキャッシュに保存"""
+        data = json.dumps(words, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        with self._lock:
+            self._put_memory(key, data)
+        self._write_disk(key, data)
+
+    def stats(self) -> dict:
+        """ヒット/ミス数と使用量"""
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_enabled": self.disk_dir is not None,
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.max_memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_entries(self) -> list[tuple[str, int, float]]:
+        """ディスク層の (パス, サイズ, 更新時刻) 一覧"""
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # LRU判定用に更新時刻を進める
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"OCR cache write failed: {e}")
+            return
+
+        with self._lock:
+            if not existed:
+                self._disk_bytes += len(data)
+            over = self.max_disk_bytes > 0 and self._disk_bytes > self.max_disk_bytes
+        if over:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """ディスク層が上限を超えたら古いものから上限の9割まで削除"""
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_disk_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
@@ -2,22 +2,196 @@
 import asyncio
 import base64
 import io
+import json
 import os
 import time
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Callable, Optional
 
 import cv2
 import numpy as np
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
+import job_store
+from admission import (
+    AdmissionControl, AdmissionMiddleware, AdmissionTicket, ClientDisconnected, DeadlineExceeded, Overloaded,
+    RequestGuard,
+)
+from batching import YOMITOKU_BATCHING_VERSION, MicroBatcher, ocr_batch, supports_batching
+from cpu_profile import CPUProfile, apply_threads
+from engine_pool import EnginePool, create_engine
+from job_store import JobStore
+from metrics import Registry
+from ocr_cache import OCRCache
+from pdf_raster import PdfFile, PdfRasterizer, page_count
+from pipeline import OCRPipeline
+from preprocess import downscale_factor, prepare_image, rescale_words
+from roi_index import WordIndex
+from roi_ocr import offset_words, plan_crops
+from single_flight import SingleFlight
+from wire_format import MSGPACK_MEDIA_TYPE, accepts_msgpack, choose_encoding, compact_words, compress, pack
+
 # GPU同時実行数の上限 (環境変数で設定可能)
 MAX_CONCURRENT_OCR = int(os.environ.get("MAX_CONCURRENT_OCR", "1"))
+# マイクロバッチングの最大バッチサイズ（1で無効）と待ち時間（ms）
+OCR_MAX_BATCH_SIZE = int(os.environ.get("OCR_MAX_BATCH_SIZE", "1"))
+OCR_BATCH_WAIT_MS = float(os.environ.get("OCR_BATCH_WAIT_MS", "10"))
+# OCR結果キャッシュ（メモリ層の上限MB、0で無効 / ディスク層の保存先、空で無効）
+OCR_CACHE_MAX_MB = float(os.environ.get("OCR_CACHE_MAX_MB", "256"))
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", "")
+OCR_CACHE_DISK_MAX_MB = float(os.environ.get("OCR_CACHE_DISK_MAX_MB", "0"))
+# エンジンワーカープロセス数（1でプロセス内推論）とワーカーあたりのtorchスレッド数
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "1"))
+OCR_WORKER_THREADS = int(os.environ.get("OCR_WORKER_THREADS", "0")) or max(
+    1, (os.cpu_count() or 1) // max(1, OCR_WORKERS)
+)
+# CPU推論の最適化プロファイル（OCR_CPU_PROFILE ほか、cpu_profile.py 参照）
+# プロセス内推論では OCR_WORKER_THREADS を明示した場合のみスレッド数を変える
+CPU_PROFILE = CPUProfile.from_env(
+    OCR_WORKER_THREADS if OCR_WORKERS > 1 else int(os.environ.get("OCR_WORKER_THREADS", "0"))
+)
+# 非同期ジョブキュー（SQLiteファイル、同時処理ジョブ数、完了ジョブの保持時間）
+OCR_JOB_DB = os.environ.get("OCR_JOB_DB", "ocr_jobs.sqlite3")
+OCR_JOB_WORKERS = int(os.environ.get("OCR_JOB_WORKERS", "1"))
+OCR_JOB_TTL_HOURS = float(os.environ.get("OCR_JOB_TTL_HOURS", "24"))
+JOB_POLL_INTERVAL_SEC = 5.0
+# ROI限定OCRで各領域の周囲に足す余白（px）
+OCR_ROI_MARGIN = int(os.environ.get("OCR_ROI_MARGIN", "48"))
+# PDF受付: ラスタライズのプロセス数、既定/上限DPI、ページ数上限
+OCR_PDF_WORKERS = int(os.environ.get("OCR_PDF_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+OCR_PDF_DPI = int(os.environ.get("OCR_PDF_DPI", "300"))
+OCR_PDF_MAX_DPI = int(os.environ.get("OCR_PDF_MAX_DPI", "600"))
+OCR_PDF_MAX_PAGES = int(os.environ.get("OCR_PDF_MAX_PAGES", "500"))
+# 受付制御: 同時に推論できる数を超えて待たせる画像数（複数ページのリクエストはページ数で数える）の上限（超えたら429、0で無制限）と
+# X-OCR-Deadline ヘッダーがない場合の期限（秒、0で期限なし）
+OCR_MAX_QUEUE = int(os.environ.get("OCR_MAX_QUEUE", "64"))
+OCR_DEFAULT_DEADLINE_SEC = float(os.environ.get("OCR_DEFAULT_DEADLINE_SEC", "0"))
+# この大きさ以上の応答を Accept-Encoding に応じて圧縮（0で無効）
+OCR_COMPRESS_MIN_BYTES = int(os.environ.get("OCR_COMPRESS_MIN_BYTES", "1024"))
+# 推論前の縮小（0で無効）: 入力画像の想定DPIと推論時のDPI、長辺の上限px、グレースケール化
+OCR_SOURCE_DPI = float(os.environ.get("OCR_SOURCE_DPI", "300"))
+OCR_TARGET_DPI = float(os.environ.get("OCR_TARGET_DPI", "0"))
+OCR_MAX_SIDE = int(os.environ.get("OCR_MAX_SIDE", "0"))
+OCR_GRAYSCALE = os.environ.get("OCR_GRAYSCALE", "0").lower() in ("1", "true", "yes")
+# 検出・認識の2段パイプライン（プロセス内推論のみ）: 各段の並列数と段間キューの長さ
+# 有効時は推論の同時実行数を MAX_CONCURRENT_OCR ではなく各段の並列数で制限する
+OCR_PIPELINE = os.environ.get("OCR_PIPELINE", "0").lower() in ("1", "true", "yes")
+OCR_DET_WORKERS = int(os.environ.get("OCR_DET_WORKERS", "1"))
+OCR_REC_WORKERS = int(os.environ.get("OCR_REC_WORKERS", "1"))
+OCR_PIPELINE_QUEUE = int(os.environ.get("OCR_PIPELINE_QUEUE", "4"))
+# 同時に処理中の同一画像のOCRを1回の推論にまとめる
+OCR_SINGLE_FLIGHT = os.environ.get("OCR_SINGLE_FLIGHT", "1").lower() in ("1", "true", "yes")
 
 # グローバル変数
 ocr_engine = None
+engine_pool = None
 gpu_semaphore = None
+ocr_concurrency = MAX_CONCURRENT_OCR
+batcher = None
+pipeline = None
+ocr_cache = None
+job_queue = None
+job_event = None
+pdf_rasterizer = None
+admission = AdmissionControl(OCR_MAX_QUEUE, MAX_CONCURRENT_OCR)
+# 先行リクエストの期限切れ・切断は後続には関係ないので、後続が推論し直す
+single_flight = SingleFlight(retry_on=(DeadlineExceeded, ClientDisconnected))
+gpu_available = False
+# バッチング無効時の推論待ち・推論中リクエスト数
+waiting_requests = 0
+running_requests = 0
+
+
+def count_waiting() -> int:
+    """推論開始を待っているリクエスト数"""
+    return (
+        waiting_requests
+        + (batcher.waiting if batcher is not None else 0)
+        + (pipeline.waiting if pipeline is not None else 0)
+    )
+
+
+def count_running() -> int:
+    """推論中のリクエスト数"""
+    return (
+        running_requests
+        + (batcher.running if batcher is not None else 0)
+        + (pipeline.running if pipeline is not None else 0)
+    )
+
+
+# メトリクス（/metrics で Prometheus テキスト形式で出力）
+metrics = Registry()
+REQUESTS_WAITING = metrics.gauge(
+    "ocr_requests_waiting", "OCR requests waiting for an inference slot", callback=count_waiting
+)
+REQUESTS_RUNNING = metrics.gauge(
+    "ocr_requests_running", "OCR requests currently in inference", callback=count_running
+)
+SEMAPHORE_WAIT_SECONDS = metrics.histogram(
+    "ocr_semaphore_wait_seconds", "Time spent waiting for an inference slot"
+)
+DECODE_SECONDS = metrics.histogram(
+    "ocr_decode_seconds", "Image decode time", labelnames=("kind",)
+)
+INFERENCE_SECONDS = metrics.histogram(
+    "ocr_inference_seconds", "Engine inference time per call (one call may hold a batch)"
+)
+INFERENCE_BATCH_SIZE = metrics.histogram(
+    "ocr_inference_batch_size", "Images per engine call", buckets=(1, 2, 4, 8, 16, 32)
+)
+PREPROCESS_SECONDS = metrics.histogram(
+    "ocr_preprocess_seconds", "Downscale/grayscale time before inference"
+)
+SERIALIZATION_SECONDS = metrics.histogram(
+    "ocr_serialization_seconds", "Response JSON serialization time", labelnames=("endpoint",)
+)
+IMAGE_MEGAPIXELS = metrics.histogram(
+    "ocr_image_megapixels", "Decoded image size in megapixels",
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 12, 16, 24, 32)
+)
+UPLOAD_BYTES = metrics.histogram(
+    "ocr_upload_bytes", "Encoded image size in bytes",
+    buckets=tuple(2 ** n for n in range(14, 27))
+)
+RESPONSE_BYTES = metrics.histogram(
+    "ocr_response_bytes", "Encoded (and compressed) response size in bytes",
+    buckets=tuple(2 ** n for n in range(10, 25)), labelnames=("format",)
+)
+ERRORS = metrics.counter(
+    "ocr_errors_total", "Errors by processing stage and type", labelnames=("stage", "type")
+)
+REJECTED = metrics.counter(
+    "ocr_rejected_total", "Requests dropped before inference", labelnames=("reason",)
+)
+COALESCED = metrics.counter(
+    "ocr_coalesced_requests_total", "OCR requests that waited for an identical in-flight request instead of inferring"
+)
+INFLIGHT_IMAGES = metrics.gauge(
+    "ocr_inflight_images", "Distinct images currently being OCRed", callback=lambda: len(single_flight)
+)
+STAGE_SECONDS = metrics.histogram(
+    "ocr_stage_seconds", "Pipeline stage time per batch", labelnames=("stage",)
+)
+STAGE_BUSY_SECONDS = metrics.counter(
+    "ocr_stage_busy_seconds_total", "Time pipeline stage workers spent processing", labelnames=("stage",)
+)
+DETECTION_UTILIZATION = metrics.gauge(
+    "ocr_detection_utilization", "Fraction of the last minute detection workers were busy",
+    callback=lambda: pipeline.detection.utilization() if pipeline is not None else 0,
+)
+RECOGNITION_UTILIZATION = metrics.gauge(
+    "ocr_recognition_utilization", "Fraction of the last minute recognition workers were busy",
+    callback=lambda: pipeline.recognition.utilization() if pipeline is not None else 0,
+)
+HTTP_REQUESTS = metrics.counter(
+    "ocr_http_requests_total", "HTTP requests by route and status", labelnames=("method", "path", "status")
+)
+HTTP_SECONDS = metrics.histogram(
+    "ocr_http_request_seconds", "HTTP request time until the response body is sent", labelnames=("method", "path")
+)
 
 
 class OCRRequest(BaseModel):
@@ -48,42 +222,268 @@ class OCRResponse(BaseModel):
     processing_time_ms: float
 
 
+class OCRBatchResponse(BaseModel):
+    """複数画像OCRレスポンス（アップロード順）"""
+    status: str
+    results: list[OCRResponse]
+    processing_time_ms: float
+
+
+class CacheStatsResponse(BaseModel):
+    """キャッシュ統計レスポンス"""
+    enabled: bool
+    hits_memory: int = 0
+    hits_disk: int = 0
+    misses: int = 0
+    memory_entries: int = 0
+    memory_bytes: int = 0
+    max_memory_bytes: int = 0
+    disk_enabled: bool = False
+    disk_bytes: int = 0
+
+
+class JobSubmitResponse(BaseModel):
+    """ジョブ登録レスポンス"""
+    job_id: str
+    status: str
+    num_pages: int
+
+
+class JobPageResult(BaseModel):
+    """ジョブ内の1ページの結果（未処理ならwords/errorともにNone）"""
+    page_idx: int
+    words: Optional[list] = None
+    error: Optional[str] = None
+
+
+class JobStatusResponse(BaseModel):
+    """ジョブ状態レスポンス"""
+    job_id: str
+    status: str
+    num_pages: int
+    pages_done: int
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+    results: Optional[list[JobPageResult]] = None
+
+
 class ExtractROIResponse(BaseModel):
     """ROI抽出レスポンス"""
     extractions: dict[str, str]
 
 
+class OCRExtractResponse(BaseModel):
+    """OCR+ROI抽出レスポンス（wordsは要求時のみ）"""
+    status: str
+    extractions: dict[str, str]
+    words: Optional[list] = None
+    processing_time_ms: float
+
+
+class ROIOCRResponse(BaseModel):
+    """ROI限定OCRレスポンス（座標はすべてページ座標）"""
+    status: str
+    extractions: dict[str, str]
+    words: Optional[list] = None
+    crops: list[list[int]]
+    crop_area_ratio: float
+    processing_time_ms: float
+
+
+class WorkerStatus(BaseModel):
+    """エンジンワーカープロセスの状態"""
+    index: int
+    pid: Optional[int] = None
+    state: str
+    alive: bool
+    processed: int
+    errors: int
+    restarts: int
+    last_error: Optional[str] = None
+    last_latency_ms: Optional[float] = None
+
+
+class StageStatus(BaseModel):
+    """パイプラインの段の状態"""
+    stage: str
+    workers: int
+    busy: int
+    queue: int
+    processed: int
+    mean_batch_ms: Optional[float] = None
+    utilization: float
+
+
 class HealthResponse(BaseModel):
     """ヘルスチェックレスポンス"""
     status: str
     gpu_available: bool
     queue_size: int
+    running: int = 0
     max_concurrent: int
+    max_pdf_pages: int = OCR_PDF_MAX_PAGES  # /ocr/pdf の1リクエストあたりのページ数上限
+    workers: list[WorkerStatus] = []
+    stages: list[StageStatus] = []
+
+
+def probe_gpu() -> bool:
+    """CUDAが使えるか（/health のたびにtorchを触らないよう起動時に一度だけ呼ぶ）"""
+    import torch
+    return torch.cuda.is_available()
 
 
 def load_ocr_engine():
-    """OCRエンジンをロード（シングルトン）"""
-    global ocr_engine
+    """OCRエンジンをロード（シングルトン）。ロードしたときにGPUの有無も確認する"""
+    global ocr_engine, gpu_available
     if ocr_engine is None:
-        from yomitoku import OCR
         device = os.environ.get("OCR_DEVICE", "cuda")
         print(f"Loading YomiToku OCR engine on {device}...")
-        ocr_engine = OCR(visualize=False, device=device)
+        if device == "cpu":
+            print(f"CPU inference: {CPU_PROFILE.describe()}")
+        ocr_engine = create_engine(device, CPU_PROFILE)
+        gpu_available = probe_gpu()
         print("OCR engine loaded successfully!")
     return ocr_engine
 
 
+def infer_batch(imgs: list[np.ndarray]) -> list[list]:
+    """画像群をOCRしてwordsリストを返す（プール有効時はワーカープロセスに振り分け）"""
+    start = time.perf_counter()
+    try:
+        if engine_pool is not None:
+            return engine_pool.ocr_batch(imgs)
+        return ocr_batch(load_ocr_engine(), imgs)
+    except Exception as e:
+        ERRORS.inc(stage="inference", type=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        INFERENCE_SECONDS.observe(elapsed)
+        INFERENCE_BATCH_SIZE.observe(len(imgs))
+        admission.observe(elapsed, len(imgs))
+
+
+def record_stage(stage: str, seconds: float, batch_size: int):
+    """パイプラインの段の処理1回を記録"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    STAGE_BUSY_SECONDS.inc(seconds, stage=stage)
+    if stage == "recognition":
+        INFERENCE_BATCH_SIZE.observe(batch_size)
+        # Retry-After の見積もりにはボトルネックの段の1画像あたり時間を使う
+        admission.observe(pipeline.seconds_per_image())
+
+
+def engine_config_key() -> str:
+    """キャッシュキーに含めるエンジン設定（結果が変わりうる設定をすべて含める）"""
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        yomitoku_version = version("yomitoku")
+    except PackageNotFoundError:
+        yomitoku_version = "unknown"
+    device = os.environ.get("OCR_DEVICE", "cuda")
+    return (
+        f"yomitoku={yomitoku_version};device={device};"
+        f"source_dpi={OCR_SOURCE_DPI:g};target_dpi={OCR_TARGET_DPI:g};"
+        f"max_side={OCR_MAX_SIDE};grayscale={int(OCR_GRAYSCALE)}"
+        + (f";{CPU_PROFILE.key()}" if device == "cpu" else "")
+    )
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """アプリケーションライフサイクル管理"""
-    global gpu_semaphore
-    gpu_semaphore = asyncio.Semaphore(MAX_CONCURRENT_OCR)
+    global gpu_semaphore, batcher, pipeline, ocr_cache, job_queue, job_event, engine_pool, ocr_concurrency
+    global gpu_available, pdf_rasterizer
+    ocr_concurrency = MAX_CONCURRENT_OCR
+    if OCR_WORKERS > 1:
+        # ワーカー数より同時実行数が少ないと遊ぶワーカーが出る
+        ocr_concurrency = max(MAX_CONCURRENT_OCR, OCR_WORKERS)
+    gpu_semaphore = asyncio.Semaphore(ocr_concurrency)
+    admission.capacity = ocr_concurrency * max(1, OCR_MAX_BATCH_SIZE)
+    ocr_cache = OCRCache(
+        engine_config_key(),
+        max_memory_bytes=int(OCR_CACHE_MAX_MB * 1024 * 1024),
+        disk_dir=OCR_CACHE_DIR,
+        max_disk_bytes=int(OCR_CACHE_DISK_MAX_MB * 1024 * 1024),
+    )
+    
+    if OCR_WORKERS > 1:
+        device = os.environ.get("OCR_DEVICE", "cuda")
+        # CPUならforkserverで一度だけロードしてforkで共有、CUDAとONNX Runtimeは各ワーカーでロード
+        engine_pool = EnginePool(
+            OCR_WORKERS, device, OCR_WORKER_THREADS, CPU_PROFILE,
+            share_engine=device == "cpu" and CPU_PROFILE.forkable,
+        )
+        await asyncio.get_event_loop().run_in_executor(None, engine_pool.start)
+        gpu_available = probe_gpu()
+    elif ocr_engine is None:
+        # 起動時にOCRエンジンをプリロード（推論もこのプロセスで行うのでスレッド数を設定）
+        apply_threads(CPU_PROFILE)
+        load_ocr_engine()
+    # エンジンが差し替え済み（bench_server.py のフェイクエンジン）ならtorchには触れない
+    
+    if OCR_PIPELINE and engine_pool is None and supports_batching(load_ocr_engine()):
+        pipeline = OCRPipeline(
+            load_ocr_engine(),
+            det_workers=OCR_DET_WORKERS,
+            rec_workers=OCR_REC_WORKERS,
+            queue_size=OCR_PIPELINE_QUEUE,
+            max_batch_size=OCR_MAX_BATCH_SIZE,
+            on_stage=record_stage,
+        )
+        pipeline.start()
+        admission.capacity = pipeline.capacity
+    elif OCR_PIPELINE:
+        print(
+            f"OCR_PIPELINE requires an in-process YomiToku {YOMITOKU_BATCHING_VERSION} engine (OCR_WORKERS=1); "
+            "running without it"
+        )
+    
+    if OCR_MAX_BATCH_SIZE > 1 and pipeline is None:
+        batcher = MicroBatcher(
+            infer_batch,
+            gpu_semaphore,
+            max_batch_size=OCR_MAX_BATCH_SIZE,
+            max_wait_ms=OCR_BATCH_WAIT_MS,
+            on_dispatch=lambda waits: [SEMAPHORE_WAIT_SECONDS.observe(w) for w in waits],
+        )
+        batcher.start()
     
-    # 起動時にOCRエンジンをプリロード
-    load_ocr_engine()
+    # 非同期ジョブ: 前回実行中だったジョブはキューに戻して再開
+    job_queue = JobStore(OCR_JOB_DB)
+    requeued = job_queue.requeue_running()
+    if requeued:
+        print(f"Requeued {requeued} interrupted OCR job(s)")
+    job_event = asyncio.Event()
+    job_workers = [asyncio.create_task(job_worker()) for _ in range(max(1, OCR_JOB_WORKERS))]
+    
+    pdf_rasterizer = PdfRasterizer(OCR_PDF_WORKERS)
+    pdf_rasterizer.start()
     
     yield
     
+    pdf_rasterizer.stop()
+    pdf_rasterizer = None
+    
+    for task in job_workers:
+        task.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    job_queue.close()
+    job_queue = None
+    
+    if batcher is not None:
+        await batcher.stop()
+        batcher = None
+    
+    if pipeline is not None:
+        await pipeline.stop()
+        pipeline = None
+    
+    if engine_pool is not None:
+        engine_pool.stop()
+        engine_pool = None
+    
     # シャットダウン時のクリーンアップ
     print("Shutting down OCR server...")
 
@@ -96,13 +496,170 @@ app = FastAPI(
 )
 
 
+# 受付制御の対象（推論を伴うエンドポイント）
+ADMISSION_PATHS = {"/ocr", "/ocr/upload", "/ocr/extract", "/ocr/roi", "/ocr/stream", "/ocr/pdf"}
+
+
+class HTTPMetricsMiddleware:
+    """
+    ルートごとのリクエスト数・ステータス・処理時間を記録
+    
+    BaseHTTPMiddleware（@app.middleware）を挟むとエンドポイントで
+    Request.is_disconnected() が切断を検出できなくなるため、ASGIミドルウェアとして実装する。
+    処理時間はストリーミング応答の送信完了までを含む。
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            ERRORS.inc(stage="http", type=type(e).__name__)
+            raise
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                path = route.path
+            else:
+                # 受付制御で断ったリクエストはルーティング前なのでパスをそのまま使う
+                path = scope["path"] if scope["path"] in ADMISSION_PATHS else "unmatched"
+            HTTP_REQUESTS.inc(method=scope["method"], path=path, status=status)
+            HTTP_SECONDS.observe(time.perf_counter() - start, method=scope["method"], path=path)
+
+
+# 後から追加したものが外側になる: HTTPメトリクス → 受付制御 → アプリ
+app.add_middleware(
+    AdmissionMiddleware,
+    control=admission,
+    paths=ADMISSION_PATHS,
+    on_reject=lambda: REJECTED.inc(reason="overloaded"),
+)
+app.add_middleware(HTTPMetricsMiddleware)
+
+
+def encode_response(model: BaseModel, endpoint: str, request: Request) -> Response:
+    """
+    レスポンスモデルをシリアライズ（所要時間を記録）
+    
+    Accept: application/x-msgpack ならwordsを列指向にしたmsgpack、それ以外はJSON。
+    Accept-Encoding に応じて OCR_COMPRESS_MIN_BYTES 以上の応答を zstd / gzip で圧縮する。
+    """
+    start = time.perf_counter()
+    if accepts_msgpack(request.headers.get("accept")):
+        body = pack(compact_words(model.model_dump()))
+        media_type = MSGPACK_MEDIA_TYPE
+        fmt = "msgpack"
+    else:
+        body = model.model_dump_json().encode()
+        media_type = "application/json"
+        fmt = "json"
+    
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None and len(body) >= OCR_COMPRESS_MIN_BYTES > 0:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    SERIALIZATION_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    RESPONSE_BYTES.observe(len(body), format=fmt)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(ClientDisconnected)
+async def disconnected_handler(request: Request, exc: ClientDisconnected):
+    # クライアントは既にいないので、ログ・メトリクス上の区別のためだけのステータス
+    return JSONResponse(status_code=499, content={"detail": str(exc)})
+
+
+def request_guard(request: Request, x_ocr_deadline: Optional[float], streaming: bool = False) -> RequestGuard:
+    """
+    OCRリクエストの期限・切断検出のガードを作る（受付判定は AdmissionMiddleware）
+    
+    X-OCR-Deadline は受付からの残り秒数で、クライアントのタイムアウトより少し短くする。
+    ストリーミング応答では切断時に ndjson_stream が残りのページを止めるので、
+    ここでは期限だけを見る（応答側と受信メッセージを奪い合わないため）。
+    """
+    timeout = x_ocr_deadline if x_ocr_deadline and x_ocr_deadline > 0 else OCR_DEFAULT_DEADLINE_SEC
+    return RequestGuard(None if streaming else request, timeout or None)
+
+
+def admit_pages(request: Request, num_pages: int) -> Optional[AdmissionTicket]:
+    """
+    複数ページのリクエストを受付制御上ページ数分として数え直す
+
+    AdmissionMiddleware は本体を読む前に1枚分で受け付けるので、ページ数が分かった時点で呼ぶ。
+    待ち行列が満杯なら 429 + Retry-After。
+    """
+    ticket = request.scope.get("state", {}).get("admission")
+    if ticket is None:
+        return None
+    try:
+        ticket.expand(num_pages)
+    except Overloaded as e:
+        REJECTED.inc(reason="overloaded")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return ticket
+
+
+def page_finished(ticket: Optional[AdmissionTicket]):
+    """ストリーミング応答で1ページ終わったら受付制御の枠を返す"""
+    if ticket is not None:
+        ticket.page_done()
+
+
+async def check_guard(guard: RequestGuard):
+    """推論直前のチェック（弾いた理由を記録）"""
+    try:
+        await guard.check()
+    except DeadlineExceeded:
+        REJECTED.inc(reason="deadline")
+        raise
+    except ClientDisconnected:
+        REJECTED.inc(reason="disconnected")
+        raise
+
+
 def decode_image(image_base64: str) -> np.ndarray:
     """Base64エンコードされた画像をデコード"""
-    image_data = base64.b64decode(image_base64)
+    start = time.perf_counter()
+    try:
+        image_data = base64.b64decode(image_base64)
+    except Exception as e:
+        ERRORS.inc(stage="decode", type=type(e).__name__)
+        raise
+    DECODE_SECONDS.observe(time.perf_counter() - start, kind="base64")
+    return decode_image_bytes(image_data)
+
+
+def decode_image_bytes(image_data: bytes) -> np.ndarray:
+    """画像バイナリ（PNG/JPEG等）をデコード（np.frombufferでコピーせずに参照）"""
+    start = time.perf_counter()
+    UPLOAD_BYTES.observe(len(image_data))
     nparr = np.frombuffer(image_data, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     if img is None:
+        ERRORS.inc(stage="decode", type="InvalidImage")
         raise ValueError("Failed to decode image")
+    DECODE_SECONDS.observe(time.perf_counter() - start, kind="image")
+    IMAGE_MEGAPIXELS.observe(img.shape[0] * img.shape[1] / 1e6)
     return img
 
 
@@ -110,86 +667,737 @@ def extract_text_from_roi(words_data: list, roi: dict) -> str:
     """
     OCR結果からROI内のテキストを文字単位で抽出（横書き1行想定）
     """
-    matched_chars = []
-    rx, ry, rw, rh = roi['x'], roi['y'], roi['w'], roi['h']
-    roi_x2, roi_y2 = rx + rw, ry + rh
-    
-    for word in words_data:
-        points = word.get('points', [])
-        content = word.get('content', '')
-        if len(points) < 4 or not content:
-            continue
-            
-        xs = [p[0] for p in points]
-        ys = [p[1] for p in points]
-        wx1, wy1 = min(xs), min(ys)
-        wx2, wy2 = max(xs), max(ys)
-        
-        cy = (wy1 + wy2) / 2
-        if not (ry <= cy <= roi_y2):
-            continue
-        
-        char_count = len(content)
-        word_width = wx2 - wx1
-        char_width = word_width / char_count if char_count > 0 else 0
-        
-        for i, char in enumerate(content):
-            char_cx = wx1 + char_width * (i + 0.5)
-            if rx <= char_cx <= roi_x2:
-                matched_chars.append({"char": char, "x": char_cx})
-
-    matched_chars.sort(key=lambda k: k['x'])
-    return "".join([m['char'] for m in matched_chars])
+    return WordIndex(words_data).extract(roi)
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """ヘルスチェック"""
-    import torch
-    return HealthResponse(
-        status="healthy",
-        gpu_available=torch.cuda.is_available(),
-        queue_size=MAX_CONCURRENT_OCR - gpu_semaphore._value,
-        max_concurrent=MAX_CONCURRENT_OCR
+    """
+    ヘルスチェック（queue_size は推論開始待ちのリクエスト数）
+    
+    エンジンワーカーの一部が dead なら "degraded"、全部 dead なら "unhealthy"（503）
+    """
+    status = "healthy"
+    if engine_pool is not None and engine_pool.alive_workers < engine_pool.num_workers:
+        status = "degraded" if engine_pool.alive_workers else "unhealthy"
+    health = HealthResponse(
+        status=status,
+        gpu_available=gpu_available,
+        queue_size=count_waiting(),
+        running=count_running(),
+        max_concurrent=ocr_concurrency,
+        max_pdf_pages=OCR_PDF_MAX_PAGES,
+        workers=engine_pool.status() if engine_pool is not None else [],
+        stages=pipeline.status() if pipeline is not None else [],
     )
+    if status == "unhealthy":
+        return JSONResponse(health.model_dump(), status_code=503)
+    return health
+
+
+async def ocr_image(img: np.ndarray, use_cache: bool = True, guard: Optional[RequestGuard] = None) -> list:
+    """
+    デコード済み画像に対してOCRを実行し、wordsリストを返す
+    
+    同一画像の結果はキャッシュから返す（use_cache=False で参照しない）
+    同じ画像を推論中のリクエストがあれば、推論せずにその結果を待つ（use_cache=False でも
+    結果は新たに推論したものなのでまとめる）
+    guard を渡すと、期限切れ・切断済みのリクエストは推論せずに例外にする
+    """
+    loop = asyncio.get_event_loop()
+    key = None
+    if ocr_cache is not None and (ocr_cache.enabled or OCR_SINGLE_FLIGHT):
+        key = await loop.run_in_executor(None, ocr_cache.make_key, img)
+        if use_cache and ocr_cache.enabled:
+            words = await loop.run_in_executor(None, ocr_cache.get, key)
+            if words is not None:
+                return words
+    
+    async def infer() -> list:
+        words = await run_preprocessed(img, guard)
+        if key is not None and ocr_cache.enabled:
+            await loop.run_in_executor(None, ocr_cache.put, key, words)
+        return words
+    
+    if key is None or not OCR_SINGLE_FLIGHT:
+        return await infer()
+    try:
+        return await single_flight.run(
+            key, infer,
+            timeout=guard.remaining() if guard is not None else None,
+            on_coalesced=COALESCED.inc,
+        )
+    except asyncio.TimeoutError:
+        REJECTED.inc(reason="deadline")
+        raise DeadlineExceeded("Request deadline exceeded while waiting for an identical request") from None
+
+
+async def run_preprocessed(img: np.ndarray, guard: Optional[RequestGuard] = None) -> list:
+    """
+    設定に応じて縮小した画像で推論し、wordsを元画像の座標に戻す
+    
+    座標は元画像基準のまま返すので、テンプレートのROIはそのまま使える。
+    ROI限定OCRの切り出し画像も同じ倍率で縮小する（長辺の上限は大きな画像にだけ効く）。
+    """
+    img_h, img_w = img.shape[:2]
+    scale = downscale_factor(img_w, img_h, OCR_SOURCE_DPI, OCR_TARGET_DPI, OCR_MAX_SIDE)
+    if scale >= 1.0 and not OCR_GRAYSCALE:
+        return await run_engine(img, guard)
+    
+    loop = asyncio.get_event_loop()
+    start = time.perf_counter()
+    small, sx, sy = await loop.run_in_executor(None, prepare_image, img, scale, OCR_GRAYSCALE)
+    PREPROCESS_SECONDS.observe(time.perf_counter() - start)
+    words = await run_engine(small, guard)
+    return rescale_words(words, sx, sy, (img_w, img_h))
+
+
+async def run_engine(img: np.ndarray, guard: Optional[RequestGuard] = None) -> list:
+    """
+    OCRエンジンで推論
+    
+    GPU Semaphoreにより同時実行数を制限
+    マイクロバッチング有効時は他のリクエストとまとめて推論する
+    パイプライン有効時は検出・認識の各段に流す（同時実行数は各段の並列数）
+    guard の期限までに推論を始められなければ DeadlineExceeded
+    """
+    global waiting_requests, running_requests
+    timeout = guard.remaining() if guard is not None else None
+    if timeout is not None and timeout <= 0:
+        await check_guard(guard)
+    
+    if pipeline is not None or batcher is not None:
+        precheck = (lambda: check_guard(guard)) if guard is not None else None
+        try:
+            if pipeline is not None:
+                return await pipeline.submit(img, timeout=timeout, precheck=precheck)
+            return await batcher.submit(img, timeout=timeout, precheck=precheck)
+        except asyncio.TimeoutError:
+            REJECTED.inc(reason="deadline")
+            raise DeadlineExceeded("Request deadline exceeded while waiting for inference") from None
+        except (DeadlineExceeded, ClientDisconnected):
+            raise
+        except Exception as e:
+            if pipeline is not None:
+                ERRORS.inc(stage="inference", type=type(e).__name__)
+            raise
+    
+    wait_start = time.perf_counter()
+    waiting_requests += 1
+    try:
+        await asyncio.wait_for(gpu_semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        REJECTED.inc(reason="deadline")
+        raise DeadlineExceeded("Request deadline exceeded while waiting for inference") from None
+    finally:
+        waiting_requests -= 1
+    SEMAPHORE_WAIT_SECONDS.observe(time.perf_counter() - wait_start)
+    
+    if guard is not None:
+        try:
+            await check_guard(guard)
+        except Exception:
+            gpu_semaphore.release()
+            raise
+    
+    running_requests += 1
+    try:
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(None, infer_batch, [img])
+        return results[0]
+    finally:
+        running_requests -= 1
+        gpu_semaphore.release()
+
+
+def cache_requested(x_ocr_cache: Optional[str]) -> bool:
+    """X-OCR-Cache: bypass ヘッダーでキャッシュ参照を無効化"""
+    return (x_ocr_cache or "").strip().lower() not in ("bypass", "no-cache", "off")
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheusテキスト形式のメトリクス"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats", response_model=CacheStatsResponse)
+async def cache_stats():
+    """OCR結果キャッシュのヒット/ミス数"""
+    if ocr_cache is None or not ocr_cache.enabled:
+        return CacheStatsResponse(enabled=False)
+    return CacheStatsResponse(enabled=True, **ocr_cache.stats())
 
 
 @app.post("/ocr", response_model=OCRResponse)
-async def run_ocr(request: OCRRequest):
+async def run_ocr(
+    request: OCRRequest,
+    http_request: Request,
+    x_ocr_cache: Optional[str] = Header(None),
+    x_ocr_deadline: Optional[float] = Header(None),
+):
     """
     画像に対してOCRを実行
     
     GPU Semaphoreにより同時実行数を制限
     """
     start_time = time.time()
+    guard = request_guard(http_request, x_ocr_deadline)
     
     try:
         img = decode_image(request.image_base64)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
     
-    # GPU Semaphoreを取得してOCR実行
-    async with gpu_semaphore:
-        loop = asyncio.get_event_loop()
-        
-        def do_ocr():
-            engine = load_ocr_engine()
-            results, _ = engine(img)
+    words = await ocr_image(img, use_cache=cache_requested(x_ocr_cache), guard=guard)
+    
+    processing_time = (time.time() - start_time) * 1000
+    
+    return encode_response(OCRResponse(
+        status="completed",
+        words=words,
+        processing_time_ms=round(processing_time, 2)
+    ), "ocr", http_request)
+
+
+@app.post("/ocr/upload", response_model=OCRBatchResponse)
+async def run_ocr_upload(
+    http_request: Request,
+    files: list[UploadFile] = File(...),
+    x_ocr_cache: Optional[str] = Header(None),
+    x_ocr_deadline: Optional[float] = Header(None),
+):
+    """
+    multipart/form-data で送られた複数画像に対してOCRを実行
+    
+    Base64/JSONを経由せず画像バイナリをそのまま受け取る。
+    結果はアップロード順に返す。
+    """
+    admit_pages(http_request, len(files))
+    use_cache = cache_requested(x_ocr_cache)
+    start_time = time.time()
+    guard = request_guard(http_request, x_ocr_deadline)
+    
+    imgs = []
+    for idx, f in enumerate(files):
+        try:
+            imgs.append(decode_image_bytes(await f.read()))
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid image data (file {idx}: {f.filename}): {str(e)}"
+            )
+        finally:
+            await f.close()
+    
+    async def ocr_one(img: np.ndarray) -> OCRResponse:
+        page_start = time.time()
+        words = await ocr_image(img, use_cache=use_cache, guard=guard)
+        return OCRResponse(
+            status="completed",
+            words=words,
+            processing_time_ms=round((time.time() - page_start) * 1000, 2)
+        )
+    
+    results = await asyncio.gather(*(ocr_one(img) for img in imgs))
+    
+    processing_time = (time.time() - start_time) * 1000
+    
+    return encode_response(OCRBatchResponse(
+        status="completed",
+        results=list(results),
+        processing_time_ms=round(processing_time, 2)
+    ), "ocr_upload", http_request)
+
+
+def page_parallelism() -> int:
+    """複数ページを扱うリクエストで同時に投入するページ数（バッチングが効くだけ並行させる）"""
+    return ocr_concurrency * max(1, OCR_MAX_BATCH_SIZE)
+
+
+async def job_worker():
+    """キュー待ちジョブを順に取り出して処理するバックグラウンドタスク"""
+    loop = asyncio.get_event_loop()
+    while True:
+        job = await loop.run_in_executor(None, job_queue.claim_next)
+        if job is None:
+            await loop.run_in_executor(
+                None, job_queue.purge_finished, OCR_JOB_TTL_HOURS * 3600
+            )
+            job_event.clear()
             try:
-                res_dict = results.model_dump()
-            except AttributeError:
-                res_dict = results.dict()
-            return res_dict.get('words', [])
+                await asyncio.wait_for(job_event.wait(), timeout=JOB_POLL_INTERVAL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            continue
         
-        words = await loop.run_in_executor(None, do_ocr)
+        try:
+            await process_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await loop.run_in_executor(None, job_queue.finish, job["id"], job_store.FAILED, str(e))
+
+
+async def process_job(job: dict):
+    """ジョブの未処理ページをOCRし、1ページごとに結果を保存"""
+    loop = asyncio.get_event_loop()
+    job_id = job["id"]
+    use_cache = bool(job["use_cache"])
+    pages = await loop.run_in_executor(None, job_queue.pending_pages, job_id)
+    page_slots = asyncio.Semaphore(page_parallelism())
+    
+    async def process_page(page_idx: int):
+        async with page_slots:
+            status = await loop.run_in_executor(None, job_queue.status, job_id)
+            if status != job_store.RUNNING:
+                return  # キャンセル済み
+            data = await loop.run_in_executor(None, job_queue.load_image, job_id, page_idx)
+            if data is None:
+                return  # 確認した直後にキャンセルされ、画像が破棄された
+            try:
+                img = decode_image_bytes(data)
+                words = await ocr_image(img, use_cache=use_cache)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await loop.run_in_executor(
+                    None, lambda: job_queue.save_page(job_id, page_idx, error=str(e))
+                )
+                return
+            await loop.run_in_executor(
+                None, lambda: job_queue.save_page(job_id, page_idx, words=words)
+            )
+    
+    await asyncio.gather(*(process_page(i) for i in pages))
+    
+    result = await loop.run_in_executor(None, job_queue.get, job_id)
+    if result is None:
+        return
+    if result["num_pages"] > 0 and all(p["error"] for p in result["results"]):
+        await loop.run_in_executor(
+            None, job_queue.finish, job_id, job_store.FAILED, "All pages failed"
+        )
+    else:
+        await loop.run_in_executor(None, job_queue.finish, job_id, job_store.COMPLETED)
+
+
+def job_response(job: dict) -> JobStatusResponse:
+    return JobStatusResponse(
+        job_id=job["id"],
+        status=job["status"],
+        num_pages=job["num_pages"],
+        pages_done=job["pages_done"],
+        error=job["error"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+        results=job.get("results"),
+    )
+
+
+@app.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job(
+    files: list[UploadFile] = File(...),
+    x_ocr_cache: Optional[str] = Header(None),
+):
+    """
+    OCRジョブを登録してすぐにジョブIDを返す
+    
+    画像は multipart/form-data で送る。処理はバックグラウンドで行われ、
+    GET /jobs/{job_id} で状態と結果を取得する。
+    """
+    images = []
+    for f in files:
+        images.append(await f.read())
+        await f.close()
     
+    loop = asyncio.get_event_loop()
+    job_id = await loop.run_in_executor(
+        None, lambda: job_queue.create(images, use_cache=cache_requested(x_ocr_cache))
+    )
+    job_event.set()
+    return JobSubmitResponse(job_id=job_id, status=job_store.QUEUED, num_pages=len(images))
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str, include_results: bool = True):
+    """ジョブの状態と（処理済みページの）結果を取得"""
+    loop = asyncio.get_event_loop()
+    job = await loop.run_in_executor(None, job_queue.get, job_id, include_results)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job_response(job)
+
+
+@app.delete("/jobs/{job_id}", response_model=JobStatusResponse)
+async def cancel_job(job_id: str):
+    """
+    ジョブをキャンセル
+    
+    キュー待ち・実行中ならキャンセル状態にする（実行中のページは完了まで待つ）。
+    終了済みのジョブは削除する。
+    """
+    loop = asyncio.get_event_loop()
+    job = await loop.run_in_executor(None, job_queue.get, job_id, False)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    
+    if job["status"] in job_store.FINISHED_STATUSES:
+        await loop.run_in_executor(None, job_queue.delete, job_id)
+    else:
+        await loop.run_in_executor(None, job_queue.finish, job_id, job_store.CANCELLED)
+        job = await loop.run_in_executor(None, job_queue.get, job_id, False)
+    return job_response(job)
+
+
+def parse_rois(rois_json: str) -> list[ROI]:
+    """フォームで送られたROIのJSON配列をパース"""
+    try:
+        return [ROI(**r) for r in json.loads(rois_json)]
+    except Exception as e:
+        ERRORS.inc(stage="request", type="InvalidROIs")
+        raise HTTPException(status_code=400, detail=f"Invalid rois: {str(e)}")
+
+
+def extract_rois(words: list, rois: list[ROI]) -> dict[str, str]:
+    """wordsから各ROIのテキストを抽出（ページごとに索引を1回だけ構築）"""
+    index = WordIndex(words)
+    return {
+        roi.label: index.extract({"x": roi.x, "y": roi.y, "w": roi.w, "h": roi.h}).strip()
+        for roi in rois
+    }
+
+
+async def ocr_and_extract(
+    img: np.ndarray,
+    roi_list: list[ROI],
+    roi_only: bool,
+    use_cache: bool,
+    guard: Optional[RequestGuard] = None,
+) -> tuple[dict[str, str], list, list[tuple[int, int, int, int]]]:
+    """
+    ページをOCRしてROIごとのテキストを抽出
+    
+    roi_only=True の場合はROIを余白付きで広げて重なりを結合した矩形だけを
+    切り出して推論し、wordsをページ座標に戻してから抽出する。
+    
+    Returns:
+        (extractions, ページ座標のwords, 推論した矩形のリスト)
+    """
+    img_h, img_w = img.shape[:2]
+    if not roi_only:
+        words = await ocr_image(img, use_cache=use_cache, guard=guard)
+        return extract_rois(words, roi_list), words, [(0, 0, img_w, img_h)]
+    
+    crops = plan_crops([r.model_dump() for r in roi_list], img_w, img_h, OCR_ROI_MARGIN)
+    
+    async def ocr_crop(rect: tuple[int, int, int, int]) -> list:
+        x1, y1, x2, y2 = rect
+        crop = np.ascontiguousarray(img[y1:y2, x1:x2])
+        return offset_words(await ocr_image(crop, use_cache=use_cache, guard=guard), x1, y1)
+    
+    crop_words = await asyncio.gather(*(ocr_crop(rect) for rect in crops))
+    words = [w for ws in crop_words for w in ws]
+    return extract_rois(words, roi_list), words, crops
+
+
+async def read_upload_image(file: UploadFile) -> np.ndarray:
+    """アップロードされた画像ファイルをデコード"""
+    try:
+        return decode_image_bytes(await file.read())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image data: {str(e)}")
+    finally:
+        await file.close()
+
+
+@app.post("/ocr/extract", response_model=OCRExtractResponse)
+async def run_ocr_extract(
+    http_request: Request,
+    file: UploadFile = File(...),
+    rois: str = Form(...),
+    roi_only: bool = Form(False),
+    include_words: bool = Form(False),
+    x_ocr_cache: Optional[str] = Header(None),
+    x_ocr_deadline: Optional[float] = Header(None),
+):
+    """
+    OCRとROI抽出を1リクエストで実行し、ラベルごとのテキストだけを返す
+    
+    wordsリストはクライアントに返さない（include_words=True の場合のみ返す）ため、
+    /ocr → /extract-roi の往復とwordsの再送が不要になる。
+    
+    Args:
+        file: ページ画像（PNG/JPEG等）
+        rois: ROIのJSON配列 [{"label", "x", "y", "w", "h"}, ...]
+        roi_only: Trueの場合ROI周辺だけをOCRする（/ocr/roi と同じ）
+        include_words: Trueの場合、ページ座標のwordsも返す
+    """
+    start_time = time.time()
+    guard = request_guard(http_request, x_ocr_deadline)
+    roi_list = parse_rois(rois)
+    img = await read_upload_image(file)
+    
+    extractions, words, _ = await ocr_and_extract(
+        img, roi_list, roi_only, cache_requested(x_ocr_cache), guard
+    )
     processing_time = (time.time() - start_time) * 1000
     
-    return OCRResponse(
+    return encode_response(OCRExtractResponse(
         status="completed",
-        words=words,
+        extractions=extractions,
+        words=words if include_words else None,
         processing_time_ms=round(processing_time, 2)
+    ), "ocr_extract", http_request)
+
+
+def parse_stream_form(num_files: int, page_ids: Optional[str], templates: Optional[str]) -> tuple[list, list]:
+    """/ocr/stream のページID・ページごとのROI指定をパース"""
+    try:
+        ids = json.loads(page_ids) if page_ids else list(range(num_files))
+        rois_per_page = json.loads(templates) if templates else [None] * num_files
+        if len(ids) != num_files or len(rois_per_page) != num_files:
+            raise ValueError("page_ids/templates must have one entry per file")
+        rois_per_page = [
+            None if rois is None else [ROI(**r) for r in rois]
+            for rois in rois_per_page
+        ]
+    except Exception as e:
+        ERRORS.inc(stage="request", type="InvalidStreamForm")
+        raise HTTPException(status_code=400, detail=f"Invalid stream request: {str(e)}")
+    return ids, rois_per_page
+
+
+@app.post("/ocr/stream")
+async def run_ocr_stream(
+    http_request: Request,
+    files: list[UploadFile] = File(...),
+    page_ids: Optional[str] = Form(None),
+    templates: Optional[str] = Form(None),
+    roi_only: bool = Form(False),
+    include_words: bool = Form(False),
+    x_ocr_cache: Optional[str] = Header(None),
+    x_ocr_deadline: Optional[float] = Header(None),
+):
+    """
+    複数ページをOCRし、1ページ終わるごとに結果をNDJSONで返す
+    
+    各行は {"page": ページID, "status": "completed" | "error", ...}。
+    1ページの失敗で全体は中断せず、そのページの行に error を入れて続行する。
+    最後に {"status": "done", "pages": n, "errors": n} を返す。
+    
+    Args:
+        files: ページ画像（PNG/JPEG等）
+        page_ids: ファイルごとのページID（JSON配列）。省略時は0始まりの連番
+        templates: ファイルごとのROI配列（JSON配列、要素がnullのページはwordsを返す）
+        roi_only: Trueの場合ROI周辺だけをOCRする
+        include_words: Trueの場合、ROI指定ありのページでもwordsを返す
+    """
+    ids, rois_per_page = parse_stream_form(len(files), page_ids, templates)
+    ticket = admit_pages(http_request, len(files))
+    use_cache = cache_requested(x_ocr_cache)
+    guard = request_guard(http_request, x_ocr_deadline, streaming=True)
+    
+    # レスポンス開始前にアップロードを読み切る（デコードはページごとに後で行う）
+    blobs = []
+    for f in files:
+        blobs.append(await f.read())
+        await f.close()
+    
+    page_slots = asyncio.Semaphore(page_parallelism())
+    
+    async def process_page(idx: int) -> dict:
+        try:
+            async with page_slots:
+                start = time.time()
+                result = {"page": ids[idx]}
+                try:
+                    img = decode_image_bytes(blobs[idx])
+                    blobs[idx] = None
+                    result.update(await ocr_page(img, rois_per_page[idx], roi_only, include_words, use_cache, guard))
+                except Exception as e:
+                    result["status"] = "error"
+                    result["error"] = f"{type(e).__name__}: {e}"
+                result["processing_time_ms"] = round((time.time() - start) * 1000, 2)
+                return result
+        finally:
+            page_finished(ticket)
+    
+    return ndjson_stream([process_page(i) for i in range(len(blobs))])
+
+
+async def ocr_page(
+    img: np.ndarray,
+    rois: Optional[list[ROI]],
+    roi_only: bool,
+    include_words: bool,
+    use_cache: bool,
+    guard: Optional[RequestGuard] = None,
+) -> dict:
+    """
+    ストリーミング系エンドポイントの1ページ分の結果
+    
+    ROI指定なし(None)ならwordsを返す。空のROI配列なら読み取る領域がないのでOCRしない。
+    """
+    if rois is None:
+        return {"words": await ocr_image(img, use_cache=use_cache, guard=guard), "status": "completed"}
+    if not rois:
+        return {"extractions": {}, "status": "completed"}
+    extractions, words, _ = await ocr_and_extract(img, rois, roi_only, use_cache, guard)
+    result = {"extractions": extractions}
+    if include_words:
+        result["words"] = words
+    result["status"] = "completed"
+    return result
+
+
+def ndjson_stream(pages: list, on_close: Optional[Callable[[], None]] = None) -> StreamingResponse:
+    """
+    ページごとの処理（結果dictを返すコルーチン）を並行に走らせ、終わった順にNDJSONで返す
+    
+    最後に {"status": "done", "pages": n, "errors": n} を返す。
+    クライアントが切断したら残りのページは処理しない。on_close はページ処理が止まってから呼ぶ。
+    """
+    async def generate():
+        tasks = [asyncio.create_task(page) for page in pages]
+        errors = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                errors += result["status"] == "error"
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({"status": "done", "pages": len(tasks), "errors": errors}) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            if on_close is not None:
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                on_close()
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.post("/ocr/pdf")
+async def run_ocr_pdf(
+    http_request: Request,
+    file: UploadFile = File(...),
+    dpi: int = Form(OCR_PDF_DPI),
+    templates: Optional[str] = Form(None),
+    roi_only: bool = Form(False),
+    include_words: bool = Form(False),
+    x_ocr_cache: Optional[str] = Header(None),
+    x_ocr_deadline: Optional[float] = Header(None),
+):
+    """
+    PDFを受け取り、サーバー側でページを画像化してOCRし、1ページ終わるごとにNDJSONで返す
+    
+    ページ画像ではなく圧縮されたPDFのまま送れるので転送量が大幅に減る。
+    ラスタライズはプロセスプールで並列に行い、描画できたページから推論に回す。
+    各行は /ocr/stream と同じ形式に、描画したページ画像の width / height を加えたもの
+    （page は1始まりのページ番号）。フロントエンドと同じDPIで描画すれば
+    テンプレート座標はそのまま対応する。
+    
+    Args:
+        file: PDFファイル
+        dpi: 描画解像度（フロントエンドの表示・テンプレート指定と揃える）
+        templates: ページごとのROI配列（JSON配列、要素がnullのページはwordsを返す）
+        roi_only: Trueの場合ROI周辺だけをOCRする
+        include_words: Trueの場合、ROI指定ありのページでもwordsを返す
+    """
+    if not 0 < dpi <= OCR_PDF_MAX_DPI:
+        raise HTTPException(status_code=400, detail=f"dpi must be between 1 and {OCR_PDF_MAX_DPI}")
+    use_cache = cache_requested(x_ocr_cache)
+    guard = request_guard(http_request, x_ocr_deadline, streaming=True)
+    
+    data = await file.read()
+    await file.close()
+    UPLOAD_BYTES.observe(len(data))
+    pdf = PdfFile(data)
+    del data
+    try:
+        num_pages = await asyncio.get_running_loop().run_in_executor(None, page_count, pdf.path)
+        if num_pages > OCR_PDF_MAX_PAGES:
+            raise ValueError(f"Too many pages: {num_pages} > {OCR_PDF_MAX_PAGES}")
+        _, rois_per_page = parse_stream_form(num_pages, None, templates)
+        ticket = admit_pages(http_request, num_pages)
+    except ValueError as e:
+        pdf.close()
+        ERRORS.inc(stage="decode", type="InvalidPDF")
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        pdf.close()
+        raise
+    
+    # 描画待ちの画像が溜まりすぎないよう、描画+推論中のページ数を抑える
+    page_slots = asyncio.Semaphore(page_parallelism() + OCR_PDF_WORKERS)
+    
+    async def process_page(idx: int) -> dict:
+        try:
+            async with page_slots:
+                start = time.time()
+                result = {"page": idx + 1}
+                try:
+                    render_start = time.perf_counter()
+                    img = await pdf_rasterizer.render(pdf.path, idx, dpi)
+                    DECODE_SECONDS.observe(time.perf_counter() - render_start, kind="pdf")
+                    IMAGE_MEGAPIXELS.observe(img.shape[0] * img.shape[1] / 1e6)
+                    result["width"], result["height"] = img.shape[1], img.shape[0]
+                    result.update(await ocr_page(img, rois_per_page[idx], roi_only, include_words, use_cache, guard))
+                except Exception as e:
+                    ERRORS.inc(stage="pdf", type=type(e).__name__)
+                    result["status"] = "error"
+                    result["error"] = f"{type(e).__name__}: {e}"
+                result["processing_time_ms"] = round((time.time() - start) * 1000, 2)
+                return result
+        finally:
+            page_finished(ticket)
+    
+    # 送信が終わるか切断された時点で一時ファイルを消す
+    return ndjson_stream([process_page(i) for i in range(num_pages)], on_close=pdf.close)
+
+
+@app.post("/ocr/roi", response_model=ROIOCRResponse)
+async def run_ocr_roi(
+    http_request: Request,
+    file: UploadFile = File(...),
+    rois: str = Form(...),
+    include_words: bool = Form(False),
+    x_ocr_cache: Optional[str] = Header(None),
+    x_ocr_deadline: Optional[float] = Header(None),
+):
+    """
+    テンプレート領域の周辺だけをOCRして各ラベルのテキストを返す
+    
+    ROIを余白付きで広げて重なりを結合した矩形だけを切り出して推論し、
+    wordsをページ座標に戻してから従来と同じ方法で文字を抽出する。
+    
+    Args:
+        file: ページ画像（PNG/JPEG等）
+        rois: ROIのJSON配列 [{"label", "x", "y", "w", "h"}, ...]
+        include_words: Trueの場合、ページ座標のwordsも返す
+    """
+    start_time = time.time()
+    guard = request_guard(http_request, x_ocr_deadline)
+    roi_list = parse_rois(rois)
+    img = await read_upload_image(file)
+    
+    extractions, words, crops = await ocr_and_extract(
+        img, roi_list, True, cache_requested(x_ocr_cache), guard
     )
+    
+    img_h, img_w = img.shape[:2]
+    crop_area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in crops)
+    processing_time = (time.time() - start_time) * 1000
+    
+    return encode_response(ROIOCRResponse(
+        status="completed",
+        extractions=extractions,
+        words=words if include_words else None,
+        crops=[list(rect) for rect in crops],
+        crop_area_ratio=round(crop_area / (img_w * img_h), 4),
+        processing_time_ms=round(processing_time, 2)
+    ), "ocr_roi", http_request)
 
 
 @app.post("/extract-roi", response_model=ExtractROIResponse)
@@ -197,13 +1405,7 @@ async def extract_roi(request: ExtractROIRequest):
     """
     OCR結果から指定されたROI領域のテキストを抽出
     """
-    extractions = {}
-    for roi in request.rois:
-        roi_dict = {"x": roi.x, "y": roi.y, "w": roi.w, "h": roi.h}
-        text = extract_text_from_roi(request.words_data, roi_dict)
-        extractions[roi.label] = text.strip()
-    
-    return ExtractROIResponse(extractions=extractions)
+    return ExtractROIResponse(extractions=extract_rois(request.words_data, request.rois))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""PDFのページ画像化: プロセスプールでページを並列にラスタライズする"""
+import asyncio
+import multiprocessing as mp
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+# ワーカープロセス内で直前に開いたPDF（同じPDFの連続ページで開き直さない）
+_open_doc = None
+_open_path: Optional[str] = None
+
+
+def page_count(pdf_path: str) -> int:
+    """PDFのページ数を返す（開けない・暗号化されている場合は ValueError）"""
+    import fitz
+    try:
+        doc = fitz.open(pdf_path, filetype="pdf")
+    except Exception as e:
+        raise ValueError(f"Failed to open PDF: {e}") from e
+    with doc:
+        if doc.needs_pass:
+            raise ValueError("Encrypted PDF is not supported")
+        return doc.page_count
+
+
+def render_page(pdf_path: str, index: int, dpi: int) -> np.ndarray:
+    """
+    1ページをBGR画像にラスタライズ（ワーカープロセスで実行）
+
+    フロントエンドの step1_upload と同じ方法で描画するので、同じDPIなら
+    画像サイズも一致し、テンプレート座標をそのまま使える。
+    """
+    global _open_doc, _open_path
+    import fitz
+    if _open_path != pdf_path:
+        if _open_doc is not None:
+            _open_doc.close()
+        _open_doc = fitz.open(pdf_path, filetype="pdf")
+        _open_path = pdf_path
+
+    pix = _open_doc[index].get_pixmap(dpi=dpi)
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)
+    # RGB(A) -> BGR（cv2をワーカーに読み込まないよう並べ替えで変換）
+    return np.ascontiguousarray(img[:, :, 2::-1])
+
+
+class PdfRasterizer:
+    """
+    PDFページを並列に画像化するプロセスプール
+
+    PyMuPDFはスレッドセーフでないためプロセスで並列化する。PDF本体は一時ファイルに
+    書き出してパスだけをワーカーに渡し、描画したページ画像だけを受け取る。
+    CUDA・推論スレッドを抱えた親をforkしないよう spawn で起動する。
+    """
+
+    def __init__(self, num_workers: int):
+        self.num_workers = max(1, num_workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=mp.get_context("spawn"),
+        )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, pdf_path: str, index: int, dpi: int) -> np.ndarray:
+        """1ページを空いているワーカーで描画"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, render_page, pdf_path, index, dpi)
+
+
+class PdfFile:
+    """アップロードされたPDFの一時ファイル（with で自動削除）"""
+
+    def __init__(self, data: bytes):
+        # ワーカー側は開いたPDFをパスで覚えるため、名前を使い回さない
+        fd, self.path = tempfile.mkstemp(prefix=f"ocr-{uuid.uuid4().hex}-", suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "PdfFile":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
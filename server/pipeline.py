@@ -0,0 +1,245 @@
+"""検出・認識のパイプライン: 2段を有界キューでつなぎ、ページNの認識中にページN+1を検出する"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from batching import build_words, detect_batch, recognize_batch
+
+
+class StageStats:
+    """1段分の処理数・処理時間と直近の稼働率"""
+
+    def __init__(self, name: str, workers: int, window: float = 60.0):
+        self.name = name
+        self.workers = workers
+        self.window = window
+        self.processed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self._created = time.monotonic()
+        self._intervals: deque = deque()  # 直近 window 秒の (開始, 終了)
+        self._active: list[float] = []  # 処理中バッチの開始時刻
+
+    def begin(self) -> float:
+        start = time.monotonic()
+        self._active.append(start)
+        return start
+
+    def end(self, start: float, batch_size: int) -> float:
+        """バッチ1つの終了を記録し、所要秒数を返す"""
+        now = time.monotonic()
+        self._active.remove(start)
+        self._intervals.append((start, now))
+        self.processed += batch_size
+        self.batches += 1
+        self.busy_seconds += now - start
+        return now - start
+
+    def utilization(self) -> float:
+        """直近 window 秒（起動直後はそれまで）のうちワーカーが処理していた割合"""
+        now = time.monotonic()
+        low = now - min(self.window, now - self._created)
+        while self._intervals and self._intervals[0][1] <= low:
+            self._intervals.popleft()
+        if now <= low:
+            return 0.0
+        busy = sum(end - max(start, low) for start, end in self._intervals)
+        busy += sum(now - max(start, low) for start in self._active)
+        return min(1.0, busy / ((now - low) * self.workers))
+
+    def status(self) -> dict:
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "busy": len(self._active),
+            "processed": self.processed,
+            "mean_batch_ms": round(self.busy_seconds / self.batches * 1000, 2) if self.batches else None,
+            "utilization": round(self.utilization(), 3),
+        }
+
+
+class OCRPipeline:
+    """
+    YomiToku OCR互換エンジン（detector / recognizer を持つもの）の2段パイプライン
+
+    検出段は入力キューから最大 max_batch_size 件を取り出して detect_batch し、
+    結果を有界キュー（queue_size）に積む。認識段はそこから取り出して recognize_batch し、
+    各呼び出し元の Future に wordsリストを返す。各段は専用のスレッドで workers 件まで
+    並行に動くので、ページNの認識中にページN+1の検出（と前後処理）が進む。
+    認識が詰まると検出段はキューの空きを待つ（メモリに検出済みページが溜まらない）。
+
+    結果は engine(img) と同じ（batching.ocr_batch と同じ関数で検出・認識する）。
+    検出段に入る直前に各リクエストの precheck を呼び、例外を送出したものは外す。
+    """
+
+    def __init__(
+        self,
+        engine,
+        det_workers: int = 1,
+        rec_workers: int = 1,
+        queue_size: int = 4,
+        max_batch_size: int = 1,
+        on_stage: Optional[Callable[[str, float, int], None]] = None,
+    ):
+        self.engine = engine
+        self.max_batch_size = max(1, max_batch_size)
+        self.on_stage = on_stage
+        self.detection = StageStats("detection", max(1, det_workers))
+        self.recognition = StageStats("recognition", max(1, rec_workers))
+        self._det_queue: asyncio.Queue = asyncio.Queue()
+        self._rec_queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._det_executor = ThreadPoolExecutor(self.detection.workers, thread_name_prefix="ocr-detect")
+        self._rec_executor = ThreadPoolExecutor(self.recognition.workers, thread_name_prefix="ocr-recognize")
+        self._tasks: list[asyncio.Task] = []
+        self.waiting = 0  # 検出開始待ちのリクエスト数
+        self.running = 0  # 検出開始から結果が出るまでのリクエスト数
+
+    @property
+    def capacity(self) -> int:
+        """パイプライン内（検出中・段間キュー・認識中）に入れるリクエスト数"""
+        return (
+            (self.detection.workers + self.recognition.workers) * self.max_batch_size
+            + self._rec_queue.maxsize
+        )
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._detect_loop()) for _ in range(self.detection.workers)]
+        self._tasks += [asyncio.create_task(self._recognize_loop()) for _ in range(self.recognition.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._det_executor.shutdown(wait=True)
+        self._rec_executor.shutdown(wait=True)
+
+    async def submit(
+        self,
+        img: np.ndarray,
+        timeout: Optional[float] = None,
+        precheck: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> list:
+        """
+        画像をパイプラインに入れ、wordsリストを待つ
+
+        timeout 秒以内に結果が出なければ asyncio.TimeoutError（未検出ならパイプラインから外れる）。
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiting += 1
+        await self._det_queue.put((img, future, precheck))
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    def seconds_per_image(self) -> float:
+        """ボトルネックの段の1画像あたり処理時間（ワーカー数で割った値）"""
+        return max(
+            stage.busy_seconds / stage.processed / stage.workers if stage.processed else 0.0
+            for stage in (self.detection, self.recognition)
+        )
+
+    def status(self) -> list[dict]:
+        return [
+            {**self.detection.status(), "queue": self._det_queue.qsize()},
+            {**self.recognition.status(), "queue": self._rec_queue.qsize()},
+        ]
+
+    @staticmethod
+    def _fill(queue: asyncio.Queue, batch: list, limit: int):
+        while len(batch) < limit and not queue.empty():
+            batch.append(queue.get_nowait())
+
+    async def _admit(self, batch: list) -> list:
+        """キャンセル済み・precheck で弾かれたリクエストを外す"""
+        checks = await asyncio.gather(
+            *(precheck() for _, _, precheck in batch if precheck is not None),
+            return_exceptions=True,
+        )
+        checks = iter(checks)
+        admitted = []
+        for img, future, precheck in batch:
+            error = next(checks) if precheck is not None else None
+            if future.done():
+                continue
+            if isinstance(error, BaseException):
+                future.set_exception(error)
+                continue
+            admitted.append((img, future))
+        return admitted
+
+    async def _run_stage(self, stage: StageStats, executor, fn, *args):
+        loop = asyncio.get_running_loop()
+        start = stage.begin()
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        finally:
+            seconds = stage.end(start, len(args[-1]))
+            if self.on_stage is not None:
+                self.on_stage(stage.name, seconds, len(args[-1]))
+
+    async def _detect_loop(self):
+        while True:
+            batch = [await self._det_queue.get()]
+            self._fill(self._det_queue, batch, self.max_batch_size)
+            self.waiting -= len(batch)
+            admitted = await self._admit(batch)
+            if not admitted:
+                continue
+            self.running += len(admitted)
+            imgs = [img for img, _ in admitted]
+            try:
+                dets = await self._run_stage(
+                    self.detection, self._det_executor, detect_batch, self.engine.detector, imgs
+                )
+            except Exception as e:
+                self.running -= len(admitted)
+                for _, future in admitted:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (img, future), (quads, scores) in zip(admitted, dets):
+                # 認識段が詰まっていればここで待つ（有界キュー）
+                await self._rec_queue.put((img, quads, scores, future))
+
+    async def _recognize_loop(self):
+        while True:
+            batch = [await self._rec_queue.get()]
+            self._fill(self._rec_queue, batch, self.max_batch_size)
+            taken = len(batch)
+            # 検出後に期限切れ等でキャンセルされた分は認識しない
+            batch = [item for item in batch if not item[3].done()]
+            try:
+                if batch:
+                    await self._recognize_batch(batch)
+            finally:
+                self.running -= taken
+
+    async def _recognize_batch(self, batch: list):
+        try:
+            words_list = await self._run_stage(
+                self.recognition, self._rec_executor, self._recognize,
+                [(img, quads, scores) for img, quads, scores, _ in batch],
+            )
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (*_, future), words in zip(batch, words_list):
+            if not future.done():
+                future.set_result(words)
+
+    def _recognize(self, items: list) -> list[list]:
+        imgs = [img for img, _, _ in items]
+        recs = recognize_batch(self.engine.recognizer, imgs, [quads for _, quads, _ in items])
+        return [
+            build_words(quads, det_scores, contents, rec_scores, directions)
+            for (_, quads, det_scores), (contents, rec_scores, directions) in zip(items, recs)
+        ]
@@ -0,0 +1,81 @@
+"""OCR前処理: 推論前にページを縮小し、結果の座標を元画像に戻す"""
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+def downscale_factor(
+    img_w: int,
+    img_h: int,
+    source_dpi: float,
+    target_dpi: float = 0,
+    max_side: int = 0,
+) -> float:
+    """
+    縮小率を決める（1.0なら縮小しない。拡大はしない）
+
+    Args:
+        img_w, img_h: 入力画像サイズ
+        source_dpi: 入力画像の解像度（フロントエンド・/ocr/pdf の描画DPI）
+        target_dpi: 推論時の解像度（0で指定なし）
+        max_side: 推論時の長辺の上限px（0で指定なし）
+    """
+    scale = 1.0
+    if target_dpi > 0 and source_dpi > 0:
+        scale = min(scale, target_dpi / source_dpi)
+    if max_side > 0:
+        scale = min(scale, max_side / max(img_w, img_h))
+    return scale
+
+
+def prepare_image(
+    img: np.ndarray,
+    scale: float,
+    grayscale: bool = False,
+) -> tuple[np.ndarray, float, float]:
+    """
+    推論用に画像を縮小（・グレースケール化）する
+
+    グレースケールでもエンジンの入力形式に合わせて3チャンネルのまま返す。
+
+    Returns:
+        (推論用画像, x方向の戻し倍率, y方向の戻し倍率)
+        戻し倍率は元画像サイズ / 縮小後サイズ（整数化による縦横の誤差も含めて正確に戻す）
+    """
+    img_h, img_w = img.shape[:2]
+    out = img
+    if scale < 1.0:
+        new_w = max(1, round(img_w * scale))
+        new_h = max(1, round(img_h * scale))
+        out = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    if grayscale and out.ndim == 3:
+        out = cv2.cvtColor(cv2.cvtColor(out, cv2.COLOR_BGR2GRAY), cv2.COLOR_GRAY2BGR)
+    out_h, out_w = out.shape[:2]
+    return out, img_w / out_w, img_h / out_h
+
+
+def rescale_words(words: list, sx: float, sy: float, img_size: Optional[tuple[int, int]] = None) -> list:
+    """
+    縮小画像座標のwordsを元画像の座標に戻す
+
+    頂点は画素の境界座標として扱い、倍率をそのまま掛ける（縮小は画像全体の
+    一様な拡大縮小なので、この写像で元画像上の同じ位置に戻る）。
+    エンジンの出力と同じく整数に丸め、img_size=(w, h) を渡すと画像内にクリップする。
+    """
+    if sx == 1.0 and sy == 1.0:
+        return words
+    shifted = []
+    for word in words:
+        word = dict(word)
+        points = []
+        for p in word.get("points", []):
+            x = round(p[0] * sx)
+            y = round(p[1] * sy)
+            if img_size is not None:
+                x = min(max(x, 0), img_size[0])
+                y = min(max(y, 0), img_size[1])
+            points.append([x, y])
+        word["points"] = points
+        shifted.append(word)
+    return shifted
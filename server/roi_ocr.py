@@ -0,0 +1,50 @@
+"""ROI限定OCR: テンプレート領域の周辺だけを切り出して認識する"""
+
+
+def plan_crops(rois: list[dict], img_w: int, img_h: int, margin: int) -> list[tuple[int, int, int, int]]:
+    """
+    ROIをマージン付きで広げ、重なるものを結合した切り出し矩形を返す
+
+    Args:
+        rois: [{"x", "y", "w", "h"}, ...]（ページ座標）
+        img_w, img_h: ページ画像サイズ
+        margin: 各ROIの周囲に足す余白（px）。枠際の文字が欠けないようにする
+
+    Returns:
+        [(x1, y1, x2, y2), ...]（画像内にクリップ済み、面積ゼロのものは除外）
+    """
+    rects = []
+    for roi in rois:
+        x1 = max(0, int(roi["x"]) - margin)
+        y1 = max(0, int(roi["y"]) - margin)
+        x2 = min(img_w, int(roi["x"] + roi["w"]) + margin)
+        y2 = min(img_h, int(roi["y"] + roi["h"]) + margin)
+        if x2 > x1 and y2 > y1:
+            rects.append((x1, y1, x2, y2))
+
+    # 重なる矩形をなくなるまで結合
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        while rects:
+            a = rects.pop()
+            for i, b in enumerate(result):
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    result[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    merged = True
+                    break
+            else:
+                result.append(a)
+        rects = result
+    return sorted(rects, key=lambda r: (r[1], r[0]))
+
+
+def offset_words(words: list, dx: int, dy: int) -> list:
+    """切り出し画像座標のwordsをページ座標に平行移動"""
+    shifted = []
+    for word in words:
+        word = dict(word)
+        word["points"] = [[p[0] + dx, p[1] + dy] for p in word.get("points", [])]
+        shifted.append(word)
+    return shifted
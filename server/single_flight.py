@@ -0,0 +1,73 @@
+"""同時に処理中の同一リクエストの統合（single-flight）: 同じ画像の推論を1回にまとめる"""
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+
+class SingleFlight:
+    """
+    キーごとに処理中の呼び出しを1つにまとめる
+
+    同じキーの呼び出しが処理中なら、後から来た呼び出しは新たに実行せず先行の結果を待つ。
+    結果は保存しない（処理中の重複だけを除く。長期の再利用は OCRCache の役目）。
+
+    先行の呼び出しがその呼び出し元固有の理由（期限切れ・切断・キャンセル）で失敗した場合、
+    待っていた側は結果を受け取れないので、自分が先行として実行し直す。
+    それ以外の例外（画像が処理できない等）は待っていた側にもそのまま送出する。
+    """
+
+    def __init__(self, retry_on: tuple = ()):
+        self.retry_on = retry_on
+        self.coalesced = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable],
+        timeout: Optional[float] = None,
+        on_coalesced: Optional[Callable[[], None]] = None,
+    ):
+        """
+        key が処理中なら先行の結果を待ち、そうでなければ fn() を実行する
+
+        timeout は待つ側の上限秒数（やり直しを含めた合計。超えたら asyncio.TimeoutError）。
+        coalesced / on_coalesced は先行の結果（例外を含む）を受け取れた呼び出しだけを1回数える。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                return await self._lead(key, fn)
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            # 待つ側がキャンセルされても先行の future には影響させない
+            kind, value = await asyncio.wait_for(asyncio.shield(future), remaining)
+            if kind == "retry":
+                continue  # 先行が呼び出し元固有の理由で終わったのでやり直す
+            self.coalesced += 1
+            if on_coalesced is not None:
+                on_coalesced()
+            if kind == "error":
+                raise value
+            return value
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable]):
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[key] = future
+        outcome = ("retry", None)
+        try:
+            value = await fn()
+            outcome = ("ok", value)
+            return value
+        except self.retry_on:
+            raise
+        except Exception as e:
+            outcome = ("error", e)
+            raise
+        finally:
+            # 例外ではなく結果として渡す（待つ側がいなくても未回収の警告を出さない）
+            del self._inflight[key]
+            future.set_result(outcome)
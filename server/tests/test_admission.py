@@ -0,0 +1,165 @@
+"""受付制御: 複数ページのリクエストはページ数で数え、終わったページから枠を返す"""
+import asyncio
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from admission import AdmissionControl, AdmissionMiddleware, AdmissionTicket, Overloaded
+
+
+def test_control_rejects_only_when_waiting_is_full():
+    control = AdmissionControl(max_waiting=2, capacity=1)
+    control.acquire()  # 推論中
+    control.acquire(2)  # 待ち2
+    assert control.waiting == 2
+    with pytest.raises(Overloaded) as e:
+        control.acquire()
+    assert 1 <= e.value.retry_after <= 60
+    control.release(2)
+    control.acquire()
+    assert control.in_flight == 2
+
+
+def test_large_request_is_admitted_when_queue_is_empty():
+    # 上限より多いページも、受け付ける前の待ち行列が空いていれば受け付ける
+    control = AdmissionControl(max_waiting=4, capacity=2)
+    ticket = AdmissionTicket(control)
+    ticket.acquire()
+    ticket.expand(10)
+    assert ticket.units == 10 and control.in_flight == 10
+    # 後から来た1枚のリクエストは断られる
+    with pytest.raises(Overloaded):
+        AdmissionTicket(control).acquire()
+
+
+def test_ticket_releases_pages_as_they_finish():
+    control = AdmissionControl(max_waiting=0, capacity=1)
+    ticket = AdmissionTicket(control)
+    ticket.acquire()
+    ticket.expand(5)
+    ticket.expand(3)  # 減らす方向には変えない
+    assert control.in_flight == 5
+    for _ in range(3):
+        ticket.page_done()
+    assert ticket.units == 2 and control.in_flight == 2
+    ticket.close()
+    ticket.page_done()
+    assert ticket.units == 0 and control.in_flight == 0
+
+
+def make_app(control: AdmissionControl, observed: list, on_reject=None):
+    """ocr_server の複数ページエンドポイントと同じ使い方をする最小のアプリ"""
+
+    async def pages(request: Request):
+        num_pages = int(request.query_params["n"])
+        ticket = request.scope["state"]["admission"]
+        try:
+            ticket.expand(num_pages)
+        except Overloaded as e:
+            return JSONResponse({"detail": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)})
+        observed.append(control.in_flight)
+
+        async def body():
+            for page in range(num_pages):
+                await asyncio.sleep(0)
+                ticket.page_done()
+                observed.append(control.in_flight)
+                yield f"{page}\n"
+
+        return StreamingResponse(body(), media_type="application/x-ndjson")
+
+    async def other(request: Request):
+        observed.append(control.in_flight)
+        return JSONResponse({})
+
+    app = Starlette(routes=[Route("/pages", pages, methods=["POST"]), Route("/other", other, methods=["POST"])])
+    app.add_middleware(AdmissionMiddleware, control=control, paths={"/pages"}, on_reject=on_reject)
+    return app
+
+
+def test_middleware_counts_pages_and_releases_everything():
+    control = AdmissionControl(max_waiting=8, capacity=1)
+    observed = []
+    with TestClient(make_app(control, observed)) as client:
+        response = client.post("/pages?n=4")
+        assert response.status_code == 200
+        assert response.text.splitlines() == ["0", "1", "2", "3"]
+        # 本体を読んだ時点で4ページ分、1ページ終わるごとに1つ減る
+        assert observed == [4, 3, 2, 1, 0]
+        assert control.in_flight == 0
+
+        observed.clear()
+        assert client.post("/other").status_code == 200
+        assert observed == [0]  # 対象外のパスは数えない
+
+
+def test_middleware_rejects_with_retry_after_when_full():
+    control = AdmissionControl(max_waiting=2, capacity=1)
+    control.acquire(3)  # 推論中1 + 待ち2（別のリクエスト）
+    rejected = []
+    with TestClient(make_app(control, [], on_reject=lambda: rejected.append(1))) as client:
+        response = client.post("/pages?n=1")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert rejected == [1]
+    assert control.in_flight == 3
+
+
+def test_page_count_rejected_after_admission_releases_the_first_unit():
+    control = AdmissionControl(max_waiting=1, capacity=1)
+    with TestClient(make_app(control, [])) as client:
+        control.acquire(1)  # 推論中1（待ち0）
+        # 1枚分で受け付けた後、待ち行列が1になったのでページ数分の拡張は断られる
+        response = client.post("/pages?n=3")
+        assert response.status_code == 429
+        assert control.in_flight == 1
+
+
+class CountingEngine:
+    """推論のたびに受付制御が数えている画像数を記録する偽のエンジン"""
+
+    def __init__(self, control: AdmissionControl):
+        self.control = control
+        self.in_flight = []
+
+    def __call__(self, img):
+        self.in_flight.append(self.control.in_flight)
+        return type("Results", (), {"model_dump": lambda self: {"words": []}})(), None
+
+
+def png(value: int) -> bytes:
+    import cv2
+    import numpy as np
+
+    _, buffer = cv2.imencode(".png", np.full((32, 32, 3), value, np.uint8))
+    return buffer.tobytes()
+
+
+def test_upload_is_counted_per_page(monkeypatch):
+    ocr_server = pytest.importorskip("ocr_server")
+    control = ocr_server.admission
+    monkeypatch.setattr(control, "max_waiting", 2)
+    monkeypatch.setattr(control, "capacity", 1)
+    monkeypatch.setattr(control, "in_flight", 0)
+    engine = CountingEngine(control)
+    monkeypatch.setattr(ocr_server, "ocr_engine", engine)
+    # lifespan（エンジンの読み込み・ジョブDB）は動かさず、推論に必要なものだけ用意する
+    monkeypatch.setattr(ocr_server, "gpu_semaphore", asyncio.Semaphore(1))
+    client = TestClient(ocr_server.app)
+    headers = {"X-OCR-Cache": "bypass"}
+
+    files = [("files", (f"{i}.png", png(i), "image/png")) for i in range(3)]
+    assert client.post("/ocr/upload", files=files, headers=headers).status_code == 200
+    assert engine.in_flight and max(engine.in_flight) == 3
+    assert control.in_flight == 0
+
+    # 推論中1 + 待ち1: 1枚分では受け付けるが、3ページ分に数え直すと待ち行列が満杯
+    control.acquire(2)
+    response = client.post("/ocr/upload", files=files, headers=headers)
+    assert response.status_code == 429 and "Retry-After" in response.headers
+    assert control.in_flight == 2
+    control.release(2)
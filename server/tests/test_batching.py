@@ -0,0 +1,66 @@
+"""バッチ推論（batching.ocr_batch）が1枚ずつの推論と同じ結果を返すことの確認"""
+import numpy as np
+import pytest
+
+import batching
+from bench_server import receipt_image
+from batching import ocr_batch, ocr_single, supports_batching
+
+
+class FakeResults:
+    def __init__(self, words):
+        self.words = words
+
+    def model_dump(self):
+        return {"words": self.words}
+
+
+class DetectorRecognizerEngine:
+    """detector / recognizer を持つが、内部APIは持たないエンジン"""
+
+    detector = object()
+    recognizer = object()
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, img):
+        self.calls += 1
+        return FakeResults([{"points": [[0, 0], [1, 0], [1, 1], [0, 1]], "content": str(img.shape[1])}]), None
+
+
+def test_unverified_yomitoku_version_falls_back_to_single(monkeypatch):
+    monkeypatch.setattr(batching, "BATCHING_SUPPORTED", False)
+    engine = DetectorRecognizerEngine()
+    imgs = [np.zeros((10, w, 3), np.uint8) for w in (10, 20, 30)]
+    assert not supports_batching(engine)
+    assert ocr_batch(engine, imgs) == [ocr_single(engine, img) for img in imgs]
+    assert engine.calls == 6
+
+
+def test_engine_without_detector_is_not_batched(monkeypatch):
+    monkeypatch.setattr(batching, "BATCHING_SUPPORTED", True)
+    assert not supports_batching(object())
+
+
+@pytest.fixture(scope="module")
+def yomitoku_engine():
+    pytest.importorskip("yomitoku")
+    if not batching.BATCHING_SUPPORTED:
+        pytest.skip(f"batched OCR is only enabled for yomitoku {batching.YOMITOKU_BATCHING_VERSION}")
+    from engine_pool import create_engine
+    return create_engine("cpu")
+
+
+def test_batched_matches_unbatched(yomitoku_engine):
+    # 同じ形状の2枚（同じバッチになる）と別形状の1枚
+    imgs = [receipt_image(0), receipt_image(1), receipt_image(2, size="a4")]
+    batched = ocr_batch(yomitoku_engine, imgs)
+    single = [ocr_single(yomitoku_engine, img) for img in imgs]
+    assert len(batched) == len(single)
+    for got, want in zip(batched, single):
+        assert [w["content"] for w in got] == [w["content"] for w in want]
+        assert [w["points"] for w in got] == [w["points"] for w in want]
+        assert [w["direction"] for w in got] == [w["direction"] for w in want]
+        assert [w["det_score"] for w in got] == pytest.approx([w["det_score"] for w in want], abs=1e-4)
+        assert [w["rec_score"] for w in got] == pytest.approx([w["rec_score"] for w in want], abs=1e-4)
@@ -0,0 +1,120 @@
+"""EnginePool: ワーカーの再起動・dead の扱いと、forkserver で共有するエンジン"""
+import os
+import textwrap
+
+import numpy as np
+import pytest
+
+from cpu_profile import CPUProfile
+from engine_pool import EnginePool
+
+IMG = np.zeros((4, 4, 3), np.uint8)
+
+
+class BrokenConn:
+    """送った直後にワーカーが落ちたように見える接続"""
+
+    def send(self, obj):
+        pass
+
+    def recv(self):
+        raise EOFError("worker exited")
+
+
+def pool_with_broken_workers(count: int) -> EnginePool:
+    pool = EnginePool(count, "cpu", 1)
+    for worker in pool.workers:
+        worker.state = "idle"
+        worker.conn = BrokenConn()
+        pool._idle.put(worker)
+    return pool
+
+
+def test_worker_that_cannot_restart_is_marked_dead(monkeypatch):
+    pool = pool_with_broken_workers(2)
+
+    def restart(worker):
+        raise TimeoutError("not ready")
+
+    monkeypatch.setattr(pool, "_restart", restart)
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="crashed"):
+            pool.ocr_batch([IMG])
+    assert [w["state"] for w in pool.status()] == ["dead", "dead"]
+    assert all("restart failed: TimeoutError" in w["last_error"] for w in pool.status())
+    assert pool.alive_workers == 0
+    # dead のワーカーは使わず、待たずに例外にする
+    with pytest.raises(RuntimeError, match="All OCR workers are dead"):
+        pool.ocr_batch([IMG])
+
+
+def test_restarted_worker_goes_back_to_idle(monkeypatch):
+    pool = pool_with_broken_workers(1)
+    restarted = []
+    monkeypatch.setattr(pool, "_restart", restarted.append)
+    with pytest.raises(RuntimeError, match="crashed"):
+        pool.ocr_batch([IMG])
+    assert restarted == pool.workers
+    assert pool._idle.qsize() == 1
+
+
+FAKE_YOMITOKU = '''
+import os
+
+class Results:
+    def __init__(self, words):
+        self.words = words
+
+    def model_dump(self):
+        return {"words": self.words}
+
+class OCR:
+    def __init__(self, visualize=False, device="cpu"):
+        self.loaded_in = os.getpid()
+
+    def __call__(self, img):
+        if img[0, 0, 0] == 255:
+            os._exit(3)
+        return Results([{"content": f"{self.loaded_in}:{os.getpid()}"}]), None
+'''
+
+FAKE_TORCH = '''
+def set_num_threads(n):
+    pass
+
+def set_num_interop_threads(n):
+    pass
+'''
+
+
+def test_shared_engine_is_loaded_once_in_forkserver(tmp_path, monkeypatch):
+    (tmp_path / "yomitoku").mkdir()
+    (tmp_path / "yomitoku" / "__init__.py").write_text(textwrap.dedent(FAKE_YOMITOKU))
+    try:
+        import torch  # noqa: F401
+    except ImportError:
+        (tmp_path / "torch.py").write_text(textwrap.dedent(FAKE_TORCH))
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    pool = EnginePool(2, "cpu", 1, CPUProfile(), share_engine=True, ready_timeout=60)
+    pool.start()
+    try:
+        def loaders(n):
+            return {pool.ocr_batch([IMG])[0][0]["content"].split(":")[0] for _ in range(n)}
+
+        shared = loaders(4)
+        # 1回だけ、サーバー本体ではなく forkserver でロードされている
+        assert len(shared) == 1 and str(os.getpid()) not in shared
+        assert len({w["pid"] for w in pool.status()}) == 2
+
+        crash = IMG.copy()
+        crash[0, 0, 0] = 255
+        with pytest.raises(RuntimeError, match="crashed"):
+            pool.ocr_batch([crash])
+        assert sum(w["restarts"] for w in pool.status()) == 1
+        assert [w["state"] for w in pool.status()] == ["idle", "idle"]
+        # 再起動したワーカーも同じエンジンを共有する
+        assert loaders(4) == shared
+    finally:
+        pool.stop()
@@ -0,0 +1,75 @@
+"""JobStore: 再起動時のキュー待ちへの戻しと、キャンセル後に結果で上書きしないこと"""
+import pytest
+
+import job_store
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_requeue_running_resumes_only_unfinished_pages(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(path)
+    job_id = store.create([b"p0", b"p1", b"p2"])
+    job = store.claim_next()
+    assert job["id"] == job_id and job["status"] == job_store.RUNNING
+    store.save_page(job_id, 0, words=[{"content": "a", "points": []}])
+    store.save_page(job_id, 2, error="bad image")
+    store.close()
+
+    # 実行中のまま再起動した
+    store = JobStore(path)
+    assert store.requeue_running() == 1
+    assert store.status(job_id) == job_store.QUEUED
+    assert store.queue_length() == 1
+    job = store.claim_next()
+    assert job["id"] == job_id
+    assert store.pending_pages(job_id) == [1]
+    assert store.load_image(job_id, 1) == b"p1"
+    # 結果を保存したページの画像は消えている
+    assert store.load_image(job_id, 0) is None
+    result = store.get(job_id)
+    assert result["pages_done"] == 2
+    assert result["results"][0]["words"] == [{"content": "a", "points": []}]
+    store.close()
+
+
+def test_claim_next_takes_oldest_queued_job(store):
+    first = store.create([b"a"])
+    second = store.create([b"b"])
+    assert store.claim_next()["id"] == first
+    assert store.claim_next()["id"] == second
+    assert store.claim_next() is None
+    assert store.requeue_running() == 2
+
+
+def test_cancelled_job_is_not_overwritten(store):
+    job_id = store.create([b"p0", b"p1"])
+    store.claim_next()
+    store.save_page(job_id, 0, words=[])
+    assert store.finish(job_id, job_store.CANCELLED)
+    assert store.status(job_id) == job_store.CANCELLED
+    # 実行中だったワーカーが後から完了・失敗を書こうとしても変わらない
+    assert not store.finish(job_id, job_store.COMPLETED)
+    assert not store.finish(job_id, job_store.FAILED, "late error")
+    job = store.get(job_id)
+    assert job["status"] == job_store.CANCELLED and job["error"] is None
+    # 残りのページの画像は捨てられ、再起動しても戻らない
+    assert store.load_image(job_id, 1) is None
+    assert store.requeue_running() == 0
+    assert store.claim_next() is None
+
+
+def test_cancel_queued_job_and_purge(store):
+    job_id = store.create([b"p0"])
+    assert store.finish(job_id, job_store.CANCELLED)
+    assert store.queue_length() == 0
+    assert store.claim_next() is None
+    assert store.purge_finished(older_than_sec=-1) == 1
+    assert store.get(job_id) is None
+    assert not store.delete(job_id)
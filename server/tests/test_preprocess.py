@@ -0,0 +1,53 @@
+"""前処理: 縮小した画像で得た座標が rescale_words で元画像の同じ位置に戻る"""
+import numpy as np
+import pytest
+
+from preprocess import downscale_factor, prepare_image, rescale_words
+
+
+def word(points, content="abc"):
+    return {"content": content, "points": points, "direction": "horizontal", "rec_score": 0.9, "det_score": 0.9}
+
+
+@pytest.mark.parametrize("size", [(2480, 3508), (3507, 2481), (1001, 777)])
+def test_words_map_back_to_original_coordinates(size):
+    width, height = size
+    img = np.zeros((height, width, 3), np.uint8)
+    scale = downscale_factor(width, height, source_dpi=300, target_dpi=150)
+    small, sx, sy = prepare_image(img, scale)
+    small_h, small_w = small.shape[:2]
+
+    rng = np.random.default_rng(width)
+    # 元画像上の矩形を縮小画像の座標にしてから戻す（エンジンは縮小画像の整数座標を返す）
+    for _ in range(50):
+        x0, x1 = sorted(rng.integers(0, width, 2))
+        y0, y1 = sorted(rng.integers(0, height, 2))
+        original = [[x0, y0], [x1, y0], [x1, y1], [x0, y1]]
+        detected = [[round(x * small_w / width), round(y * small_h / height)] for x, y in original]
+        [restored] = rescale_words([word(detected)], sx, sy, (width, height))
+        error = np.abs(np.array(restored["points"]) - np.array(original))
+        # 縮小画像の1画素（戻し倍率分）以内
+        assert error[:, 0].max() <= sx and error[:, 1].max() <= sy
+
+
+def test_exact_factors_cover_the_whole_image():
+    img = np.zeros((1001, 777, 3), np.uint8)
+    small, sx, sy = prepare_image(img, 0.33)
+    small_h, small_w = small.shape[:2]
+    corner = [[0, 0], [small_w, 0], [small_w, small_h], [0, small_h]]
+    [restored] = rescale_words([word(corner)], sx, sy)
+    assert restored["points"] == [[0, 0], [777, 0], [777, 1001], [0, 1001]]
+
+
+def test_points_are_clipped_and_other_fields_kept():
+    words = [word([[-2, -2], [120, -2], [120, 60], [-2, 60]], content="x")]
+    [restored] = rescale_words(words, 2.0, 2.0, (200, 100))
+    assert restored["points"] == [[0, 0], [200, 0], [200, 100], [0, 100]]
+    assert restored["content"] == "x" and restored["rec_score"] == 0.9
+    # 元の words は書き換えない
+    assert words[0]["points"][0] == [-2, -2]
+
+
+def test_no_scaling_returns_words_unchanged():
+    words = [word([[1, 2], [3, 2], [3, 4], [1, 4]])]
+    assert rescale_words(words, 1.0, 1.0) is words
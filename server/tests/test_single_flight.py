@@ -0,0 +1,101 @@
+"""SingleFlight: 同一キーの統合、先行の失敗時のやり直しと例外の伝播、待つ側の期限"""
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class CallerGone(Exception):
+    """呼び出し元固有の理由で先行が終わった（retry_on に指定する）"""
+
+
+def test_identical_calls_run_once_and_count_reuse():
+    async def main():
+        flight = SingleFlight()
+        calls = []
+        counted = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "words"
+
+        results = await asyncio.gather(*(
+            flight.run("k", fn, on_coalesced=lambda: counted.append(1)) for _ in range(3)
+        ))
+        return flight, results, calls, counted
+
+    flight, results, calls, counted = asyncio.run(main())
+    assert results == ["words"] * 3
+    assert len(calls) == 1
+    assert flight.coalesced == 2 and len(counted) == 2
+    assert len(flight) == 0
+
+
+def test_waiter_reruns_when_leader_fails_for_its_own_reason():
+    async def main():
+        flight = SingleFlight(retry_on=(CallerGone,))
+        calls = []
+
+        async def leader():
+            calls.append("leader")
+            await asyncio.sleep(0.05)
+            raise CallerGone()
+
+        async def waiter():
+            calls.append("waiter")
+            return "words"
+
+        first = asyncio.ensure_future(flight.run("k", leader))
+        await asyncio.sleep(0)
+        second = await flight.run("k", waiter)
+        with pytest.raises(CallerGone):
+            await first
+        return flight, second, calls
+
+    flight, second, calls = asyncio.run(main())
+    assert second == "words"
+    assert calls == ["leader", "waiter"]
+    assert flight.coalesced == 0  # 先行の結果は使っていない
+
+
+def test_other_errors_propagate_to_waiters():
+    async def main():
+        flight = SingleFlight(retry_on=(CallerGone,))
+
+        async def fn():
+            await asyncio.sleep(0.05)
+            raise ValueError("bad image")
+
+        return flight, await asyncio.gather(
+            flight.run("k", fn), flight.run("k", fn), return_exceptions=True,
+        )
+
+    flight, results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert flight.coalesced == 1
+
+
+def test_timeout_covers_retries():
+    async def main():
+        flight = SingleFlight(retry_on=(CallerGone,))
+        loop = asyncio.get_running_loop()
+        first = loop.create_future()
+        flight._inflight["k"] = first
+
+        def leader_gone():
+            # 先行が呼び出し元固有の理由で終わり、同時に別の呼び出しが次の先行になった
+            flight._inflight["k"] = loop.create_future()
+            first.set_result(("retry", None))
+
+        loop.call_later(0.15, leader_gone)
+        start = loop.time()
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.run("k", lambda: None, timeout=0.2)
+        return flight, loop.time() - start
+
+    flight, elapsed = asyncio.run(main())
+    # やり直した後の待ちは残り時間（0.05秒）だけ
+    assert elapsed < 0.3
+    assert flight.coalesced == 0
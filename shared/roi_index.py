@@ -0,0 +1,113 @@
+"""OCR結果の文字ジオメトリ索引: 1ページ分のwordsから複数ROIのテキストをまとめて抽出（フロントエンド・サーバー共通）"""
+from typing import Optional
+
+import numpy as np
+
+
+class WordIndex:
+    """
+    wordsリストを文字単位のNumPy配列に展開した索引
+
+    各wordの外接矩形を文字数で等分して文字中心を推定し、文字中心x・wordの中心yで
+    ROIとの包含を判定する（横書き1行想定）。判定規則・並び順は従来の
+    extract_text_from_roi と同一で、同じ文字列を返す。
+
+    文字はwordの中心y順に並べて保持し、ROIごとにy範囲を二分探索で絞り込んでから
+    x範囲をベクトル演算で判定する。
+    """
+
+    def __init__(self, words_data):
+        """words_data: wordsリスト、または列指向の WordArrays（wire_format）"""
+        if hasattr(words_data, 'points') and hasattr(words_data, 'contents'):
+            wx1, wy1, wx2, wy2, contents = self._bounds_from_arrays(words_data)
+        else:
+            wx1, wy1, wx2, wy2, contents = self._bounds_from_dicts(words_data)
+
+        counts = np.array([len(c) for c in contents], dtype=np.int64)
+        wx1 = np.asarray(wx1, dtype=np.float64)
+        wx2 = np.asarray(wx2, dtype=np.float64)
+        wy1 = np.asarray(wy1, dtype=np.float64)
+        wy2 = np.asarray(wy2, dtype=np.float64)
+
+        # 文字ごとの値に展開（word内の位置 i は 0..len-1）
+        char_width = (wx2 - wx1) / np.maximum(counts, 1)
+        starts = np.cumsum(counts) - counts
+        pos = np.arange(int(counts.sum()), dtype=np.float64) - np.repeat(starts, counts)
+        cx = np.repeat(wx1, counts) + np.repeat(char_width, counts) * (pos + 0.5)
+        cy = np.repeat((wy1 + wy2) / 2, counts)
+        chars = np.array(list("".join(contents)), dtype='<U1') if contents else np.empty(0, dtype='<U1')
+
+        # y順にソートして保持（同値は元の順序を維持）
+        order = np.argsort(cy, kind='stable')
+        self._cy = cy[order]
+        self._cx = cx[order]
+        self._seq = order  # 元の出現順（x同値時の並び順に使う）
+        self._chars = chars[order]
+
+    @staticmethod
+    def _bounds_from_dicts(words_data: list) -> tuple:
+        wx1, wy1, wx2, wy2, contents = [], [], [], [], []
+        for word in words_data:
+            points = word.get('points', [])
+            content = word.get('content', '')
+            if len(points) < 4 or not content:
+                continue
+            xs = [p[0] for p in points]
+            ys = [p[1] for p in points]
+            wx1.append(min(xs))
+            wy1.append(min(ys))
+            wx2.append(max(xs))
+            wy2.append(max(ys))
+            contents.append(content)
+        return wx1, wy1, wx2, wy2, contents
+
+    @staticmethod
+    def _bounds_from_arrays(words) -> tuple:
+        """
+        (n, 4, 2) の頂点配列から外接矩形をまとめて求める
+
+        頂点のないwordは wire_format で0埋めされている（to_dicts では空リスト）ので、dictと同じく文字列のないwordとともに除く。
+        """
+        contents = words.contents
+        points = np.asarray(words.points).reshape(len(contents), 4, 2)
+        keep = np.array([bool(c) for c in contents], dtype=bool) & points.any(axis=(1, 2))
+        points = points[keep]
+        xs = points[:, :, 0]
+        ys = points[:, :, 1]
+        contents = [c for c, k in zip(contents, keep) if k]
+        return xs.min(axis=1), ys.min(axis=1), xs.max(axis=1), ys.max(axis=1), contents
+
+    def __len__(self) -> int:
+        return len(self._chars)
+
+    def extract(self, roi: dict) -> str:
+        """ROI内の文字をx順に連結して返す"""
+        rx, ry, rw, rh = roi['x'], roi['y'], roi['w'], roi['h']
+        lo = np.searchsorted(self._cy, ry, side='left')
+        hi = np.searchsorted(self._cy, ry + rh, side='right')
+        if lo >= hi:
+            return ""
+
+        cx = self._cx[lo:hi]
+        mask = (cx >= rx) & (cx <= rx + rw)
+        if not mask.any():
+            return ""
+        cx = cx[mask]
+        seq = self._seq[lo:hi][mask]
+        order = np.lexsort((seq, cx))
+        return "".join(self._chars[lo:hi][mask][order].tolist())
+
+    def extract_many(self, rois: list[dict]) -> list[str]:
+        """複数ROIのテキストをまとめて抽出"""
+        return [self.extract(roi) for roi in rois]
+
+
+def extract_texts(words_data, rois: dict[str, dict], index: Optional[WordIndex] = None) -> dict[str, str]:
+    """
+    {label: roi} の各ROIのテキストを抽出
+
+    同じページに対して繰り返し呼ぶ場合は index を渡すと索引の構築を省ける。
+    """
+    if index is None:
+        index = WordIndex(words_data)
+    return {label: index.extract(roi) for label, roi in rois.items()}
@@ -0,0 +1,113 @@
+"""WordIndex が従来の extract_text_from_roi と同じ文字列を返すことの確認"""
+import random
+
+import pytest
+
+from roi_index import WordIndex, extract_texts
+from wire_format import WordArrays, encode_words
+
+
+def extract_text_from_roi(words_data, roi):
+    """置き換え前の実装（wordごとのループ）"""
+    matched_chars = []
+    rx, ry, rw, rh = roi['x'], roi['y'], roi['w'], roi['h']
+    roi_x2, roi_y2 = rx + rw, ry + rh
+
+    for word in words_data:
+        points = word.get('points', [])
+        content = word.get('content', '')
+        if len(points) < 4 or not content:
+            continue
+
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        wx1, wy1 = min(xs), min(ys)
+        wx2, wy2 = max(xs), max(ys)
+
+        cy = (wy1 + wy2) / 2
+        if not (ry <= cy <= roi_y2):
+            continue
+
+        char_count = len(content)
+        word_width = wx2 - wx1
+        char_width = word_width / char_count if char_count > 0 else 0
+
+        for i, char in enumerate(content):
+            char_cx = wx1 + char_width * (i + 0.5)
+            if rx <= char_cx <= roi_x2:
+                matched_chars.append({"char": char, "x": char_cx})
+
+    matched_chars.sort(key=lambda k: k['x'])
+    return "".join([m['char'] for m in matched_chars])
+
+
+def random_words(rng: random.Random, n: int, integer: bool) -> list[dict]:
+    """同じ行・同じx位置に並ぶwordや不正なwordを含むwordsリスト"""
+    words = []
+    for i in range(n):
+        x = rng.randrange(0, 800, 20) if integer else rng.uniform(0, 800)
+        y = rng.randrange(0, 600, 30) if integer else rng.uniform(0, 600)
+        w = rng.randrange(10, 200, 10) if integer else rng.uniform(5, 200)
+        h = rng.choice([20, 30]) if integer else rng.uniform(10, 40)
+        content = "".join(rng.choice("0123456789円年月日合計¥,") for _ in range(rng.randint(0, 8)))
+        word = {"points": [[x, y], [x + w, y], [x + w, y + h], [x, y + h]], "content": content}
+        kind = rng.random()
+        if kind < 0.05:
+            word["points"] = []
+        elif kind < 0.1:
+            word["points"] = word["points"][:2]
+        elif kind < 0.13:
+            del word["points"]
+        words.append(word)
+    return words
+
+
+def random_rois(rng: random.Random, n: int) -> list[dict]:
+    return [
+        {"x": rng.randrange(0, 800, 10), "y": rng.randrange(0, 600, 15), "w": rng.randrange(0, 400, 10), "h": rng.randrange(0, 200, 15)}
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_strings_as_legacy_for_dicts(seed):
+    rng = random.Random(seed)
+    words = random_words(rng, 60, integer=seed % 2 == 0)
+    index = WordIndex(words)
+    for roi in random_rois(rng, 30):
+        assert index.extract(roi) == extract_text_from_roi(words, roi)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_strings_as_legacy_for_word_arrays(seed):
+    # 整数座標なら wire_format の丸めで位置は変わらない
+    rng = random.Random(seed)
+    words = random_words(rng, 60, integer=True)
+    index = WordIndex(WordArrays(encode_words(words)))
+    for roi in random_rois(rng, 30):
+        assert index.extract(roi) == extract_text_from_roi(words, roi)
+
+
+def test_word_arrays_skip_words_without_points():
+    words = [
+        {"points": [], "content": "999"},
+        {"points": [[0, 0], [0, 0]], "content": "888"},
+        {"points": [[10, 10], [40, 10], [40, 30], [10, 30]], "content": "123"},
+    ]
+    roi = {"x": 0, "y": 0, "w": 100, "h": 100}
+    assert extract_text_from_roi(words, roi) == "123"
+    assert WordIndex(WordArrays(encode_words(words))).extract(roi) == "123"
+
+
+def test_empty_words():
+    assert WordIndex([]).extract({"x": 0, "y": 0, "w": 10, "h": 10}) == ""
+    assert WordIndex(WordArrays(encode_words([]))).extract({"x": 0, "y": 0, "w": 10, "h": 10}) == ""
+
+
+def test_extract_texts_by_label():
+    words = [
+        {"points": [[0, 0], [30, 0], [30, 20], [0, 20]], "content": "abc"},
+        {"points": [[0, 50], [20, 50], [20, 70], [0, 70]], "content": "de"},
+    ]
+    rois = {"top": {"x": 0, "y": 0, "w": 100, "h": 30}, "bottom": {"x": 0, "y": 40, "w": 100, "h": 40}}
+    assert extract_texts(words, rois) == {"top": "abc", "bottom": "de"}
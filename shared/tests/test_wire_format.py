@@ -0,0 +1,100 @@
+"""列指向エンコードの往復（encode → pack → compress → decompress → unpack → expand）の確認"""
+import random
+
+import numpy as np
+import pytest
+
+import wire_format
+from wire_format import (
+    WIRE_FORMAT_VERSION, WordArrays, choose_encoding, compact_words, compress, decompress, encode_words,
+    expand_words, pack, supported_encodings, unpack,
+)
+
+
+def sample_words(seed: int = 0, n: int = 50) -> list[dict]:
+    """整数座標・float32で表せるスコアのwords（往復で値が変わらない）"""
+    rng = random.Random(seed)
+    words = []
+    for _ in range(n):
+        x, y = rng.randint(0, 2000), rng.randint(0, 3000)
+        w, h = rng.randint(1, 400), rng.randint(1, 80)
+        words.append({
+            "points": [[x, y], [x + w, y], [x + w, y + h], [x, y + h]],
+            "content": "".join(rng.choice("領収書¥0123456789,.-令和年月日 ABC") for _ in range(rng.randint(0, 12))),
+            "direction": rng.choice(["horizontal", "vertical"]),
+            "det_score": rng.randint(0, 1024) / 1024,
+            "rec_score": rng.randint(0, 1024) / 1024,
+        })
+    return words
+
+
+def round_trip(data, encoding, as_arrays=False):
+    body = compress(pack(compact_words(data)), encoding)
+    return expand_words(unpack(decompress(body, encoding)), as_arrays)
+
+
+@pytest.mark.parametrize("encoding", supported_encodings())
+def test_round_trip_equals_input(encoding):
+    words = sample_words()
+    response = {"status": "ok", "words": words, "results": [{"page": 1, "words": sample_words(1)}]}
+    assert round_trip(response, encoding) == response
+
+
+@pytest.mark.parametrize("encoding", supported_encodings())
+def test_round_trip_as_arrays(encoding):
+    words = sample_words()
+    arrays = round_trip({"words": words}, encoding, as_arrays=True)["words"]
+    assert isinstance(arrays, WordArrays)
+    assert len(arrays) == len(words)
+    assert arrays.contents == [w["content"] for w in words]
+    np.testing.assert_array_equal(arrays.points, np.array([w["points"] for w in words]))
+    assert arrays.to_dicts() == words
+
+
+def test_round_trip_rounds_coordinates_and_scores():
+    words = [{"points": [[1.4, 2.6], [10.5, 2.6], [10.5, 20.2], [1.4, 20.2]], "content": "a", "det_score": 0.9, "rec_score": 0.1}]
+    (word,) = round_trip({"words": words}, "gzip")["words"]
+    assert word["points"] == [[1, 3], [10, 3], [10, 20], [1, 20]]
+    assert word["det_score"] == pytest.approx(0.9, abs=1e-6)
+    assert word["rec_score"] == pytest.approx(0.1, abs=1e-6)
+    assert word["direction"] == "horizontal"
+
+
+def test_words_without_quad_come_back_without_points():
+    words = [
+        {"points": [], "content": "x", "direction": "horizontal", "det_score": 0.5, "rec_score": 0.5},
+        {"points": [[0, 0], [5, 5]], "content": "y", "direction": "horizontal", "det_score": 0.5, "rec_score": 0.5},
+    ]
+    assert [w["points"] for w in round_trip({"words": words}, "gzip")["words"]] == [[], []]
+
+
+def test_empty_words():
+    assert round_trip({"words": []}, "gzip") == {"words": []}
+
+
+def test_unknown_version_is_rejected():
+    columns = encode_words(sample_words(n=3))
+    columns["version"] = WIRE_FORMAT_VERSION + 1
+    with pytest.raises(ValueError):
+        WordArrays(columns)
+
+
+def test_columns_without_version_decode_as_version_1():
+    words = sample_words(n=3)
+    columns = encode_words(words)
+    del columns["version"]
+    assert WordArrays(columns).to_dicts() == words
+
+
+def test_decompress_passes_through_already_decoded_body():
+    body = pack({"a": 1})
+    assert decompress(body, "gzip") == body
+    assert decompress(body, "zstd") == body
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding(None) is None
+    if wire_format.zstandard is not None:
+        assert choose_encoding("gzip, zstd") == "zstd"
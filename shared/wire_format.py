@@ -0,0 +1,188 @@
+"""OCR結果のコンパクトな列指向エンコード（msgpack + NumPyバッファ）と応答圧縮（フロントエンド・サーバー共通）
+
+wordsリスト（dictのリスト）を次の列に変換する。数値列はリトルエンディアンの生バッファ。
+    version:   列の形式のバージョン（WIRE_FORMAT_VERSION。ないものは1）
+    count:     word数 n
+    points:    int32 (n, 4, 2) 四角形の頂点座標（頂点が4つでないwordはすべて0）
+    content:   全wordの文字列をUTF-8で連結したもの
+    offsets:   int32 (n + 1) content 内の各wordの開始バイト位置
+    det_score: float32 (n)
+    rec_score: float32 (n)
+    direction: uint8 (n) 0=horizontal, 1=vertical
+"""
+import gzip
+from typing import Optional
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 任意依存
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 任意依存
+    zstandard = None
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DIRECTIONS = ("horizontal", "vertical")
+# 列の形式を変えたら上げる（デコード側は知らないバージョンを例外にする）
+WIRE_FORMAT_VERSION = 1
+
+
+def encode_words(words: list) -> dict:
+    """wordsリストを列指向のdictに変換"""
+    n = len(words)
+    points = np.zeros((n, 4, 2), dtype="<i4")
+    encoded = []
+    det_scores = np.zeros(n, dtype="<f4")
+    rec_scores = np.zeros(n, dtype="<f4")
+    directions = np.zeros(n, dtype=np.uint8)
+    for i, word in enumerate(words):
+        quad = word.get("points") or []
+        if len(quad) == 4:
+            points[i] = np.rint(np.asarray(quad, dtype=np.float64))
+        encoded.append((word.get("content") or "").encode("utf-8"))
+        det_scores[i] = word.get("det_score") or 0.0
+        rec_scores[i] = word.get("rec_score") or 0.0
+        directions[i] = word.get("direction") == "vertical"
+    offsets = np.zeros(n + 1, dtype="<i4")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return {
+        "version": WIRE_FORMAT_VERSION,
+        "count": n,
+        "points": points.tobytes(),
+        "content": b"".join(encoded),
+        "offsets": offsets.tobytes(),
+        "det_score": det_scores.tobytes(),
+        "rec_score": rec_scores.tobytes(),
+        "direction": directions.tobytes(),
+    }
+
+
+class WordArrays:
+    """列指向でデコードしたwords（NumPy配列のまま保持し、必要な時だけdictに戻す）"""
+
+    def __init__(self, columns: dict):
+        version = columns.get("version", 1)
+        if version != WIRE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported word column format version: {version} (expected {WIRE_FORMAT_VERSION})")
+        n = columns["count"]
+        self.points = np.frombuffer(columns["points"], dtype="<i4").reshape(n, 4, 2)
+        self.offsets = np.frombuffer(columns["offsets"], dtype="<i4")
+        self.det_scores = np.frombuffer(columns["det_score"], dtype="<f4")
+        self.rec_scores = np.frombuffer(columns["rec_score"], dtype="<f4")
+        self.directions = np.frombuffer(columns["direction"], dtype=np.uint8)
+        self._content = columns["content"]
+        self._contents: Optional[list[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @property
+    def contents(self) -> list[str]:
+        """各wordの文字列"""
+        if self._contents is None:
+            data = self._content
+            offsets = self.offsets.tolist()
+            self._contents = [data[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+        return self._contents
+
+    def to_dicts(self) -> list[dict]:
+        """従来のwordsリスト形式に戻す（頂点のないwordの points は空リスト）"""
+        has_points = self.points.any(axis=(1, 2)).tolist()
+        return [
+            {
+                "points": quad if has_quad else [],
+                "content": content,
+                "direction": DIRECTIONS[direction],
+                "det_score": det,
+                "rec_score": rec,
+            }
+            for quad, has_quad, content, direction, det, rec in zip(
+                self.points.tolist(), has_points, self.contents, self.directions.tolist(),
+                self.det_scores.tolist(), self.rec_scores.tolist(),
+            )
+        ]
+
+
+def is_word_columns(value) -> bool:
+    return isinstance(value, dict) and "count" in value and isinstance(value.get("points"), bytes)
+
+
+def compact_words(data):
+    """応答dict内の "words" をすべて列指向に置き換える（ネストしたresultsも含む）"""
+    if isinstance(data, dict):
+        return {
+            key: encode_words(value) if key == "words" and isinstance(value, list) else compact_words(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [compact_words(item) for item in data]
+    return data
+
+
+def expand_words(data, as_arrays: bool = True):
+    """compact_words の逆変換（as_arrays=False なら従来のdictのリストに戻す）"""
+    if is_word_columns(data):
+        arrays = WordArrays(data)
+        return arrays if as_arrays else arrays.to_dicts()
+    if isinstance(data, dict):
+        return {key: expand_words(value, as_arrays) for key, value in data.items()}
+    if isinstance(data, list):
+        return [expand_words(item, as_arrays) for item in data]
+    return data
+
+
+def pack(data) -> bytes:
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def unpack(body: bytes):
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.unpackb(body, raw=False)
+
+
+def accepts_msgpack(accept: Optional[str]) -> bool:
+    """Accept ヘッダーがコンパクト形式を求めているか（msgpack未導入ならJSONのまま）"""
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in (accept or "")
+
+
+def supported_encodings() -> list[str]:
+    """この環境で使える応答圧縮（優先順）"""
+    return (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Accept-Encoding から使う圧縮方式を選ぶ（q=0 は除外）"""
+    offered = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        offered.add(name.strip().lower())
+    for encoding in supported_encodings():
+        if encoding in offered:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    # 速度優先（LAN内の転送量を減らすのが目的で、圧縮率より遅延を重視）
+    return gzip.compress(body, compresslevel=1)
+
+
+def decompress(body: bytes, encoding: Optional[str]) -> bytes:
+    """HTTPライブラリが展開しなかった圧縮を展開（既に展開済みならそのまま）"""
+    if encoding == "zstd" and body[:4] == ZSTD_MAGIC:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding == "gzip" and body[:2] == b"\x1f\x8b":
+        return gzip.decompress(body)
+    return body